@@ -0,0 +1,151 @@
+"""
+MarmoView - Controle de admissão e limites por cliente
+- TokenBucketLimiter: balde de fichas por cliente (taxa sustentada + rajada);
+  acima do limite a requisição recebe 429 na hora
+- AdmissionGate: no máximo N execuções simultâneas, com uma fila curta de
+  espera com prazo; fila cheia ou prazo esgotado viram 503 na hora
+
+Limites valem por processo (cada worker tem os seus).
+"""
+
+import math
+import threading
+import time
+
+
+class RateLimited(Exception):
+    """Cliente acima do seu limite de requisições (HTTP 429)"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Limite de requisições excedido, tente em {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """Servidor sem capacidade para admitir a requisição (HTTP 503)"""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """
+    Balde de fichas por cliente: `rate` fichas por segundo, até `burst`
+    acumuladas. rate=0 desativa o limite.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._buckets = {}  # cliente -> (fichas, instante da última recarga)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def take(self, client):
+        """Consome uma ficha do cliente; RateLimited se o balde estiver vazio"""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[client] = (tokens, now)
+                self.rejected += 1
+                raise RateLimited(max(1, math.ceil((1 - tokens) / self.rate)))
+            self._buckets[client] = (tokens - 1, now)
+            if len(self._buckets) > 10000:
+                self._prune(now)
+
+    def _prune(self, now):
+        # Baldes cheios há tempo suficiente equivalem a baldes novos
+        full_after = self.burst / self.rate
+        self._buckets = {c: (t, last) for c, (t, last) in self._buckets.items()
+                         if now - last < full_after}
+
+    def stats(self):
+        return {'rate': self.rate, 'burst': self.burst,
+                'clients': len(self._buckets), 'rejected': self.rejected}
+
+
+class AdmissionGate:
+    """
+    Semáforo com fila limitada. `acquire` entra na hora se houver vaga; senão
+    espera na fila (até `queue_size` requisições, por até `queue_timeout`
+    segundos) e levanta Overloaded quando a fila está cheia ou o prazo acaba.
+    limit=0 desativa o limite.
+    """
+
+    def __init__(self, limit, queue_size=0, queue_timeout=0.0, name='gate'):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.name = name
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._hold_avg = 5.0  # média móvel do tempo de ocupação (s)
+        self.admitted = 0
+        self.rejected = 0
+
+    def _retry_after(self):
+        # Estimativa: a fila atual escoando pelas vagas no tempo médio de ocupação
+        waves = (self._waiting + 1) / max(self.limit, 1)
+        return max(1, min(60, math.ceil(self._hold_avg * waves)))
+
+    def try_acquire(self):
+        """Ocupa uma vaga sem esperar; retorna o instante de entrada ou None"""
+        with self._cond:
+            if self.limit > 0 and self._active >= self.limit:
+                self.rejected += 1
+                return None
+            self._active += 1
+            self.admitted += 1
+            return time.monotonic()
+
+    def acquire(self):
+        """Ocupa uma vaga (esperando na fila); retorna o instante de entrada"""
+        with self._cond:
+            if self.limit <= 0 or self._active < self.limit:
+                self._active += 1
+                self.admitted += 1
+                return time.monotonic()
+            if self._waiting >= self.queue_size:
+                self.rejected += 1
+                raise Overloaded(self._retry_after(), f"{self.name}: fila cheia")
+
+            self._waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if self._active < self.limit:
+                            break
+                        self.rejected += 1
+                        raise Overloaded(self._retry_after(), f"{self.name}: tempo de espera esgotado")
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            self.admitted += 1
+            return time.monotonic()
+
+    def release(self, started=None):
+        """Libera a vaga; `started` (de acquire) alimenta a estimativa de Retry-After"""
+        with self._cond:
+            self._active -= 1
+            if started is not None:
+                self._hold_avg = 0.8 * self._hold_avg + 0.2 * (time.monotonic() - started)
+            self._cond.notify()
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self._active,
+            'waiting': self._waiting,
+            'queue_size': self.queue_size,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'avg_hold_seconds': round(self._hold_avg, 2),
+        }
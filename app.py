@@ -1,60 +1,467 @@
 #!/usr/bin/env python3
 """
 MarmoView Backend - Sistema de Upload e Geração de Desenhos
-Sem persistência: dados são mantidos apenas em memória durante execução
+Sessões e blobs (fotos, desenhos, PDFs) ficam em memória por padrão e se
+perdem ao reiniciar; SESSION_BACKEND=sqlite/redis e BLOB_BACKEND=disk os
+persistem e compartilham entre workers (session_store.py, blob_store.py)
 """
 
-from flask import Flask, request, jsonify, send_file
+import time
+_startup_started = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify, send_file, g
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.datastructures import MultiDict
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 import os
 import io
 import base64
 from datetime import datetime
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.units import cm
-from PIL import Image, ImageDraw, ImageFont
+from urllib.parse import urlsplit
+from PIL import Image, ImageOps
+import tempfile
 import uuid
 import json
-import requests
+import hashlib
+import hmac
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import importlib
+from image_prep import build_contact_sheet, score_image, rank_images
+from blob_store import create_blob_store
+from session_store import create_session_store
+from async_core import AsyncCore
+from render_pool import RenderPool, RenderQueueFull, RenderTimeout
+from admission import AdmissionGate, Overloaded, RateLimited, TokenBucketLimiter
+from metrics import Metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import tracing
+from providers import ProviderRegistry
+from zip_stream import ZipStream
+from chunked_upload import UploadError, UploadSpool
+from rendering import build_scene
+from scene import preload_fonts, render_svg, scene_json, changed_layers as scene_changed_layers
 
 # Carrega variáveis de ambiente do arquivo .env
 from dotenv import load_dotenv
 load_dotenv()
 print("[CONFIG] Arquivo .env carregado")
 
-# Importar cliente OpenAI (usaremos mock se não estiver configurado)
-try:
-    from openai import OpenAI
-    openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY', ''))
-    HAS_OPENAI = bool(os.getenv('OPENAI_API_KEY'))
-except:
-    HAS_OPENAI = False
-    openai_client = None
-
-# Importar cliente Anthropic (Claude Vision)
-try:
+# Clientes dos provedores: cada SDK só é importado no primeiro uso (providers.py)
+def _anthropic_client():
     from anthropic import Anthropic
-    anthropic_client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY', ''))
-    HAS_CLAUDE_VISION = bool(os.getenv('ANTHROPIC_API_KEY'))
-except:
-    HAS_CLAUDE_VISION = False
-    anthropic_client = None
+    return Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY', ''))
+
+def _openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv('OPENAI_API_KEY', ''))
+
+def _gradio_client_class():
+    from gradio_client import Client
+    return Client
+
+providers = ProviderRegistry()
+providers.register('anthropic', _anthropic_client)
+providers.register('openai', _openai_client)
+providers.register('gradio', _gradio_client_class, module='gradio_client')
+providers.register('http', lambda: importlib.import_module('requests'), module='requests')
+
+# OpenAI (DALL-E) e Claude Vision: ativos com a chave configurada e o SDK instalado
+HAS_OPENAI = bool(os.getenv('OPENAI_API_KEY')) and providers.installed('openai')
+HAS_CLAUDE_VISION = bool(os.getenv('ANTHROPIC_API_KEY')) and providers.installed('anthropic')
+
+class MarmoJSONProvider(DefaultJSONProvider):
+    """Bytes nunca são serializados nas respostas JSON: saem só com o tamanho"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (bytes, bytearray, memoryview)):
+            return {'bytes': memoryview(o).nbytes}
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__, static_folder='.', static_url_path='')
+app.json = MarmoJSONProvider(app)
 CORS(app)
 
-# Armazenamento temporário em memória
-# Quando o servidor reinicia, tudo é perdido
-session_data = {}
+# Atrás de proxy reverso: TRUSTED_PROXY_HOPS proxies confiáveis na frente do app.
+# O IP do cliente (usado nos limites por cliente) vem do X-Forwarded-For
+# escrito por eles; sem proxy, o header é ignorado e vale o IP da conexão.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+if TRUSTED_PROXY_HOPS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+# Métricas por etapa, provedor e cache (formato Prometheus em /metrics)
+metrics = Metrics()
+
+# Trace por requisição (header Server-Timing) no upload, geração e PDF; os
+# traces acima de TRACE_SLOW_SECONDS ficam nos últimos TRACE_BUFFER_SIZE
+# de /api/admin/slow-traces (só com ADMIN_TOKEN definido)
+TRACED_ENDPOINTS = {'upload_files', 'finalize_upload', 'generate_drawing', 'generate_pdf'}
+slow_traces = tracing.SlowTraceLog(threshold=float(os.getenv('TRACE_SLOW_SECONDS', '5')),
+                                   size=int(os.getenv('TRACE_BUFFER_SIZE', '100')))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+if not ADMIN_TOKEN:
+    print("[Admin] ⚠️ ADMIN_TOKEN não definido: rotas de administração desativadas")
+
+# Aquecimento na inicialização (em segundo plano): fontes, layouts, um desenho e
+# um PDF de teste e, com WARMUP_PROVIDERS, conexões com os provedores
+# configurados. /api/ready só responde 200 depois dele.
+WARMUP = os.getenv('WARMUP', '1').lower() in ('1', 'true', 'sim')
+WARMUP_PROVIDERS = os.getenv('WARMUP_PROVIDERS', '1').lower() in ('1', 'true', 'sim')
+WARMUP_PROVIDER_TIMEOUT = float(os.getenv('WARMUP_PROVIDER_TIMEOUT', '10'))
+
+# Sessões expiram após este tempo sem uso (libera memória e cancela análises pendentes)
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '7200'))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '60'))
+
+# Armazenamento das sessões (só metadados). Padrão: memória do processo, e
+# quando o servidor reinicia, tudo é perdido. SESSION_BACKEND=sqlite ou redis
+# compartilha as sessões entre vários processos/nós (gunicorn -w N).
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+session_data = create_session_store(SESSION_BACKEND, ttl=SESSION_TTL_SECONDS)
+
+# Imagens e artefatos (PNG do desenho, PDF) endereçados por conteúdo (SHA-256):
+# as sessões guardam só o digest e uploads idênticos compartilham o mesmo buffer.
+# BLOB_BACKEND=disk grava os blobs em BLOB_SPOOL_DIR e mantém só metadados em memória.
+BLOB_BACKEND = os.getenv('BLOB_BACKEND', 'memory')
+blob_store = create_blob_store(BLOB_BACKEND, os.getenv('BLOB_SPOOL_DIR'))
+blob_store.prune(session_data.ids())  # referências órfãs de execuções anteriores
+if SESSION_BACKEND != 'memory' and BLOB_BACKEND == 'memory':
+    print("[CONFIG] ⚠️ Sessões compartilhadas com blobs em memória: use BLOB_BACKEND=disk")
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Uploads retomáveis (/api/uploads): pedaços gravados em UPLOAD_SPOOL_DIR,
+# de até UPLOAD_CHUNK_MAX bytes; uploads parados há UPLOAD_TTL_SECONDS são apagados
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+UPLOAD_CHUNK_MAX = int(os.getenv('UPLOAD_CHUNK_MAX', str(8 * 1024 * 1024)))
+UPLOAD_TTL_SECONDS = int(os.getenv('UPLOAD_TTL_SECONDS', '86400'))
+upload_spool = UploadSpool(os.getenv('UPLOAD_SPOOL_DIR') or None, max_files=5,
+                           max_file_size=MAX_FILE_SIZE)
+
+# Hugging Face: a foto de entrada vai reduzida a HF_INPUT_MAX_SIDE px no maior
+# lado (o tamanho de entrada dos modelos img2img) e imagens geradas acima de
+# HF_MAX_RESULT_BYTES são descartadas
+HF_INPUT_MAX_SIDE = int(os.getenv('HF_INPUT_MAX_SIDE', '768'))
+HF_MAX_RESULT_BYTES = 20 * 1024 * 1024
+
+# Folha de contato: envia as fotos ao Claude como uma única imagem em mosaico
+CLAUDE_CONTACT_SHEET = os.getenv('CLAUDE_CONTACT_SHEET', '').lower() in ('1', 'true', 'sim')
+CONTACT_SHEET_MAX_IMAGES = 5
+
+# Análise especulativa: inicia a análise do Claude já no upload, em segundo plano
+SPECULATIVE_ANALYSIS = os.getenv('SPECULATIVE_ANALYSIS', '').lower() in ('1', 'true', 'sim')
+SPECULATIVE_MAX_WORKERS = int(os.getenv('SPECULATIVE_MAX_WORKERS', '4'))
+SPECULATIVE_PER_TENANT = int(os.getenv('SPECULATIVE_PER_TENANT', '2'))
+SPECULATIVE_WAIT_SECONDS = int(os.getenv('SPECULATIVE_WAIT_SECONDS', '120'))
+
+# Modo assíncrono: E/S com os provedores num único event loop (clientes async)
+ASYNC_PROVIDERS = os.getenv('ASYNC_PROVIDERS', '').lower() in ('1', 'true', 'sim')
+async_core = AsyncCore()
+
+# Pool de processos para renderizar desenho (PIL) e PDF (reportlab).
+# RENDER_POOL_SIZE=0 (padrão) renderiza na própria thread da requisição.
+RENDER_POOL_SIZE = int(os.getenv('RENDER_POOL_SIZE', '0'))
+render_pool = RenderPool(size=RENDER_POOL_SIZE,
+                         queue_depth=int(os.getenv('RENDER_QUEUE_DEPTH', '0')) or None,
+                         queue_timeout=float(os.getenv('RENDER_QUEUE_TIMEOUT', '30')),
+                         render_timeout=float(os.getenv('RENDER_TIMEOUT', '60')))
+render_pool.start()
+
+# Exportação em lote (ZIP): PNG/PDF das sessões preparados em EXPORT_WORKERS
+# threads (que usam o pool de renderização, se configurado), até
+# EXPORT_MAX_SESSIONS sessões por arquivo
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '4'))
+EXPORT_MAX_SESSIONS = int(os.getenv('EXPORT_MAX_SESSIONS', '500'))
+
+# Revisões incrementais: versões mantidas no histórico de cada sessão
+REVISION_HISTORY_LIMIT = int(os.getenv('REVISION_HISTORY_LIMIT', '50'))
+
+# Idempotency-Key (upload e geração): validade da resposta guardada e quanto
+# uma repetição espera pela requisição original ainda em andamento
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+# Single-flight da geração: após este prazo a marca 'generating' de outro
+# worker é considerada abandonada
+GENERATION_FLIGHT_TIMEOUT = int(os.getenv('GENERATION_FLIGHT_TIMEOUT', '300'))
+
+# Controle de admissão das gerações (limites por processo):
+# - balde de fichas por cliente: GENERATION_RATE gerações/s, rajada de GENERATION_BURST (429)
+# - até GENERATION_MAX_CONCURRENT gerações simultâneas; as excedentes esperam
+#   numa fila de GENERATION_QUEUE_SIZE por até GENERATION_QUEUE_TIMEOUT s (503)
+# - até PROVIDER_MAX_CONCURRENT chamadas simultâneas a DALL-E/Hugging Face;
+#   acima disso a geração usa o desenho local na hora
+generation_limiter = TokenBucketLimiter(rate=float(os.getenv('GENERATION_RATE', '1')),
+                                        burst=int(os.getenv('GENERATION_BURST', '20')))
+generation_gate = AdmissionGate(limit=int(os.getenv('GENERATION_MAX_CONCURRENT', '16')),
+                                queue_size=int(os.getenv('GENERATION_QUEUE_SIZE', '32')),
+                                queue_timeout=float(os.getenv('GENERATION_QUEUE_TIMEOUT', '10')),
+                                name='geração')
+provider_gate = AdmissionGate(limit=int(os.getenv('PROVIDER_MAX_CONCURRENT', '8')),
+                              name='provedores')
+
+analysis_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_MAX_WORKERS,
+                                       thread_name_prefix='analise')
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='exportacao')
+# ?mode=async sem ASYNC_PROVIDERS: a geração síncrona roda numa destas threads
+# (uma por vaga do generation_gate)
+generation_executor = ThreadPoolExecutor(max_workers=generation_gate.limit or None,
+                                         thread_name_prefix='geracao')
+_speculative_lock = threading.Lock()
+_speculative_by_tenant = {}
+# Futures das análises especulativas deste processo: session_id -> (future, cancel)
+_speculative_jobs = {}
+# Gerações em andamento neste processo: (session_id, entradas) -> Future
+_generation_lock = threading.Lock()
+_generation_flights = {}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def client_tenant():
+    """
+    Identifica o cliente para limites por cliente: o IP da conexão (ou o
+    resolvido pelos proxies confiáveis). Headers enviados pelo próprio
+    cliente, como X-Tenant-Id, não são autenticados e não contam.
+    """
+    return request.remote_addr or 'anon'
+
+def request_fingerprint(*parts):
+    """SHA-256 de partes serializáveis em JSON (identifica uma requisição)"""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray)):
+            h.update(part)
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+def stream_sha256(stream, chunk_size=64 * 1024):
+    """SHA-256 do stream lido em blocos (hashlib.file_digest só existe a partir do 3.11)"""
+    h = hashlib.sha256()
+    for piece in iter(lambda: stream.read(chunk_size), b''):
+        h.update(piece)
+    return h.hexdigest()
+
+def idempotency_key(scope):
+    """Chave de armazenamento da Idempotency-Key da requisição (None se ausente)"""
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if not key:
+        return None
+    return f"idem:{scope}:{client_tenant()}:{key[:200]}"
+
+def claim_idempotency(key, fingerprint, **fields):
+    """
+    Reserva a Idempotency-Key. Retorna (None, registro) se esta requisição é a
+    original e deve executar; senão (resposta, None): a resposta guardada da
+    original, 409 se ela ainda não terminou ou 422 se a chave foi reutilizada
+    com outro conteúdo.
+    """
+    record = {'state': 'pending', 'fingerprint': fingerprint,
+              'request_id': uuid.uuid4().hex, **fields}
+    stored = session_data.claim_key(key, record, IDEMPOTENCY_TTL_SECONDS)
+    if stored['request_id'] == record['request_id']:
+        return None, record
+    
+    if stored['fingerprint'] != fingerprint:
+        return (jsonify({'error': 'Idempotency-Key já usada com outra requisição'}), 422), None
+    
+    # Repetição: espera a original terminar (ela pode estar em outro worker)
+    deadline = time.time() + IDEMPOTENCY_WAIT_SECONDS
+    with tracing.span('idempotency_wait'):
+        while stored is not None and stored['state'] == 'pending' and time.time() < deadline:
+            time.sleep(0.2)
+            stored = session_data.get_key(key)
+    if stored is None:
+        # A original falhou e liberou a chave: esta passa a ser a original
+        return claim_idempotency(key, fingerprint, **fields)
+    if stored['state'] == 'pending':
+        response = jsonify({'error': 'Requisição original ainda em andamento'})
+        response.headers['Retry-After'] = '1'
+        return (response, 409), None
+    
+    print(f"[Idempotência] Repetição atendida com a resposta original ({key[:40]}...)")
+    metrics.cache('idempotency_replay', True)
+    response = jsonify(stored['response'])
+    response.status_code = stored['status']
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response, None
+
+def complete_idempotency(key, record, payload, status):
+    """Guarda a resposta da requisição original para as repetições"""
+    if status < 400:
+        session_data.set_key(key, dict(record, state='done', response=payload, status=status),
+                             IDEMPOTENCY_TTL_SECONDS)
+    else:
+        # Erros não ficam gravados: a repetição executa de novo
+        session_data.delete_key(key)
+
+def evict_session(session_id):
+    """Remove a sessão e cancela a análise especulativa pendente, se houver"""
+    session_data.delete(session_id)
+    blob_store.release(session_id)
+    job = _speculative_jobs.pop(session_id, None)
+    if job is not None:
+        future, cancel = job
+        cancel.set()
+        future.cancel()
+
+_sweep_lock = threading.Lock()
+_last_sweep = 0.0
+
+def evict_expired_sessions():
+    """
+    Expira sessões sem uso há mais de SESSION_TTL_SECONDS. Chamada nos uploads,
+    mas varre no máximo a cada SESSION_SWEEP_INTERVAL segundos (e um upload
+    por vez; os demais seguem sem esperar)
+    """
+    global _last_sweep
+    if SESSION_TTL_SECONDS <= 0 or time.time() - _last_sweep < SESSION_SWEEP_INTERVAL:
+        return
+    if not _sweep_lock.acquire(blocking=False):
+        return
+    try:
+        if time.time() - _last_sweep < SESSION_SWEEP_INTERVAL:
+            return
+        _last_sweep = time.time()
+        for session_id in session_data.expired(time.time() - SESSION_TTL_SECONDS):
+            print(f"[Sessão] Expirando {session_id[:8]}")
+            evict_session(session_id)
+    finally:
+        _sweep_lock.release()
+
+def _run_speculative_analysis(session_id, images, form, cancel):
+    """
+    Executa a análise em segundo plano, a menos que a sessão já tenha expirado.
+    O resultado também vai para a sessão, para outros workers reaproveitarem.
+    """
+    if cancel.is_set():
+        return None
+    ai_analysis = analyze_images_with_claude(images, form)
+    if ai_analysis is not None and not cancel.is_set():
+        session_data.update(session_id, {'speculative_analysis': ai_analysis})
+    return ai_analysis
+
+async def _run_speculative_analysis_async(session_id, images, form, cancel):
+    """Versão assíncrona de _run_speculative_analysis"""
+    if cancel.is_set():
+        return None
+    ai_analysis = await analyze_images_async(images, form)
+    if ai_analysis is not None and not cancel.is_set():
+        await async_core.offload(session_data.update, session_id,
+                                 {'speculative_analysis': ai_analysis})
+    return ai_analysis
+
+def start_speculative_analysis(session_id, tenant):
+    """
+    Dispara a análise do Claude logo após o upload e guarda o future na sessão.
+    Respeita o limite de análises simultâneas por tenant; acima dele, a análise
+    fica para o generate-drawing (comportamento normal).
+    """
+    if not (SPECULATIVE_ANALYSIS and HAS_CLAUDE_VISION):
+        return False
+    
+    with _speculative_lock:
+        if _speculative_by_tenant.get(tenant, 0) >= SPECULATIVE_PER_TENANT:
+            print(f"[Especulativa] Limite do tenant {tenant} atingido, análise adiada")
+            return False
+        _speculative_by_tenant[tenant] = _speculative_by_tenant.get(tenant, 0) + 1
+    
+    def _finished(future):
+        with _speculative_lock:
+            remaining = _speculative_by_tenant.get(tenant, 1) - 1
+            if remaining > 0:
+                _speculative_by_tenant[tenant] = remaining
+            else:
+                _speculative_by_tenant.pop(tenant, None)
+            # Ninguém reivindicou: o resultado já está na sessão e o future não serve mais
+            if _speculative_jobs.get(session_id, (None, None))[0] is future:
+                del _speculative_jobs[session_id]
+    
+    data = session_data.get(session_id)
+    cancel = threading.Event()
+    if ASYNC_PROVIDERS:
+        future = async_core.submit(_run_speculative_analysis_async(
+            session_id, ranked_images(data), data['form'], cancel))
+    else:
+        future = analysis_executor.submit(_run_speculative_analysis, session_id,
+                                          ranked_images(data), data['form'], cancel)
+    # Registrado antes do callback, que roda na hora se a análise já terminou
+    _speculative_jobs[session_id] = (future, cancel)
+    future.add_done_callback(_finished)
+    print(f"[Especulativa] Análise iniciada para sessão {session_id[:8]}")
+    return True
+
+def take_analysis(session_id, data):
+    """
+    Retorna a análise da sessão: reaproveita a análise especulativa (concluída
+    por qualquer worker, ou em andamento neste) ou, se não houver (ou falhar),
+    chama o Claude normalmente.
+    """
+    ai_analysis = data.pop('speculative_analysis', None)
+    if ai_analysis is not None:
+        print("[Especulativa] ✓ Análise reaproveitada do upload")
+        metrics.cache('speculative_analysis', True)
+        _speculative_jobs.pop(session_id, None)
+        return ai_analysis
+    
+    future, _cancel = _speculative_jobs.pop(session_id, (None, None))
+    if future is None and SPECULATIVE_ANALYSIS:
+        # Concluída depois que `data` foi lido: o resultado só está na sessão gravada
+        ai_analysis = (session_data.get(session_id) or {}).get('speculative_analysis')
+        if ai_analysis is not None:
+            print("[Especulativa] ✓ Análise reaproveitada do upload")
+            metrics.cache('speculative_analysis', True)
+            return ai_analysis
+    if future is not None and not future.cancelled():
+        try:
+            with tracing.span('speculative_wait'):
+                ai_analysis = future.result(timeout=SPECULATIVE_WAIT_SECONDS)
+            if ai_analysis is not None:
+                print("[Especulativa] ✓ Análise reaproveitada do upload")
+                metrics.cache('speculative_analysis', True)
+                return ai_analysis
+        except Exception as e:
+            print(f"[Especulativa] ⚠️ Falhou, refazendo análise: {e}")
+    if SPECULATIVE_ANALYSIS:
+        metrics.cache('speculative_analysis', False)
+    return analyze_images_with_claude(ranked_images(data), data['form'])
+
+async def take_analysis_async(session_id, data):
+    """Versão assíncrona de take_analysis (aguarda o future sem bloquear o loop)"""
+    ai_analysis = data.pop('speculative_analysis', None)
+    if ai_analysis is not None:
+        print("[Especulativa] ✓ Análise reaproveitada do upload")
+        metrics.cache('speculative_analysis', True)
+        _speculative_jobs.pop(session_id, None)
+        return ai_analysis
+    
+    future, _cancel = _speculative_jobs.pop(session_id, (None, None))
+    if future is None and SPECULATIVE_ANALYSIS:
+        stored = await async_core.offload(session_data.get, session_id)
+        ai_analysis = (stored or {}).get('speculative_analysis')
+        if ai_analysis is not None:
+            print("[Especulativa] ✓ Análise reaproveitada do upload")
+            metrics.cache('speculative_analysis', True)
+            return ai_analysis
+    if future is not None and not future.cancelled():
+        try:
+            with tracing.span('speculative_wait'):
+                ai_analysis = await asyncio.wait_for(asyncio.wrap_future(future),
+                                                     SPECULATIVE_WAIT_SECONDS)
+            if ai_analysis is not None:
+                print("[Especulativa] ✓ Análise reaproveitada do upload")
+                metrics.cache('speculative_analysis', True)
+                return ai_analysis
+        except Exception as e:
+            print(f"[Especulativa] ⚠️ Falhou, refazendo análise: {e}")
+    if SPECULATIVE_ANALYSIS:
+        metrics.cache('speculative_analysis', False)
+    return await analyze_images_async(ranked_images(data), data['form'])
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
@@ -74,107 +481,480 @@ def upload_files():
     if len(files) > 5:
         return jsonify({'error': 'Máximo de 5 imagens permitido'}), 400
     
-    # Gera ID único para esta sessão
-    session_id = str(uuid.uuid4())
+    evict_expired_sessions()
+    
+    # Idempotency-Key: repetições do mesmo upload recebem a mesma sessão
+    key = idempotency_key('upload')
+    if key is None:
+        payload, status = store_upload(str(uuid.uuid4()), files)
+        return jsonify(payload), status
+    
+    contents = []
+    for file in files:
+        contents.append(file.filename or '')
+        contents.append(stream_sha256(file.stream))
+        file.stream.seek(0)
+    fingerprint = request_fingerprint(contents, sorted(request.form.items(multi=True)))
+    
+    replay, record = claim_idempotency(key, fingerprint, session_id=str(uuid.uuid4()))
+    if replay is not None:
+        return replay
+    try:
+        payload, status = store_upload(record['session_id'], files)
+    except Exception:
+        session_data.delete_key(key)
+        raise
+    complete_idempotency(key, record, payload, status)
+    return jsonify(payload), status
+
+# --- Uploads retomáveis ---
+# POST   /api/uploads                        declara as fotos: {"files": [{"filename", "size", "sha256"?}], "form": {...}}
+# PUT    /api/uploads/<id>/files/<i>?offset=N  corpo com os bytes do pedaço (X-Chunk-Sha256 opcional)
+# GET    /api/uploads/<id>                   faixas recebidas e faltantes de cada foto
+# POST   /api/uploads/<id>/finalize          cria a sessão (mesma resposta de /api/upload)
+# DELETE /api/uploads/<id>                   desiste do upload
+
+def upload_form(form):
+    """
+    Formulário de um upload retomável, com os mesmos campos de /api/upload:
+    textos, e listas de textos em stoneElements/cutouts. ValueError se inválido.
+    """
+    if form is None:
+        return {}
+    if not isinstance(form, dict):
+        raise ValueError("'form' deve ser um objeto")
+    checked = {}
+    for field, value in form.items():
+        if field not in REVISION_FIELDS:
+            raise ValueError(f"Campo desconhecido no formulário: {field}")
+        if field in REVISION_LIST_FIELDS:
+            values = value if isinstance(value, list) else [value]
+            if not all(isinstance(v, str) for v in values):
+                raise ValueError(f"'{field}' deve ser texto ou lista de textos")
+            checked[field] = values
+        elif isinstance(value, str):
+            checked[field] = value
+        else:
+            raise ValueError(f"'{field}' deve ser texto")
+    return checked
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    """Inicia um upload retomável"""
+    payload = request.get_json(silent=True) or {}
+    files = payload.get('files')
+    for file in files if isinstance(files, list) else []:
+        if not isinstance(file, dict) or not allowed_file(str(file.get('filename') or '')):
+            return jsonify({'error': 'Apenas imagens PNG ou JPEG são aceitas'}), 400
+    
+    removed = upload_spool.expire(time.time() - UPLOAD_TTL_SECONDS)
+    if removed:
+        print(f"[Upload] {removed} upload(s) retomável(is) expirado(s)")
+    
+    try:
+        form = upload_form(payload.get('form'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    upload = upload_spool.create(files, form)
+    upload['chunk_size'] = UPLOAD_CHUNK_SIZE
+    upload['chunk_max'] = UPLOAD_CHUNK_MAX
+    return jsonify(upload), 201
+
+@app.route('/api/uploads/<upload_id>/files/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """Recebe um pedaço de uma foto, gravado direto no spool (sem bufferizar o corpo)"""
+    length = request.content_length
+    if not length:
+        return jsonify({'error': 'Content-Length obrigatório'}), 411
+    if length > UPLOAD_CHUNK_MAX:
+        return jsonify({'error': f'Pedaço acima de {UPLOAD_CHUNK_MAX} bytes'}), 413
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'Informe ?offset='}), 400
+    
+    upload = upload_spool.write_chunk(upload_id, index, offset, request.stream, length,
+                                      request.headers.get('X-Chunk-Sha256'))
+    return jsonify(upload)
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Faixas já recebidas: o cliente reenvia só as que faltam"""
+    return jsonify(upload_spool.status(upload_id))
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    upload_spool.status(upload_id)  # 404 se não existir
+    upload_spool.delete(upload_id)
+    return jsonify({'success': True})
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """
+    Transforma o upload completo numa sessão. Repetições (resposta perdida na
+    rede) devolvem a mesma sessão; duas finalizações simultâneas, mesmo em
+    workers diferentes, criam uma só.
+    """
+    session_id, response = upload_spool.result(upload_id)
+    owner = False
+    if session_id is None:
+        key = f'upload-finalize:{upload_id}'
+        candidate = str(uuid.uuid4())
+        session_id = session_data.claim_key(key, candidate, UPLOAD_TTL_SECONDS)
+        owner = session_id == candidate
+    if not owner:
+        if response is None:
+            # Outro worker está finalizando; pode ter terminado desde a primeira leitura
+            session_id, response = upload_spool.result(upload_id)
+        if response is None:
+            reply = jsonify({'error': 'Upload sendo finalizado, tente novamente em instantes'})
+            reply.headers['Retry-After'] = '1'
+            return reply, 409
+        if session_data.get(session_id) is None:
+            return jsonify({'error': 'A sessão deste upload já expirou'}), 410
+        # Repetição: a mesma resposta da finalização original
+        reply = jsonify(response)
+        reply.headers['Idempotent-Replayed'] = 'true'
+        return reply
+    
+    evict_expired_sessions()
+    try:
+        files, form = upload_spool.complete_files(upload_id)
+        form = MultiDict([(field, value) for field, values in form.items()
+                          for value in (values if isinstance(values, list) else [values])])
+        payload, status = store_upload(session_id, files, form)
+    except Exception:
+        session_data.delete_key(key)
+        raise
+    if status == 200:
+        upload_spool.finish(upload_id, session_id, payload)
+        print(f"[Upload] Upload retomável {upload_id[:8]} virou a sessão {session_id[:8]}")
+    else:
+        session_data.delete_key(key)
+    return jsonify(payload), status
+
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    return jsonify({'error': str(e), **e.details}), e.status
+
+@metrics.timed('upload_parse')
+def store_upload(session_id, files, form=None):
+    """
+    Grava as imagens e o formulário (padrão: request.form) na sessão;
+    retorna (resposta, status HTTP)
+    """
+    form = request.form if form is None else form
     
     # Processa imagens
     images_data = []
-    for file in files:
-        if file and allowed_file(file.filename):
-            # Lê imagem em memória
-            img_bytes = file.read()
-            
-            if len(img_bytes) > MAX_FILE_SIZE:
-                return jsonify({'error': f'Arquivo {file.filename} excede 10MB'}), 400
-            
-            # Converte para base64 para manter em memória
-            img_b64 = base64.b64encode(img_bytes).decode('utf-8')
-            
-            # Extrai dimensões
-            img = Image.open(io.BytesIO(img_bytes))
-            width, height = img.size
-            
-            images_data.append({
-                'filename': secure_filename(file.filename),
-                'data': img_b64,
-                'width': width,
-                'height': height,
-                'format': img.format
-            })
+    try:
+        for file in files:
+            if file and allowed_file(file.filename):
+                # Lê imagem em memória
+                img_bytes = file.read()
+                
+                if len(img_bytes) > MAX_FILE_SIZE:
+                    blob_store.release(session_id)
+                    return {'error': f'Arquivo {file.filename} excede 10MB'}, 400
+                
+                # Valida antes de guardar: só o cabeçalho é lido aqui
+                try:
+                    img = Image.open(io.BytesIO(img_bytes))
+                except OSError:  # inclui UnidentifiedImageError
+                    blob_store.release(session_id)
+                    return {'error': f'Arquivo {file.filename} não é uma imagem válida'}, 400
+                
+                # Guarda no blob store (deduplicado por SHA-256)
+                digest = blob_store.put(img_bytes, session_id)
+                meta = blob_store.meta(digest)
+                
+                metrics.cache('image_blob', 'width' in meta)
+                if 'width' not in meta:
+                    # Extrai dimensões
+                    meta['width'], meta['height'] = img.size
+                    meta['format'] = img.format
+                    
+                    # Pontua nitidez/exposição e calcula pHash em cópia reduzida
+                    try:
+                        meta['quality'] = score_image(img_bytes)
+                    except Exception as e:
+                        print(f"[Upload] ⚠️ Não foi possível pontuar {file.filename}: {e}")
+                        meta['quality'] = None
+                else:
+                    print(f"[Upload] Imagem {digest[:12]} já conhecida, reaproveitando")
+                
+                images_data.append({
+                    'filename': secure_filename(file.filename),
+                    'digest': digest,
+                    'size': len(img_bytes),
+                    'width': meta['width'],
+                    'height': meta['height'],
+                    'format': meta['format'],
+                    'quality': meta['quality']
+                })
+    except Exception:
+        # Nenhuma sessão foi criada: as referências já gravadas não ficam órfãs
+        blob_store.release(session_id)
+        raise
     
     # Captura dados do formulário
     form_data = {
-        'characteristics': request.form.get('characteristics', ''),
-        'envType': request.form.get('envType', ''),
-        'stoneElements': request.form.getlist('stoneElements'),
-        'format': request.form.get('format', ''),
-        'cutouts': request.form.getlist('cutouts'),
+        'characteristics': form.get('characteristics', ''),
+        'envType': form.get('envType', ''),
+        'stoneElements': form.getlist('stoneElements'),
+        'format': form.get('format', ''),
+        'cutouts': form.getlist('cutouts'),
         'timestamp': datetime.now().isoformat()
     }
     
+    # Melhores fotos distintas primeiro (quase-duplicatas descartadas)
+    ranking = rank_images([img['quality'] for img in images_data])
+    
     # Armazena na sessão (memória)
-    session_data[session_id] = {
+    session_data.save(session_id, {
         'images': images_data,
+        'ranking': ranking,
         'form': form_data,
-        'status': 'uploaded'
-    }
+        'status': 'uploaded',
+        'created_at': time.time(),
+        'last_access': time.time()
+    })
     
-    return jsonify({
+    speculative = start_speculative_analysis(session_id, client_tenant())
+    
+    return {
         'success': True,
         'session_id': session_id,
         'images_count': len(images_data),
+        'distinct_images': len(ranking),
+        'analysis_started': speculative,
         'message': f'{len(images_data)} imagem(ns) recebida(s) com sucesso'
-    })
+    }, 200
 
-@app.route('/api/generate-drawing/<session_id>', methods=['POST'])
-def generate_drawing(session_id):
-    """Gera desenho conceitual baseado nas imagens e dados"""
-    
-    if session_id not in session_data:
-        return jsonify({'error': 'Sessão não encontrada ou expirada'}), 404
-    
-    data = session_data[session_id]
-    
-    # Tenta análise com Claude Vision
-    ai_analysis = analyze_images_with_claude(data['images'], data['form'])
+def image_bytes(img):
+    """Bytes originais de uma imagem da sessão (via blob store)"""
+    return blob_store.get(img['digest'])
+
+def image_b64(img):
+    """Imagem da sessão em base64 (formato aceito pelos provedores)"""
+    return base64.b64encode(image_bytes(img)).decode('utf-8')
+
+def hf_input_image(img_bytes):
+    """
+    Foto de entrada do Space: (bytes, mime, nome do arquivo), reduzida a
+    HF_INPUT_MAX_SIDE px no maior lado, com a rotação do EXIF aplicada e no
+    formato original (JPEG continua JPEG). Fotos menores vão como estão.
+    MPO (JPEG com quadros extras, comum em câmeras de celular) vira um JPEG
+    simples, só com a foto principal.
+    """
+    with Image.open(io.BytesIO(img_bytes)) as img:
+        fmt = {'JPEG': 'JPEG', 'MPO': 'JPEG', 'PNG': 'PNG'}.get(img.format, 'PNG')
+        extension = 'jpg' if fmt == 'JPEG' else 'png'
+        if max(img.size) <= HF_INPUT_MAX_SIDE and img.format == fmt:
+            return bytes(img_bytes), Image.MIME[fmt], f'entrada.{extension}'
+        if fmt == 'JPEG':
+            # Decodifica o JPEG já em escala reduzida (bem mais rápido que a foto inteira)
+            img.draft('RGB', (HF_INPUT_MAX_SIDE, HF_INPUT_MAX_SIDE))
+        small = ImageOps.exif_transpose(img)
+        small.thumbnail((HF_INPUT_MAX_SIDE, HF_INPUT_MAX_SIDE), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if fmt == 'JPEG':
+            small.convert('RGB').save(buffer, format='JPEG', quality=90)
+        else:
+            small.save(buffer, format='PNG')
+    return buffer.getvalue(), Image.MIME[fmt], f'entrada.{extension}'
+
+def send_blob(digest, mimetype, download_name=None):
+    """Envia um blob: do arquivo em disco (page cache/sendfile) ou da memória"""
+    path = blob_store.path(digest)
+    if path:
+        return send_file(path, mimetype=mimetype, as_attachment=bool(download_name),
+                         download_name=download_name, max_age=0)
+    return send_file(io.BytesIO(blob_store.get(digest)), mimetype=mimetype,
+                     as_attachment=bool(download_name), download_name=download_name)
+
+def _render_drawing_spec(drawing):
+    """Desenho sem a análise embutida (ela vai separada na spec)"""
+    return {k: v for k, v in drawing.items() if k != 'ai_analysis'}
+
+@metrics.timed('render_drawing')
+def render_drawing(scene):
+    """Rasteriza a cena do desenho em PNG (no pool de processos, se configurado)"""
+    return render_pool.render('drawing', scene=scene)
+
+@metrics.timed('render_pdf')
+def render_pdf(drawing, session_id, scene=None):
+    """Gera o PDF do desenho conceitual (no pool de processos, se configurado)"""
+    return render_pool.render('pdf', drawing=_render_drawing_spec(drawing),
+                              session_id=session_id, scene=scene)
+
+def session_scene(data):
+    """Cena vetorial do desenho da sessão (None para desenhos sem cena)"""
+    digest = data.get('scene_digest')
+    if not digest or digest not in blob_store:
+        return None
+    return json.loads(bytes(blob_store.get(digest)))
+
+def ranked_images(data):
+    """Retorna as imagens da sessão, melhores fotos distintas primeiro"""
+    ranking = data.get('ranking')
+    if ranking is None:
+        return data['images']
+    return [data['images'][i] for i in ranking]
+
+# Descrições em inglês usadas nos prompts dos geradores de imagem
+PROMPT_ENV_MAP = {
+    'cozinha': 'kitchen countertop',
+    'banheiro': 'bathroom vanity',
+    'area-gourmet': 'gourmet area',
+    'lavabo': 'powder room',
+    'outro': 'interior space'
+}
+
+PROMPT_FORMAT_MAP = {
+    'reto': 'linear straight layout',
+    'l': 'L-shaped layout',
+    'u': 'U-shaped layout',
+    'ilha': 'island configuration',
+    'pensula': 'peninsula layout',
+    'irregular': 'custom irregular shape'
+}
+
+def dalle_prompt(form):
+    """Prompt técnico otimizado para DALL-E 3"""
+    env_desc = PROMPT_ENV_MAP.get(form['envType'], 'interior space')
+    format_desc = PROMPT_FORMAT_MAP.get(form['format'], 'custom layout')
+    
+    prompt = f"Professional technical architectural blueprint drawing of {env_desc} with {format_desc}. "
+    prompt += f"Top-down view, marble or granite countertop installation layout. "
+    prompt += f"Clean lines, precise measurements indicators, professional CAD style, "
+    prompt += f"minimalist design, high quality technical illustration with detailed stone placement"
+    return prompt
+
+def hf_prompt(form):
+    """Prompt técnico para img2img no Hugging Face"""
+    env_desc = PROMPT_ENV_MAP.get(form['envType'], 'interior space')
+    format_desc = PROMPT_FORMAT_MAP.get(form['format'], 'custom layout')
+    
+    prompt = f"Technical architectural drawing of {env_desc} with {format_desc}, "
+    prompt += f"marble or granite countertop installation, "
+    prompt += f"professional blueprint style, clean lines, top-down view, "
+    prompt += f"precise measurements indication, technical illustration, "
+    prompt += f"high quality architectural rendering, detailed stone layout"
+    return prompt
+
+def hf_settings():
+    """(url do Space, token, usar HF?) — só tenta HF se OpenAI não estiver configurado"""
+    hf_space_url = os.getenv('HF_SPACE_URL')
+    return hf_space_url, os.getenv('HF_API_KEY'), bool(hf_space_url) and not HAS_OPENAI
+
+def store_artifact(data, session_id, kind, payload):
+    """
+    Guarda o artefato no blob store e registra na sessão o digest (`<kind>_digest`)
+    e o tamanho em bytes (artifact_bytes), usados pela visão resumida da sessão
+    """
+    previous = data.get(f'{kind}_digest')
+    data[f'{kind}_digest'] = blob_store.put(payload, session_id)
+    if previous and previous != data[f'{kind}_digest']:
+        retire_artifact(data, previous)
+    data['artifact_bytes'] = {**data.get('artifact_bytes', {}), kind: len(payload)}
+    return data[f'{kind}_digest']
+
+def retire_artifact(data, digest):
+    """
+    Artefato substituído: o blob fica com a sessão até a próxima versão
+    registrada sair do histórico (release_versions)
+    """
+    data['retired_digests'] = data.get('retired_digests', []) + [digest]
+
+def finish_generation(session_id, data, drawing_description, drawing_image, ai_analysis, scene,
+                      drawing_source='local'):
+    """Grava o resultado na sessão e monta a resposta da API"""
+    previous_scene = session_scene(data)
+    data['status'] = 'drawing_created'
+    data['drawing'] = drawing_description
+    store_artifact(data, session_id, 'drawing', drawing_image)
+    data['drawing_source'] = drawing_source
+    store_artifact(data, session_id, 'scene', scene_json(scene))
+    store_artifact(data, session_id, 'svg', render_svg(scene))
+    data['ai_analysis'] = ai_analysis
+    data.pop('ai_layout_overridden', None)
+    for field in ('generation_inputs', 'generation_started', 'error'):
+        data.pop(field, None)
+    record_version(session_id, data, 'generate',
+                   changed_layers=scene_changed_layers(previous_scene, scene))
+    session_data.save(session_id, data)
+    
+    return generation_payload(session_id, data)
+
+def generation_payload(session_id, data):
+    """Resposta da API para o desenho gerado na sessão"""
+    return {
+        'success': True,
+        'session_id': session_id,
+        'version': data['version'],
+        'drawing': data['drawing'],
+        'drawing_url': f'/api/drawing-image/{session_id}',
+        'svg_url': f'/api/drawing-svg/{session_id}',
+        'ai_analysis': data.get('ai_analysis'),
+        'message': 'Desenho conceitual gerado com sucesso'
+    }
+
+def providers_enabled():
+    """Algum provedor de imagem (DALL-E ou Hugging Face) configurado?"""
+    return HAS_OPENAI or hf_settings()[2]
+
+def provider_slot(data):
+    """
+    Vaga em provider_gate para chamar os provedores de imagem. None se não há
+    provedor configurado ou se estão no limite: a geração segue na hora com o
+    desenho local. Quem recebe a vaga a devolve com provider_gate.release(vaga).
+    """
+    if not (providers_enabled() and data['images']):
+        return None
+    slot = provider_gate.try_acquire()
+    if slot is None:
+        print("[Admissão] ⚠️ Provedores no limite, usando desenho conceitual local")
+    return slot
+
+def run_generation(session_id, data):
+    """Pipeline síncrono: análise → desenho local → provedores de imagem"""
     
-    # Cria descrição do desenho (usa análise IA se disponível)
-    drawing_description = create_conceptual_drawing(data, ai_analysis)
+    # Tenta análise com Claude Vision (reaproveita a especulativa do upload, se houver)
+    ai_analysis = take_analysis(session_id, data)
     
-    # Gera imagem do desenho em memória
-    drawing_image = generate_drawing_image(drawing_description, data, ai_analysis)
+    with tracing.span('layout'):
+        # Cria descrição do desenho (usa análise IA se disponível)
+        drawing_description = create_conceptual_drawing(data, ai_analysis)
+        
+        # Layout vetorial do desenho local (o PNG só é rasterizado se nenhum
+        # provedor gerar imagem)
+        scene = build_scene(drawing_description, data['form'], ai_analysis, session_id)
     
     # --- Prioridade: OpenAI DALL-E 3 > Hugging Face > Desenho Local ---
+    drawing_image = None
+    slot = provider_slot(data)
+    if slot is not None:
+        try:
+            drawing_image = _provider_image(data)
+        finally:
+            provider_gate.release(slot)
+    
+    drawing_source = 'local' if drawing_image is None else 'provider'
+    if drawing_image is None:
+        drawing_image = render_drawing(scene)
+
+    with tracing.span('store'):
+        return finish_generation(session_id, data, drawing_description, drawing_image,
+                                 ai_analysis, scene, drawing_source)
+
+def _provider_image(data):
+    """DALL-E 3 > Hugging Face; None se nenhum gerar imagem"""
     
     # OPÇÃO 1: Tentar OpenAI DALL-E 3 primeiro (melhor qualidade)
     if HAS_OPENAI and data['images']:
         try:
-            # Cria prompt técnico detalhado
-            env_map = {
-                'cozinha': 'kitchen countertop',
-                'banheiro': 'bathroom vanity',
-                'area-gourmet': 'gourmet area',
-                'lavabo': 'powder room',
-                'outro': 'interior space'
-            }
-            
-            format_map = {
-                'reto': 'linear straight layout',
-                'l': 'L-shaped layout',
-                'u': 'U-shaped layout',
-                'ilha': 'island configuration',
-                'pensula': 'peninsula layout',
-                'irregular': 'custom irregular shape'
-            }
-            
-            env_desc = env_map.get(data['form']['envType'], 'interior space')
-            format_desc = format_map.get(data['form']['format'], 'custom layout')
-            
-            # Prompt otimizado para DALL-E 3
-            prompt = f"Professional technical architectural blueprint drawing of {env_desc} with {format_desc}. "
-            prompt += f"Top-down view, marble or granite countertop installation layout. "
-            prompt += f"Clean lines, precise measurements indicators, professional CAD style, "
-            prompt += f"minimalist design, high quality technical illustration with detailed stone placement"
+            prompt = dalle_prompt(data['form'])
             
             print(f"[OpenAI] Gerando imagem com DALL-E 3...")
             print(f"[OpenAI] Prompt: {prompt[:100]}...")
@@ -182,106 +962,524 @@ def generate_drawing(session_id):
             dalle_img = generate_image_with_dalle(prompt)
             if dalle_img:
                 print("[OpenAI] ✓ Imagem gerada com sucesso via DALL-E 3")
-                drawing_image = dalle_img
+                return dalle_img
             else:
                 print("[OpenAI] ⚠️ DALL-E 3 falhou, tentando alternativas...")
         except Exception as e:
             print(f"[OpenAI] ⚠️ Erro: {e}")
     
     # OPÇÃO 2: Se OpenAI falhou/indisponível, tentar Hugging Face
-    HF_SPACE_URL = os.getenv('HF_SPACE_URL')
-    HF_TOKEN = os.getenv('HF_API_KEY')
-    USE_HF_IMAGE = bool(HF_SPACE_URL) and not HAS_OPENAI  # Só tenta HF se OpenAI não estiver configurado
+    hf_space_url, hf_token, use_hf_image = hf_settings()
 
-    if USE_HF_IMAGE and data['images']:
+    if use_hf_image and data['images']:
         try:
-            # Usa a primeira imagem enviada como base
-            input_image_b64 = data['images'][0]['data']
-            
-            # Cria prompt técnico detalhado para melhor resultado
-            env_map = {
-                'cozinha': 'kitchen countertop',
-                'banheiro': 'bathroom vanity',
-                'area-gourmet': 'gourmet area',
-                'lavabo': 'powder room',
-                'outro': 'interior space'
-            }
-            
-            format_map = {
-                'reto': 'linear straight layout',
-                'l': 'L-shaped layout',
-                'u': 'U-shaped layout',
-                'ilha': 'island configuration',
-                'pensula': 'peninsula layout',
-                'irregular': 'custom irregular shape'
-            }
-            
-            env_desc = env_map.get(data['form']['envType'], 'interior space')
-            format_desc = format_map.get(data['form']['format'], 'custom layout')
-            
-            # Prompt otimizado para desenho técnico
-            prompt = f"Technical architectural drawing of {env_desc} with {format_desc}, "
-            prompt += f"marble or granite countertop installation, "
-            prompt += f"professional blueprint style, clean lines, top-down view, "
-            prompt += f"precise measurements indication, technical illustration, "
-            prompt += f"high quality architectural rendering, detailed stone layout"
+            # Usa a melhor foto (mais nítida/bem exposta) como base
+            input_image = hf_input_image(image_bytes(ranked_images(data)[0]))
+            prompt = hf_prompt(data['form'])
             
             print(f"[HF] Prompt técnico gerado: {prompt}")
             
             # Chama Hugging Face Space
-            print(f"[HF] Tentando gerar imagem com HF Space: {HF_SPACE_URL}")
-            hf_img = generate_image_with_hf_space(input_image_b64, prompt, HF_SPACE_URL, HF_TOKEN)
+            print(f"[HF] Tentando gerar imagem com HF Space: {hf_space_url}")
+            hf_img = generate_image_with_hf_space(input_image, prompt, hf_space_url, hf_token)
             if hf_img:
                 print("[HF] ✓ Imagem gerada com sucesso via Hugging Face")
-                drawing_image = hf_img
+                return hf_img
             else:
                 print("[HF] ⚠️ Hugging Face falhou, usando desenho conceitual local")
         except Exception as e:
             print(f"[HF] ⚠️ Erro ao tentar Hugging Face: {e}. Usando desenho conceitual local")
+    return None
 
-    # Atualiza status
-    session_data[session_id]['status'] = 'drawing_created'
-    session_data[session_id]['drawing'] = drawing_description
-    session_data[session_id]['drawing_image'] = drawing_image
-    session_data[session_id]['ai_analysis'] = ai_analysis
+async def _provider_image_async(data):
+    """DALL-E 3 > Hugging Face, no núcleo assíncrono; None se nenhum gerar imagem"""
+    if HAS_OPENAI and data['images']:
+        prompt = dalle_prompt(data['form'])
+        print(f"[OpenAI] Gerando imagem com DALL-E 3 (async)...")
+        dalle_img = await generate_image_with_dalle_async(prompt)
+        if dalle_img:
+            print("[OpenAI] ✓ Imagem gerada com sucesso via DALL-E 3")
+            return dalle_img
+        print("[OpenAI] ⚠️ DALL-E 3 falhou, tentando alternativas...")
+    
+    hf_space_url, hf_token, use_hf_image = hf_settings()
+    if use_hf_image and data['images']:
+        input_image = await async_core.offload(hf_input_image, image_bytes(ranked_images(data)[0]))
+        print(f"[HF] Tentando gerar imagem com HF Space (async): {hf_space_url}")
+        hf_img = await generate_image_with_hf_space_async(
+            input_image, hf_prompt(data['form']), hf_space_url, hf_token)
+        if hf_img:
+            print("[HF] ✓ Imagem gerada com sucesso via Hugging Face")
+            return hf_img
+        print("[HF] ⚠️ Hugging Face falhou, usando desenho conceitual local")
+    return None
+
+async def run_generation_async(session_id, data):
+    """
+    Pipeline assíncrono: a E/S com os provedores fica no event loop; o
+    desenho local só é rasterizado (no executor de CPU) se nenhum provedor
+    gerar imagem.
+    """
+    ai_analysis = await take_analysis_async(session_id, data)
+    with tracing.span('layout'):
+        drawing_description = create_conceptual_drawing(data, ai_analysis)
+        scene = build_scene(drawing_description, data['form'], ai_analysis, session_id)
+    
+    drawing_image = None
+    slot = provider_slot(data)
+    if slot is not None:
+        try:
+            drawing_image = await _provider_image_async(data)
+        finally:
+            provider_gate.release(slot)
+    drawing_source = 'local' if drawing_image is None else 'provider'
+    if drawing_image is None:
+        drawing_image = await async_core.offload(render_drawing, scene)
+    
+    with tracing.span('store'):
+        return await async_core.offload(finish_generation, session_id, data,
+                                        drawing_description, drawing_image, ai_analysis,
+                                        scene, drawing_source)
+
+def generation_failed(session_id, error):
+    """Registra na sessão a falha da geração"""
+    print(f"[Geração] ⚠️ Geração da sessão {session_id[:8]} falhou: {error}")
+    session_data.update(session_id, {'status': 'generation_failed', 'error': str(error)})
+
+def _generation_thread(session_id, data):
+    """Geração síncrona em segundo plano (?mode=async com ASYNC_PROVIDERS desligado)"""
+    try:
+        return run_generation(session_id, data)
+    except Exception as e:
+        generation_failed(session_id, e)
+        raise
+
+async def _generation_job(session_id, data):
+    """Geração no núcleo assíncrono: falhas ficam registradas na sessão"""
+    try:
+        return await run_generation_async(session_id, data)
+    except Exception as e:
+        generation_failed(session_id, e)
+        raise
+
+def generation_inputs(data):
+    """Impressão digital das entradas da geração (fotos, formulário e versão)"""
+    return request_fingerprint([img['digest'] for img in data['images']],
+                               data['form'], data.get('version', 0))
+
+def _attached_flight(session_id, data, flight_key):
+    """Geração em andamento para as mesmas entradas (chamar com _generation_lock)"""
+    future = _generation_flights.get(flight_key)
+    if future is not None:
+        print(f"[Geração] Sessão {session_id[:8]}: anexada à geração em andamento")
+        metrics.cache('generation_flight', True)
+        return future, False
+    if generation_running(data) and data.get('generation_inputs') == flight_key[1]:
+        print(f"[Geração] Sessão {session_id[:8]}: em andamento em outro worker")
+        return None, False
+    return None
+
+def generation_running(data):
+    """Há uma geração em andamento (marca 'generating' ainda não abandonada)?"""
+    return (data.get('status') == 'generating'
+            and time.time() - data.get('generation_started', 0) < GENERATION_FLIGHT_TIMEOUT)
+
+def join_generation(session_id, data, background=False):
+    """
+    Single-flight da geração: chamadas concorrentes para a mesma sessão e as
+    mesmas entradas compartilham uma única execução. Retorna (future, dono):
+    - future de uma geração já em andamento neste processo (dono=False)
+    - None se outro worker já está gerando (marca 'generating' na sessão)
+    - future de uma nova geração; com dono=True quem chamou deve executá-la
+      e resolver o future (modo síncrono)
+    Só uma nova geração passa pelo controle de admissão (RateLimited/Overloaded).
+    """
+    inputs = generation_inputs(data)
+    flight_key = (session_id, inputs)
+    with _generation_lock:
+        attached = _attached_flight(session_id, data, flight_key)
+    if attached is not None:
+        return attached
+    
+    # Admissão: limite do cliente (429) e vaga de geração, com fila curta (503)
+    generation_limiter.take(client_tenant())
+    with tracing.span('admission_wait'):
+        admitted_at = generation_gate.acquire()
+    
+    with _generation_lock:
+        # Revisão gravada enquanto esta chamada esperava vaga: gera a versão nova
+        stored = session_data.get(session_id)
+        if stored is not None and stored.get('version', 0) != data.get('version', 0):
+            data.clear()
+            data.update(stored)
+            flight_key = (session_id, generation_inputs(data))
+        attached = _attached_flight(session_id, data, flight_key)
+        if attached is not None:
+            generation_gate.release()
+            return attached
+        
+        marks = ('status', 'generation_inputs', 'generation_started')
+        previous = {key: data[key] for key in marks if key in data}
+        data['status'] = 'generating'
+        data['generation_inputs'] = flight_key[1]
+        data['generation_started'] = time.time()
+        owner = saved = False
+        try:
+            session_data.save(session_id, data)
+            saved = True
+            if ASYNC_PROVIDERS:
+                future = async_core.submit(_generation_job(session_id, data))
+            elif background:
+                future = generation_executor.submit(_generation_thread, session_id, data)
+            else:
+                future, owner = Future(), True
+        except BaseException:
+            # Nada agendado: devolve a vaga e as marcas anteriores (também na
+            # sessão gravada, para ninguém esperar por uma geração que não existe)
+            for key in marks:
+                data.pop(key, None)
+            data.update(previous)
+            generation_gate.release(admitted_at)
+            if saved:
+                try:
+                    session_data.save(session_id, data)
+                except Exception as e:
+                    print(f"[Geração] ⚠️ Falha ao desfazer a marca de geração: {e}")
+            raise
+        _generation_flights[flight_key] = future
+        metrics.cache('generation_flight', False)
     
-    return jsonify({
-        'success': True,
-        'session_id': session_id,
-        'drawing': drawing_description,
-        'drawing_url': f'/api/drawing-image/{session_id}',
-        'ai_analysis': ai_analysis,
-        'message': 'Desenho conceitual gerado com sucesso'
-    })
+    def _finished(_future):
+        _generation_flights.pop(flight_key, None)
+        generation_gate.release(admitted_at)
+    
+    future.add_done_callback(_finished)
+    return future, owner
+
+def wait_generation(session_id, timeout):
+    """Acompanha pela sessão uma geração feita por outro worker"""
+    deadline = time.time() + timeout
+    data = session_data.get(session_id)
+    while data is not None and data.get('status') == 'generating' and time.time() < deadline:
+        time.sleep(0.25)
+        data = session_data.get(session_id)
+    return data
+
+@app.route('/api/generate-drawing/<session_id>', methods=['POST'])
+def generate_drawing(session_id):
+    """Gera desenho conceitual baseado nas imagens e dados"""
+    
+    data = session_data.get(session_id)
+    if data is None:
+        return jsonify({'error': 'Sessão não encontrada ou expirada'}), 404
+    
+    data['last_access'] = time.time()
+    background = request.args.get('mode') == 'async'
+    
+    # Idempotency-Key: repetição da mesma chamada recebe a resposta original
+    key = idempotency_key(f'generate:{session_id}')
+    if key is None:
+        payload, status = coalesced_generation(session_id, data, background)
+        return jsonify(payload), status
+    
+    replay, record = claim_idempotency(key, request_fingerprint(session_id, background))
+    if replay is not None:
+        return replay
+    try:
+        payload, status = coalesced_generation(session_id, data, background)
+    except Exception:
+        session_data.delete_key(key)
+        raise
+    complete_idempotency(key, record, payload, status)
+    return jsonify(payload), status
+
+def coalesced_generation(session_id, data, background=False):
+    """Executa (ou acompanha) a geração single-flight; retorna (resposta, status HTTP)"""
+    future, owner = join_generation(session_id, data, background)
+    
+    if owner:
+        try:
+            future.set_result(run_generation(session_id, data))
+        except Exception as e:
+            generation_failed(session_id, e)
+            future.set_exception(e)
+    
+    # ?mode=async: responde na hora; o cliente acompanha pelo status da sessão
+    if background:
+        return {
+            'success': True,
+            'session_id': session_id,
+            'status': 'generating',
+            'status_url': f'/api/session/{session_id}',
+            'drawing_url': f'/api/drawing-image/{session_id}',
+            'message': 'Geração iniciada'
+        }, 202
+    
+    if owner:
+        return future.result(), 200
+    if future is not None:
+        with tracing.span('generation_wait'):
+            return future.result(timeout=GENERATION_FLIGHT_TIMEOUT), 200
+    
+    with tracing.span('generation_wait'):
+        data = wait_generation(session_id, GENERATION_FLIGHT_TIMEOUT)
+    if data is None:
+        return {'error': 'Sessão não encontrada ou expirada'}, 404
+    if data.get('status') == 'generating':
+        return {'success': True, 'session_id': session_id, 'status': 'generating',
+                'status_url': f'/api/session/{session_id}'}, 202
+    if data.get('status') == 'generation_failed' or 'drawing' not in data:
+        return {'error': data.get('error', 'Falha ao gerar desenho')}, 500
+    return generation_payload(session_id, data), 200
 
 @app.route('/api/drawing-image/<session_id>', methods=['GET'])
 def get_drawing_image(session_id):
     """Retorna a imagem do desenho gerado"""
     
-    if session_id not in session_data:
+    data = session_data.get(session_id)
+    if data is None:
         return jsonify({'error': 'Sessão não encontrada'}), 404
     
-    if 'drawing_image' not in session_data[session_id]:
+    digest = session_drawing(session_id, data)
+    if digest is None:
         return jsonify({'error': 'Desenho não foi gerado'}), 404
     
-    img_data = session_data[session_id]['drawing_image']
+    return send_blob(digest, 'image/png')
+
+def session_drawing(session_id, data):
+    """Digest do PNG do desenho (None se não houver desenho)"""
+    if 'drawing_digest' not in data:
+        # Desenho revisado: o PNG local é rasterizado da cena só quando pedido
+        scene = session_scene(data)
+        if scene is None:
+            return None
+        store_artifact(data, session_id, 'drawing', render_drawing(scene))
+        session_data.update(session_id, {'drawing_digest': data['drawing_digest'],
+                                         'artifact_bytes': data['artifact_bytes']})
+    return data['drawing_digest']
+
+@app.route('/api/drawing-svg/<session_id>', methods=['GET'])
+def get_drawing_svg(session_id):
+    """Retorna o desenho conceitual em SVG (vetorial, poucos KB)"""
     
-    return send_file(
-        io.BytesIO(img_data),
-        mimetype='image/png',
-        as_attachment=False
-    )
+    data = session_data.get(session_id)
+    if data is None:
+        return jsonify({'error': 'Sessão não encontrada'}), 404
+    
+    if 'svg_digest' not in data:
+        return jsonify({'error': 'Desenho não foi gerado'}), 404
+    
+    # ?version=N: SVG de uma versão anterior, a partir da cena guardada no histórico
+    version = request.args.get('version', type=int)
+    if version is not None and version != data.get('version'):
+        entry = next((r for r in data.get('revisions', []) if r['version'] == version), None)
+        if entry is None or entry.get('scene_digest') not in blob_store:
+            return jsonify({'error': f'Versão {version} não encontrada'}), 404
+        scene = json.loads(bytes(blob_store.get(entry['scene_digest'])))
+        return send_file(io.BytesIO(render_svg(scene)), mimetype='image/svg+xml')
+    
+    return send_blob(data['svg_digest'], 'image/svg+xml')
 
-def analyze_images_with_claude(images_data, form_data):
-    """Analisa imagens com Claude Vision e retorna insights para o desenho"""
+# Contrato da análise: 9 chaves obrigatórias expressas como schema de ferramenta.
+# Com tool_choice forçado o modelo devolve o JSON já estruturado (sem markdown,
+# sem texto extra) e as descrições ficam no schema em vez de inflar o prompt.
+ANALYSIS_TOOL_NAME = 'registrar_analise'
+
+ANALYSIS_PROPERTIES = {
+    'layout_analysis': {
+        'type': 'string',
+        'description': 'Layout atual do espaço (paredes, móveis, estruturas visíveis)'
+    },
+    'space_dimensions': {
+        'type': 'object',
+        'description': 'Proporções estimadas a partir da imagem',
+        'properties': {
+            'width_ratio': {'type': 'number', 'description': 'Largura em relação à altura (1.5 = 50% mais largo)'},
+            'depth_ratio': {'type': 'number', 'description': 'Profundidade em relação à largura'},
+            'height_estimate': {'type': 'number', 'description': 'Altura estimada em cm (240 se não identificar)'}
+        },
+        'required': ['width_ratio', 'depth_ratio', 'height_estimate']
+    },
+    'stone_layout': {
+        'type': 'object',
+        'description': 'Posicionamento dos elementos de pedra (coordenadas 0-100)',
+        'properties': {
+            'main_surface': {'type': 'string', 'description': 'Superfície principal (bancada/parede/piso)'},
+            'positions': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'element': {'type': 'string'},
+                        'x_start': {'type': 'number'},
+                        'x_end': {'type': 'number'},
+                        'y_start': {'type': 'number'},
+                        'y_end': {'type': 'number'},
+                        'description': {'type': 'string'}
+                    },
+                    'required': ['element', 'x_start', 'x_end', 'y_start', 'y_end']
+                }
+            }
+        },
+        'required': ['main_surface', 'positions']
+    },
+    'cutouts_positions': {
+        'type': 'array',
+        'description': 'Um item por recorte identificado (coordenadas 0-100)',
+        'items': {
+            'type': 'object',
+            'properties': {
+                'type': {'type': 'string', 'description': 'pia/cooktop/torneira/etc'},
+                'x': {'type': 'number'},
+                'y': {'type': 'number'},
+                'size': {'type': 'string', 'enum': ['pequeno', 'médio', 'grande']},
+                'notes': {'type': 'string'}
+            },
+            'required': ['type', 'x', 'y', 'size']
+        }
+    },
+    'format_recommendation': {
+        'type': 'string',
+        'description': 'Como o formato desejado se encaixa no espaço analisado'
+    },
+    'visual_references': {
+        'type': 'array', 'items': {'type': 'string'},
+        'description': 'Elementos visuais chave (cores, texturas, estilo)'
+    },
+    'drawing_instructions': {
+        'type': 'array', 'items': {'type': 'string'},
+        'description': 'Instruções curtas para o desenho técnico'
+    },
+    'challenges': {
+        'type': 'array', 'items': {'type': 'string'},
+        'description': 'Desafios ou pontos de atenção'
+    },
+    'confidence': {
+        'type': 'number',
+        'description': 'Confiança da análise (0-100)'
+    }
+}
+
+ANALYSIS_REQUIRED_KEYS = list(ANALYSIS_PROPERTIES.keys())
+
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+
+
+def _analysis_tool(keys=None):
+    """Monta o schema da ferramenta de análise (opcionalmente só com algumas chaves)"""
+    keys = keys or ANALYSIS_REQUIRED_KEYS
+    return {
+        'name': ANALYSIS_TOOL_NAME,
+        'description': 'Registra a análise estruturada do ambiente para o desenho conceitual.',
+        'input_schema': {
+            'type': 'object',
+            'properties': {k: ANALYSIS_PROPERTIES[k] for k in keys},
+            'required': list(keys)
+        }
+    }
+
+
+def _analysis_max_tokens(form_data):
+    """Dimensiona max_tokens pelo número de elementos e recortes pedidos.
+
+    Cada posição de elemento custa ~120 tokens e cada recorte ~80 no JSON
+    compacto; o restante (textos e listas) cabe em ~700 tokens.
+    """
+    elements = [e for e in form_data.get('stoneElements', []) if e != 'nenhum']
+    cutouts = [c for c in form_data.get('cutouts', []) if c != 'nenhum']
+    budget = 700 + 120 * max(len(elements), 1) + 80 * max(len(cutouts), 1)
+    return max(1024, min(budget, 4096))
+
+
+def _extract_analysis(response):
+    """Extrai o dict da análise de uma resposta (tool_use ou, em último caso, texto)"""
+    for block in response.content:
+        if getattr(block, 'type', None) == 'tool_use' and block.name == ANALYSIS_TOOL_NAME:
+            if isinstance(block.input, dict):
+                return dict(block.input)
+    
+    # Fallback: modelo respondeu em texto (com ou sem cercas ```json)
+    for block in response.content:
+        text = getattr(block, 'text', None)
+        if not text:
+            continue
+        start = text.find('{')
+        end = text.rfind('}')
+        if start == -1 or end <= start:
+            continue
+        try:
+            return json.loads(text[start:end + 1])
+        except ValueError:
+            continue
     
-    if not HAS_CLAUDE_VISION:
-        # Se Claude não estiver configurado, usa análise simbólica
-        return None
+    return {}
+
+
+def _repair_request(analysis, missing_keys, form_data):
+    """Parâmetros da chamada que pede só as chaves ausentes, sem reenviar as imagens"""
+    print(f"[Claude] Reparando chaves ausentes: {', '.join(missing_keys)}")
     
-    try:
-        # Prepara imagens para Claude Vision
-        image_contents = []
+    prompt_text = f"""Uma análise de ambiente {form_data.get('envType', 'não especificado')} \
+(formato {form_data.get('format')}) ficou incompleta.
+
+Análise parcial já obtida:
+{json.dumps(analysis, ensure_ascii=False, separators=(',', ':'))}
+
+Elementos de pedra: {', '.join(form_data.get('stoneElements', []))}
+Recortes: {', '.join(form_data.get('cutouts', []))}
+
+Complete APENAS as chaves ausentes ({', '.join(missing_keys)}), coerentes com a análise \
+parcial, chamando a ferramenta {ANALYSIS_TOOL_NAME}."""
+    
+    return dict(
+        model=CLAUDE_MODEL,
+        max_tokens=256 + 200 * len(missing_keys),
+        tools=[_analysis_tool(missing_keys)],
+        tool_choice={"type": "tool", "name": ANALYSIS_TOOL_NAME},
+        messages=[{"role": "user", "content": prompt_text}],
+    )
+
+
+def _merge_repair(analysis, missing_keys, response):
+    """Incorpora à análise as chaves devolvidas pelo reparo"""
+    repaired = _extract_analysis(response)
+    for key in missing_keys:
+        if key in repaired:
+            analysis[key] = repaired[key]
+    return analysis
+
+
+def _missing_keys(analysis, response):
+    """Chaves obrigatórias ausentes (só faz sentido reparar análise não vazia)"""
+    if getattr(response, 'stop_reason', None) == 'max_tokens':
+        print("[Claude] ⚠️ Resposta atingiu max_tokens, chaves finais podem faltar")
+    if not analysis:
+        return []
+    return [k for k in ANALYSIS_REQUIRED_KEYS if k not in analysis]
+
+
+def build_analysis_request(images_data, form_data):
+    """Monta os parâmetros da chamada de análise (imagens + prompt + schema)"""
+    # Prepara imagens para Claude Vision
+    image_contents = []
+    sheet_note = ''
+    if CLAUDE_CONTACT_SHEET and len(images_data) > 1:
+        # Modo folha de contato: todas as fotos em um único bloco de imagem
+        selected = images_data[:CONTACT_SHEET_MAX_IMAGES]
+        sheet = build_contact_sheet([image_bytes(img) for img in selected])
+        image_contents.append({
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/jpeg",
+                "data": base64.b64encode(sheet).decode('utf-8'),
+            },
+        })
+        sheet_note = (f"\nA imagem é uma folha de contato com {len(selected)} fotos do mesmo ambiente, "
+                      f"numeradas de 1 a {len(selected)} no canto superior esquerdo de cada quadro. "
+                      f"Ao citar uma foto, use o número do quadro (ex: \"foto 2\").\n")
+        print(f"[Claude] Folha de contato: {len(selected)} fotos, {len(sheet)} bytes")
+    else:
         for img_data in images_data[:3]:  # Máximo 3 imagens para não sobrecarregar
             # Claude aceita base64
             image_contents.append({
@@ -289,16 +1487,16 @@ def analyze_images_with_claude(images_data, form_data):
                 "source": {
                     "type": "base64",
                     "media_type": "image/jpeg",
-                    "data": img_data['data'],
+                    "data": image_b64(img_data),
                 },
             })
-        
-        # Adiciona texto do prompt
-        prompt_text = f"""Você é um especialista em marmoraria, design de interiores e desenho técnico para fabricação de pedras naturais.
+    
+    # Adiciona texto do prompt (o formato da saída é definido pelo schema da ferramenta)
+    prompt_text = f"""Você é um especialista em marmoraria, design de interiores e desenho técnico para fabricação de pedras naturais.
 
 CONTEXTO:
 Analise esta(s) imagem(ns) de um ambiente {form_data.get('envType', 'não especificado')} que receberá revestimento em pedra natural.
-
+{sheet_note}
 DADOS DO FORMULÁRIO:
 - Tipo de ambiente: {form_data.get('envType')}
 - Formato desejado: {form_data.get('format')}
@@ -307,74 +1505,89 @@ DADOS DO FORMULÁRIO:
 - Características descritas: {form_data.get('characteristics', 'Nenhuma')}
 
 TAREFA:
-Você deve fornecer uma análise EXTREMAMENTE DETALHADA para gerar um desenho técnico conceitual preciso.
-
-Retorne um JSON com as seguintes chaves (todas obrigatórias):
-
-1. "layout_analysis": Descrição DETALHADA do layout atual do espaço (paredes, móveis, estruturas visíveis)
-
-2. "space_dimensions": Objeto com estimativas de proporções baseadas na imagem:
-   - "width_ratio": largura aproximada em relação à altura (ex: 1.5 = 50% mais largo)
-   - "depth_ratio": profundidade em relação à largura
-   - "height_estimate": altura estimada em cm (padrão 240cm se não identificar)
-
-3. "stone_layout": Objeto DETALHADO com posicionamento dos elementos de pedra:
-   - "main_surface": descrição da superfície principal (bancada/parede/piso)
-   - "positions": lista de objetos, cada um com:
-     * "element": nome do elemento (bancada/ilha/nicho/etc)
-     * "x_start": posição X inicial (0-100, porcentagem da largura)
-     * "x_end": posição X final (0-100)
-     * "y_start": posição Y inicial (0-100, porcentagem da altura)
-     * "y_end": posição Y final (0-100)
-     * "description": descrição do posicionamento
-
-4. "cutouts_positions": lista de objetos para cada recorte identificado:
-   - "type": tipo do recorte (pia/cooktop/torneira/etc)
-   - "x": posição X (0-100)
-   - "y": posição Y (0-100)
-   - "size": tamanho estimado (pequeno/médio/grande)
-   - "notes": observações sobre o recorte
-
-5. "format_recommendation": Como o formato {form_data.get('format')} se encaixa no espaço analisado
+Forneça uma análise detalhada para gerar um desenho técnico conceitual preciso e registre-a \
+chamando a ferramenta {ANALYSIS_TOOL_NAME} (todas as chaves são obrigatórias).
 
-6. "visual_references": Lista de elementos visuais chave identificados nas imagens (cores, texturas, estilo)
-
-7. "drawing_instructions": Lista de instruções específicas para o desenho técnico (ex: "posicionar ilha centralizada", "bancada em L com 2.5m + 1.8m")
-
-8. "challenges": Lista de desafios ou pontos de atenção identificados
-
-9. "confidence": Nível de confiança da análise (0-100)
-
-IMPORTANTE: 
+IMPORTANTE:
 - Seja MUITO ESPECÍFICO com posições e proporções
 - Use as coordenadas 0-100 para facilitar o desenho
+- Uma posição em stone_layout.positions por elemento e um item em cutouts_positions por recorte
 - Se não conseguir identificar algo nas imagens, use valores padrão razoáveis baseados no tipo de ambiente
-- Responda APENAS com JSON válido, sem markdown ou explicações extras"""
+- Textos curtos e objetivos: a saída é consumida por um programa"""
+    
+    image_contents.append({
+        "type": "text",
+        "text": prompt_text
+    })
+    
+    # Saída estruturada via ferramenta
+    return dict(
+        model=CLAUDE_MODEL,
+        max_tokens=_analysis_max_tokens(form_data),
+        tools=[_analysis_tool()],
+        tool_choice={"type": "tool", "name": ANALYSIS_TOOL_NAME},
+        messages=[
+            {
+                "role": "user",
+                "content": image_contents,
+            }
+        ],
+    )
+
+
+@metrics.provider('claude', stage='claude_analysis', enabled=lambda: HAS_CLAUDE_VISION)
+def analyze_images_with_claude(images_data, form_data):
+    """Analisa imagens com Claude Vision e retorna insights para o desenho"""
+    
+    if not HAS_CLAUDE_VISION:
+        # Se Claude não estiver configurado, usa análise simbólica
+        return None
+    
+    try:
+        # Chama Claude Vision
+        client = providers.get('anthropic')
+        response = client.messages.create(**build_analysis_request(images_data, form_data))
+        analysis = _extract_analysis(response)
         
-        image_contents.append({
-            "type": "text",
-            "text": prompt_text
-        })
+        # Chave obrigatória ausente: repara só o que falta em vez de refazer tudo
+        missing = _missing_keys(analysis, response)
+        if missing:
+            try:
+                repair = client.messages.create(**_repair_request(analysis, missing, form_data))
+                analysis = _merge_repair(analysis, missing, repair)
+            except Exception as e:
+                print(f"[Claude] ⚠️ Reparo falhou, mantendo análise parcial: {e}")
         
-        # Chama Claude Vision
-        response = anthropic_client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1024,
-            messages=[
-                {
-                    "role": "user",
-                    "content": image_contents,
-                }
-            ],
-        )
+        return analysis or None
+        
+    except Exception as e:
+        print(f"⚠️ Erro ao analisar com Claude Vision: {e}")
+        return None
+
+
+@metrics.provider('claude', stage='claude_analysis', enabled=lambda: HAS_CLAUDE_VISION)
+async def analyze_images_async(images_data, form_data):
+    """Versão assíncrona de analyze_images_with_claude (cliente AsyncAnthropic)"""
+    
+    if not HAS_CLAUDE_VISION:
+        return None
+    
+    try:
+        # Montar o pedido decodifica/mosaica imagens: CPU, vai para o executor
+        request_kwargs = await async_core.offload(build_analysis_request, images_data, form_data)
+        client = async_core.anthropic()
+        response = await client.messages.create(**request_kwargs)
+        analysis = _extract_analysis(response)
         
-        # Extrai resposta de texto
-        response_text = response.content[0].text
+        missing = _missing_keys(analysis, response)
+        if missing:
+            try:
+                repair = await client.messages.create(**_repair_request(analysis, missing, form_data))
+                analysis = _merge_repair(analysis, missing, repair)
+            except Exception as e:
+                print(f"[Claude] ⚠️ Reparo falhou, mantendo análise parcial: {e}")
         
-        # Tenta parsear JSON
-        import json
-        analysis = json.loads(response_text)
-        return analysis
+        return analysis or None
         
     except Exception as e:
         print(f"⚠️ Erro ao analisar com Claude Vision: {e}")
@@ -454,585 +1667,670 @@ def generate_geometric_shapes(form):
     
     return shapes
 
-def generate_drawing_image(drawing, data, ai_analysis=None):
-    """Gera imagem PNG do desenho conceitual com análise de IA - VERSÃO MELHORADA"""
-    from PIL import ImageDraw, ImageFont
+@app.route('/api/generate-pdf/<session_id>', methods=['GET'])
+def generate_pdf(session_id):
+    """Gera PDF do desenho conceitual"""
     
-    # Análise dos dados para desenho mais preciso
-    form = data['form']
+    data = session_data.get(session_id)
+    if data is None:
+        return jsonify({'error': 'Sessão não encontrada'}), 404
     
-    # Cria canvas maior com proporção melhor - 1200x800
-    img = Image.new('RGB', (1200, 800), color=(255, 255, 255))  # fundo branco puro
-    draw = ImageDraw.Draw(img)
+    data['last_access'] = time.time()
     
-    # Configuração de cores profissionais
-    cor_principal = (70, 100, 90)  # verde-escuro elegante
-    cor_secundaria = (120, 160, 140)  # verde-médio
-    cor_texto = (30, 30, 30)  # quase preto
-    cor_titulo = (50, 50, 50)  # cinza escuro
-    cor_grid = (240, 240, 240)  # cinza muito claro
-    cor_recorte = (200, 50, 50)  # vermelho para recortes
-    cor_medida = (100, 100, 180)  # azul para medidas
+    if 'drawing' not in data:
+        return jsonify({'error': 'Desenho não foi gerado ainda'}), 400
     
-    # === CABEÇALHO ===
-    try:
-        # Tenta usar fonte TrueType, senão usa padrão
-        font_titulo = ImageFont.truetype("arial.ttf", 24)
-        font_subtitulo = ImageFont.truetype("arial.ttf", 16)
-        font_texto = ImageFont.truetype("arial.ttf", 12)
-        font_nota = ImageFont.truetype("arial.ttf", 10)
-    except:
-        font_titulo = ImageFont.load_default()
-        font_subtitulo = ImageFont.load_default()
-        font_texto = ImageFont.load_default()
-        font_nota = ImageFont.load_default()
-    
-    # Título
-    draw.text((30, 20), "MARMOVIEW - DESENHO CONCEITUAL", fill=cor_titulo, font=font_titulo)
-    
-    # Linha divisória
-    draw.line([(30, 55), (1170, 55)], fill=cor_grid, width=2)
-    
-    # Informações do projeto
-    y = 70
-    info_text = f"Ambiente: {drawing['environment'].upper()}"
-    draw.text((30, y), info_text, fill=cor_texto, font=font_subtitulo)
-    
-    y = 95
-    formato_text = f"Configuração: {drawing['format']}"
-    draw.text((30, y), formato_text, fill=cor_texto, font=font_texto)
-    
-    # Elementos identificados
-    if drawing['elements'] and drawing['elements'][0] != 'nenhum':
-        y = 115
-        elementos = ', '.join([e.capitalize() for e in drawing['elements'][:5]])
-        draw.text((30, y), f"Elementos: {elementos}", fill=cor_secundaria, font=font_texto)
-    
-    # Mostra se análise IA foi aplicada
-    if ai_analysis and 'confidence' in ai_analysis:
-        y = 135
-        ai_confidence = ai_analysis.get('confidence', 0)
-        draw.text((30, y), f"✓ Análise IA aplicada - Confiança: {ai_confidence}%", 
-                 fill=cor_principal, font=font_texto)
-        y_offset = 170
-    else:
-        y = 135
-        draw.text((30, y), "⚠ Desenho baseado em formulário (sem análise de IA)", 
-                 fill=(150, 150, 150), font=font_nota)
-        y_offset = 160
-    
-    # === ÁREA DE DESENHO PRINCIPAL ===
-    canvas_x = 50
-    canvas_y = y_offset
-    canvas_width = 1100
-    canvas_height = 500
-    
-    # Fundo da área de desenho
-    draw.rectangle([canvas_x, canvas_y, canvas_x + canvas_width, canvas_y + canvas_height], 
-                   fill=(250, 250, 250), outline=cor_titulo, width=2)
-    
-    # Grid profissional mais sutil
-    grid_spacing = 50
-    for i in range(0, canvas_width, grid_spacing):
-        draw.line([canvas_x + i, canvas_y, canvas_x + i, canvas_y + canvas_height], 
-                 fill=cor_grid, width=1)
-    for i in range(0, canvas_height, grid_spacing):
-        draw.line([canvas_x, canvas_y + i, canvas_x + canvas_width, canvas_y + i], 
-                 fill=cor_grid, width=1)
-    
-    # === DESENHO DA CONFIGURAÇÃO ===
-    margin_x = 100
-    margin_y = 50
-    drawing_area_width = canvas_width - 2 * margin_x
-    drawing_area_height = canvas_height - 2 * margin_y
-    base_x = canvas_x + margin_x
-    base_y = canvas_y + margin_y
-    
-    # Desenha baseado na configuração e análise IA
-    if ai_analysis and 'stone_layout' in ai_analysis:
-        draw_intelligent_layout(draw, ai_analysis, canvas_y, canvas_width, canvas_height, 
-                               cor_principal, cor_titulo, cor_texto, canvas_x, font_texto)
+    download_name = f'marmoview_desenho_{session_id[:8]}.pdf'
+    return send_blob(session_pdf(session_id, data), 'application/pdf', download_name)
+
+def pdf_source(data):
+    """Desenho de que o PDF da sessão deriva (cena revisada ou PNG gerado)"""
+    return data.get('scene_digest') or data.get('drawing_digest')
+
+def pdf_is_current(data):
+    """O PDF guardado na sessão ainda corresponde ao desenho atual?"""
+    return bool(data.get('pdf_digest')) and data.get('pdf_source') == pdf_source(data)
+
+def session_pdf(session_id, data):
+    """Digest do PDF do desenho atual da sessão, renderizado só se ainda não existir"""
+    
+    # PDF já gerado para este desenho: reaproveita o blob
+    if pdf_is_current(data):
+        metrics.cache('pdf', True)
     else:
-        # Desenho melhorado baseado no formato
-        draw_improved_format(draw, form['format'], base_x, base_y, drawing_area_width, 
-                           drawing_area_height, cor_principal, cor_secundaria, cor_titulo, font_texto)
+        metrics.cache('pdf', False)
         
-        # Adiciona elementos de pedra
-        draw_improved_elements(draw, form['stoneElements'], base_x, base_y, 
-                              drawing_area_width, drawing_area_height, cor_secundaria, font_nota)
+        # Renderiza o PDF com a cena vetorial (no pool de processos, se configurado)
+        pdf_bytes = render_pdf(data['drawing'], session_id, session_scene(data))
         
-        # Adiciona recortes
-        draw_improved_cutouts(draw, form['cutouts'], base_x, base_y, 
-                            drawing_area_width, drawing_area_height, cor_recorte, font_nota)
-    
-    # === INFORMAÇÕES ADICIONAIS ===
-    y = canvas_y + canvas_height + 20
-    
-    # Recortes identificados
-    if drawing['cutouts'] and drawing['cutouts'][0] != 'nenhum':
-        recortes = ', '.join([c.capitalize() for c in drawing['cutouts'][:5]])
-        draw.text((canvas_x, y), f"Recortes previstos: {recortes}", 
-                 fill=cor_recorte, font=font_texto)
-        y += 20
-    
-    # === AVISOS IMPORTANTES ===
-    y += 10
-    draw.rectangle([canvas_x, y, canvas_x + canvas_width, y + 60], 
-                   fill=(255, 245, 240), outline=cor_recorte, width=2)
-    
-    y += 10
-    draw.text((canvas_x + 20, y), "⚠️  IMPORTANTE - DESENHO CONCEITUAL", 
-             fill=cor_recorte, font=font_subtitulo)
-    y += 25
-    draw.text((canvas_x + 20, y), 
-             "• Não utilizar para fabricação • Requer medição precisa em campo • Sem escala exata", 
-             fill=cor_texto, font=font_nota)
-    
-    # === RODAPÉ ===
-    draw.text((30, 775), f"MarmoView v1.0 - Gerado em {datetime.now().strftime('%d/%m/%Y %H:%M')}", 
-             fill=(180, 180, 180), font=font_nota)
-    draw.text((900, 775), f"Sessão: {data.get('session_id', 'N/A')[:12]}", 
-             fill=(180, 180, 180), font=font_nota)
-    
-    # Salva em buffer
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG', quality=95)
-    buffer.seek(0)
-    
-    return buffer.read()
-
-def draw_improved_format(draw, format_type, base_x, base_y, width, height, cor_principal, cor_secundaria, cor_borda, font):
-    """Desenha configuração de formato melhorada e proporcional"""
-    
-    # Mapeamento de formatos
-    format_map = {
-        'reto': 'Reto/Linear',
-        'l': 'Em L',
-        'u': 'Em U',
-        'ilha': 'Ilha Central',
-        'pensula': 'Península',
-        'irregular': 'Irregular'
+        # Guarda o PDF como blob da sessão (em disco, se BLOB_BACKEND=disk)
+        store_artifact(data, session_id, 'pdf', pdf_bytes)
+        data['pdf_source'] = pdf_source(data)
+    
+    # Atualiza status
+    data['status'] = 'pdf_generated'
+    session_data.save(session_id, data)
+    return data['pdf_digest']
+
+def render_session_drawing(data):
+    """PNG do desenho sem alterar a sessão: o blob guardado ou rasterizado da cena (None se não houver)"""
+    digest = data.get('drawing_digest')
+    if digest and digest in blob_store:
+        return blob_store.get(digest)
+    scene = session_scene(data)
+    return render_drawing(scene) if scene is not None else None
+
+def render_session_pdf(session_id, data):
+    """PDF do desenho atual sem alterar a sessão: o blob guardado, se ainda vale, ou renderizado na hora"""
+    if pdf_is_current(data) and data['pdf_digest'] in blob_store:
+        return blob_store.get(data['pdf_digest'])
+    return render_pdf(data['drawing'], session_id, session_scene(data))
+
+# --- Exportação em lote ---
+
+def prepare_export(session_id):
+    """
+    Worker da exportação: lê a sessão e obtém o PNG e o PDF do desenho.
+    Só lê: status, digests e blobs da sessão ficam como estão.
+    Retorna (sessão, {tipo: bytes}) ou (None, {}) se a sessão não existir.
+    """
+    data = session_data.get(session_id)
+    if data is None:
+        return None, {}
+    artifacts = {}
+    if 'drawing' in data:
+        artifacts['drawing'] = render_session_drawing(data)
+        artifacts['pdf'] = render_session_pdf(session_id, data)
+    return data, artifacts
+
+def export_session_entries(archive, session_id, data, artifacts):
+    """Entradas de uma sessão no ZIP: fotos originais, desenho, PDF e análise"""
+    folder = f'{session_id}/'
+    for i, img in enumerate(data.get('images', []), 1):
+        if img['digest'] in blob_store:
+            yield from archive.add(f"{folder}fotos/{i:02d}_{img['filename']}",
+                                   blob_store.get(img['digest']))
+    for kind, name in (('drawing', 'desenho.png'), ('pdf', 'desenho.pdf')):
+        if artifacts.get(kind) is not None:
+            yield from archive.add(folder + name, artifacts[kind])
+    analysis = {
+        'session_id': session_id,
+        'status': data.get('status'),
+        'version': data.get('version', 0),
+        'created_at': data.get('created_at'),
+        'form': data.get('form'),
+        'drawing': {k: v for k, v in (data.get('drawing') or {}).items() if k != 'ai_analysis'} or None,
+        'ai_analysis': data.get('ai_analysis'),
     }
+    yield from archive.add(folder + 'analise.json',
+                           json.dumps(analysis, ensure_ascii=False, indent=2).encode('utf-8'),
+                           compress=True)
+
+def export_archive(session_ids):
+    """
+    Gera o ZIP das sessões em streaming. PNG/PDF são preparados em paralelo no
+    export_executor com no máximo 2×EXPORT_WORKERS sessões em andamento, e cada
+    sessão entra no arquivo assim que fica pronta (fora da ordem pedida).
+    O manifest.json no fim lista o que foi exportado e os erros.
+    """
+    archive = ZipStream()
+    manifest = []
+    queue = iter(session_ids)
+    pending = {}
+    
+    def fill():
+        while len(pending) < 2 * EXPORT_WORKERS:
+            session_id = next(queue, None)
+            if session_id is None:
+                return
+            pending[export_executor.submit(prepare_export, session_id)] = session_id
     
-    if format_type == 'reto':
-        # Bancada linear - ocupa 80% da largura
-        w = int(width * 0.8)
-        h = int(height * 0.25)
-        x = base_x + (width - w) // 2
-        y = base_y + height // 3
-        
-        # Bancada principal
-        draw.rectangle([x, y, x + w, y + h], outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x + 10, y + 10), "BANCADA", fill=cor_borda, font=font)
-        
-        # Linha de parede atrás
-        draw.line([base_x, y - 20, base_x + width, y - 20], fill=cor_borda, width=3)
-        draw.text((base_x + 10, y - 35), "PAREDE", fill=(150, 150, 150), font=font)
-        
-    elif format_type == 'l':
-        # Configuração em L
-        # Bancada horizontal
-        w1 = int(width * 0.6)
-        h1 = int(height * 0.2)
-        x1 = base_x + 50
-        y1 = base_y + 50
-        draw.rectangle([x1, y1, x1 + w1, y1 + h1], outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x1 + 10, y1 + 10), "BANCADA 1", fill=cor_borda, font=font)
-        
-        # Bancada vertical (perpendicular)
-        w2 = int(height * 0.2)
-        h2 = int(height * 0.5)
-        x2 = x1
-        y2 = y1 + h1
-        draw.rectangle([x2, y2, x2 + w2, y2 + h2], outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x2 + 10, y2 + 20), "BANCADA 2", fill=cor_borda, font=font)
-        
-        # Paredes
-        draw.line([base_x, y1 - 15, base_x + width, y1 - 15], fill=cor_borda, width=2)
-        draw.line([x2 - 15, y1, x2 - 15, base_y + height], fill=cor_borda, width=2)
-        
-    elif format_type == 'u':
-        # Configuração em U
-        espessura = int(height * 0.18)
-        
-        # Bancada direita
-        x1 = base_x + 50
-        y1 = base_y + 40
-        h1 = int(height * 0.7)
-        draw.rectangle([x1, y1, x1 + espessura, y1 + h1], 
-                      outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x1 + 5, y1 + 20), "BANC.\nLAT.", fill=cor_borda, font=font)
-        
-        # Bancada central (fundo)
-        x2 = x1
-        y2 = y1
-        w2 = int(width * 0.7)
-        draw.rectangle([x2, y2, x2 + w2, y2 + espessura], 
-                      outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x2 + w2//2 - 30, y2 + 10), "BANCADA FUNDO", fill=cor_borda, font=font)
-        
-        # Bancada esquerda
-        x3 = x2 + w2 - espessura
-        y3 = y2
-        draw.rectangle([x3, y3, x3 + espessura, y3 + h1], 
-                      outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x3 + 5, y3 + 20), "BANC.\nLAT.", fill=cor_borda, font=font)
-        
-    elif format_type == 'ilha':
-        # Ilha central com bancadas laterais
-        # Ilha no centro
-        ilha_w = int(width * 0.4)
-        ilha_h = int(height * 0.35)
-        ilha_x = base_x + (width - ilha_w) // 2
-        ilha_y = base_y + (height - ilha_h) // 2
-        draw.rectangle([ilha_x, ilha_y, ilha_x + ilha_w, ilha_y + ilha_h], 
-                      outline=cor_principal, fill=cor_secundaria, width=5)
-        draw.text((ilha_x + ilha_w//2 - 20, ilha_y + ilha_h//2), "ILHA", fill=cor_borda, font=font)
-        
-        # Bancada na parede
-        banc_w = int(width * 0.6)
-        banc_h = int(height * 0.15)
-        banc_x = base_x + (width - banc_w) // 2
-        banc_y = base_y + 30
-        draw.rectangle([banc_x, banc_y, banc_x + banc_w, banc_y + banc_h], 
-                      outline=cor_secundaria, fill=(200, 220, 210), width=3)
-        draw.text((banc_x + 10, banc_y + 5), "BANCADA PAREDE", fill=cor_borda, font=font)
-        
-    elif format_type == 'pensula':
-        # Península - bancada principal + extensão
-        # Bancada na parede
-        w1 = int(width * 0.7)
-        h1 = int(height * 0.2)
-        x1 = base_x + 40
-        y1 = base_y + 40
-        draw.rectangle([x1, y1, x1 + w1, y1 + h1], 
-                      outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x1 + 10, y1 + 10), "BANCADA PRINCIPAL", fill=cor_borda, font=font)
-        
-        # Península (perpendicular)
-        w2 = int(height * 0.25)
-        h2 = int(height * 0.45)
-        x2 = x1 + w1 - w2
-        y2 = y1 + h1
-        draw.rectangle([x2, y2, x2 + w2, y2 + h2], 
-                      outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((x2 + 10, y2 + 20), "PENÍNSULA", fill=cor_borda, font=font)
+    try:
+        fill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                session_id = pending.pop(future)
+                first = len(archive.names)
+                try:
+                    data, artifacts = future.result()
+                    if data is None:
+                        manifest.append({'session_id': session_id, 'error': 'Sessão não encontrada'})
+                        continue
+                    yield from export_session_entries(archive, session_id, data, artifacts)
+                    manifest.append({'session_id': session_id, 'status': data.get('status'),
+                                     'files': archive.names[first:]})
+                except Exception as e:
+                    print(f"[Exportação] ❌ Sessão {session_id[:8]}: {e}")
+                    manifest.append({'session_id': session_id, 'error': str(e),
+                                     'files': archive.names[first:]})
+            fill()
         
-    else:
-        # Formato irregular - polígono assimétrico
-        points = [
-            (base_x + 100, base_y + 80),
-            (base_x + width - 150, base_y + 50),
-            (base_x + width - 100, base_y + height - 150),
-            (base_x + width - 250, base_y + height - 80),
-            (base_x + 80, base_y + height - 100)
-        ]
-        draw.polygon(points, outline=cor_principal, fill=cor_secundaria, width=4)
-        draw.text((base_x + width//2 - 50, base_y + height//2), 
-                 "FORMATO IRREGULAR", fill=cor_borda, font=font)
+        yield from archive.add('manifest.json',
+                               json.dumps({'sessions': manifest, 'exported_at': time.time()},
+                                          ensure_ascii=False, indent=2).encode('utf-8'),
+                               compress=True)
+        yield archive.close()
+        print(f"[Exportação] {len(manifest)} sessões, {len(archive.names)} arquivos")
+    finally:
+        # Cliente desconectou: não prepara o que ainda não começou
+        for future in pending:
+            future.cancel()
 
-def draw_improved_elements(draw, elements, base_x, base_y, width, height, cor, font):
-    """Desenha elementos de pedra melhorados"""
-    if not elements or elements[0] == 'nenhum':
-        return
-    
-    # Posiciona elementos de forma distribuída
-    element_positions = {
-        'bancada': (base_x + width * 0.3, base_y + height * 0.3),
-        'pia': (base_x + width * 0.5, base_y + height * 0.4),
-        'cooktop': (base_x + width * 0.6, base_y + height * 0.35),
-        'mesa': (base_x + width * 0.4, base_y + height * 0.6),
-        'soleira': (base_x + width * 0.7, base_y + height * 0.2)
-    }
+def export_session_ids(params):
+    """IDs pedidos (session_ids) ou da faixa since/until/status/env; ValueError se inválido"""
+    ids = params.get('session_ids')
+    if isinstance(ids, str):
+        ids = [i for i in ids.split(',') if i]
+    if ids is None:
+        since, until = parse_timestamp(params.get('since')), parse_timestamp(params.get('until'))
+        if since is None and until is None:
+            raise ValueError('Informe session_ids ou uma faixa since/until')
+        ids, cursor = [], None
+        while len(ids) <= EXPORT_MAX_SESSIONS:
+            entries, cursor = session_data.list_sessions(
+                status=params.get('status') or None, env_type=params.get('env') or None,
+                since=since, until=until, cursor=cursor, limit=SESSIONS_PAGE_LIMIT)
+            ids.extend(entry['id'] for entry in entries)
+            if not cursor:
+                break
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        raise ValueError('session_ids deve ser uma lista de IDs')
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > EXPORT_MAX_SESSIONS:
+        raise ValueError(f'No máximo {EXPORT_MAX_SESSIONS} sessões por exportação')
+    return ids
+
+@app.route('/api/export', methods=['GET', 'POST'])
+def export_sessions():
+    """
+    Exporta várias sessões num ZIP enviado em streaming.
+    POST {"session_ids": [...]} ou {"since": ..., "until": ..., "status": ..., "env": ...};
+    GET aceita os mesmos campos na query (session_ids separados por vírgula).
+    """
+    denied = admin_denied()
+    if denied is not None:
+        return denied
     
-    for element in elements[:4]:
-        if element in element_positions:
-            x, y = element_positions[element]
-            # Desenha ícone do elemento
-            draw.ellipse([x-25, y-25, x+25, y+25], outline=cor, width=3)
-            draw.text((x-20, y-5), element[:3].upper(), fill=cor, font=font)
+    params = request.get_json(silent=True) if request.method == 'POST' else None
+    try:
+        session_ids = export_session_ids(params or request.args.to_dict())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not session_ids:
+        return jsonify({'error': 'Nenhuma sessão para exportar'}), 404
+    
+    download_name = f"marmoview_exportacao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return Response(export_archive(session_ids), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{download_name}"',
+        'X-Accel-Buffering': 'no',  # nginx: repassa os pedaços sem acumular
+    })
 
-def draw_improved_cutouts(draw, cutouts, base_x, base_y, width, height, cor, font):
-    """Desenha recortes melhorados"""
-    if not cutouts or cutouts[0] == 'nenhum':
-        return
+@app.route('/api/session/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """
+    Retorna dados da sessão (sem as imagens base64 para economizar).
+    ?fields=status,drawing.title  só os campos pedidos (caminhos com ponto)
+    ?view=summary                 resumo compacto: status, versão, digests e tamanhos
+    Lê uma cópia rasa da sessão (snapshot): outras threads podem estar
+    alterando o registro enquanto a resposta é montada.
+    """
     
-    # Posiciona recortes estrategicamente
-    cutout_positions = []
-    spacing_x = width // (len(cutouts) + 1)
+    data = session_data.snapshot(session_id)
+    if data is None:
+        return jsonify({'error': 'Sessão não encontrada'}), 404
     
-    for i, cutout in enumerate(cutouts[:5]):
-        x = base_x + spacing_x * (i + 1)
-        y = base_y + height * 0.4
-        
-        # Desenha marca de recorte
-        size = 20
-        draw.ellipse([x-size, y-size, x+size, y+size], 
-                    outline=cor, fill=(255, 220, 220), width=3)
-        
-        # Label
-        label = cutout[:4].upper() if cutout != 'nenhum' else ''
-        draw.text((x-15, y-8), label, fill=cor, font=font)
-
-def draw_intelligent_layout(draw, ai_analysis, canvas_y, canvas_width, canvas_height, cor_principal, cor_borda, cor_texto, canvas_x, font):
-    """Desenha layout inteligente baseado na análise da IA"""
+    fields = request.args.get('fields')
+    if fields:
+        return jsonify(project_session(data, [f for f in fields.split(',') if f]))
+    if request.args.get('view') == 'summary':
+        return jsonify(session_summary(session_id, data))
     
-    # Offset base para desenho (margem da área de desenho)
-    x_base = canvas_x
-    y_base = canvas_y
+    # Visão completa: metadados leves das imagens no lugar dos registros inteiros
+    return jsonify({key: session_images(value) if key == 'images' else value
+                    for key, value in data.items()})
+
+def session_images(images):
+    return [{'filename': img['filename'], 'digest': img['digest'],
+             'width': img['width'], 'height': img['height'], 'quality': img.get('quality')}
+            for img in images]
+
+def project_session(data, fields):
+    """
+    {caminho: valor} dos caminhos pedidos ('status', 'drawing.title', 'images.0.digest');
+    caminhos inexistentes são omitidos. As chaves ficam planas para que nenhum
+    dict da sessão seja montado ou alterado na resposta.
+    """
+    result = {}
+    for path in fields:
+        value = data
+        for key in path.split('.'):
+            if isinstance(value, dict) and key in value:
+                value = value[key]
+            elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+                value = value[int(key)]
+            else:
+                break
+        else:
+            result[path] = session_images(value) if path == 'images' else value
+    return result
+
+SESSION_ARTIFACTS = {
+    'drawing': '/api/drawing-image/{}',
+    'svg': '/api/drawing-svg/{}',
+    'pdf': '/api/generate-pdf/{}',
+    'scene': None,
+}
+
+def session_summary(session_id, data):
+    """Resumo para polling: tamanhos e digests já gravados na sessão (sem ler blobs)"""
+    sizes = data.get('artifact_bytes', {})
+    drawing = data.get('drawing') or {}
+    return {
+        'session_id': session_id,
+        'status': data.get('status'),
+        'version': data.get('version', 0),
+        'created_at': data.get('created_at'),
+        'last_access': data.get('last_access'),
+        'images': [{'digest': img['digest'], 'bytes': img.get('size')}
+                   for img in data.get('images', ())],
+        'drawing': {'title': drawing.get('title'), 'format': drawing.get('format'),
+                    'source': data.get('drawing_source')} if drawing else None,
+        'artifacts': {kind: {'digest': data[f'{kind}_digest'], 'bytes': sizes.get(kind),
+                             'url': url.format(session_id) if url else None}
+                      for kind, url in SESSION_ARTIFACTS.items() if f'{kind}_digest' in data},
+        'error': data.get('error'),
+    }
+
+SESSIONS_PAGE_LIMIT = 200
+
+def parse_timestamp(value):
+    """Timestamp Unix ou data/hora ISO (2024-05-01, 2024-05-01T08:00) -> segundos"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/api/sessions', methods=['GET'])
+def list_sessions():
+    """
+    Listagem das sessões para o back-office, das mais recentes para as mais
+    antigas, a partir do índice do armazenamento (sem ler os registros).
+    ?status=uploaded&env=cozinha&since=2024-05-01&until=...&limit=50&cursor=...
+    ?counts=1 inclui o total de sessões por status.
+    """
+    denied = admin_denied()
+    if denied is not None:
+        return denied
     
+    limit = min(max(request.args.get('limit', 50, type=int), 1), SESSIONS_PAGE_LIMIT)
     try:
-        stone_layout = ai_analysis.get('stone_layout', {})
-        positions = stone_layout.get('positions', [])
+        entries, next_cursor = session_data.list_sessions(
+            status=request.args.get('status') or None,
+            env_type=request.args.get('env') or None,
+            since=parse_timestamp(request.args.get('since')),
+            until=parse_timestamp(request.args.get('until')),
+            cursor=request.args.get('cursor'),
+            limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Há quanto tempo cada sessão está parada (sessões presas em uploaded etc.)
+    now = time.time()
+    for entry in entries:
+        entry['idle_seconds'] = round(now - entry['last_access'], 1) if entry.get('last_access') else None
+    
+    response = {'sessions': entries, 'next_cursor': next_cursor}
+    if request.args.get('counts') in ('1', 'true'):
+        response['counts'] = session_data.status_counts()
+    return jsonify(response)
+
+# --- Revisões incrementais ---
+
+# Etapas que cada campo do formulário invalida numa revisão:
+#   drawing   descrição e cena vetorial (recalculadas em microssegundos)
+#   ai_layout posições sugeridas pela IA (stone_layout, cutouts_positions);
+#             o desenho passa a seguir o formulário
+#   provider  a imagem do DALL-E/Hugging Face deixa de representar o pedido
+# A análise do Claude não é refeita: ela também leu os campos do formulário
+# (build_analysis_request), então fica desatualizada depois de uma revisão,
+# mas mantê-la evita uma nova ida à IA. Por isso os campos de geometria
+# descartam o layout dela (ai_layout) e o desenho segue o formulário revisado.
+REVISION_FIELDS = {
+    'envType': {'drawing', 'provider'},
+    'format': {'drawing', 'ai_layout', 'provider'},
+    'stoneElements': {'drawing', 'ai_layout'},
+    'cutouts': {'drawing', 'ai_layout'},
+    'characteristics': {'drawing'},
+}
+REVISION_LIST_FIELDS = {'stoneElements', 'cutouts'}
+
+def apply_form_delta(form, delta):
+    """
+    Aplica o delta ao formulário. Campos de lista aceitam a lista completa ou
+    {"add": [...], "remove": [...]}. Retorna {campo: {'from', 'to'}} só com o
+    que mudou; ValueError se o delta for inválido.
+    """
+    if not isinstance(delta, dict):
+        raise ValueError("'form' deve ser um objeto com os campos alterados")
+    
+    changes = {}
+    for field, value in delta.items():
+        if field not in REVISION_FIELDS:
+            raise ValueError(f"Campo não revisável: {field}")
+        current = form.get(field)
+        if field in REVISION_LIST_FIELDS:
+            if isinstance(value, dict):
+                add, remove = value.get('add', []), value.get('remove', [])
+                if set(value) - {'add', 'remove'} or not all(
+                        isinstance(items, list) and all(isinstance(v, str) for v in items)
+                        for items in (add, remove)):
+                    raise ValueError(f"'{field}': add e remove devem ser listas de textos")
+                new = [v for v in (current or []) if v not in remove]
+                new += [v for v in add if v not in new]
+            elif isinstance(value, list):
+                new = list(value)
+            else:
+                raise ValueError(f"'{field}' deve ser lista ou {{add, remove}}")
+            if not all(isinstance(v, str) for v in new):
+                raise ValueError(f"'{field}' deve conter apenas textos")
+        elif isinstance(value, str):
+            new = value
+        else:
+            raise ValueError(f"'{field}' deve ser texto")
+        if new != current:
+            changes[field] = {'from': current, 'to': new}
+    
+    for field, change in changes.items():
+        form[field] = change['to']
+    return changes
+
+def drawing_analysis(data):
+    """Análise usada no desenho (sem o layout da IA, se uma revisão o invalidou)"""
+    ai_analysis = data.get('ai_analysis')
+    if ai_analysis and data.get('ai_layout_overridden'):
+        return {k: v for k, v in ai_analysis.items()
+                if k not in ('stone_layout', 'cutouts_positions')}
+    return ai_analysis
+
+def record_version(session_id, data, kind, changes=None, note=None, changed_layers=None):
+    """
+    Incrementa a versão da sessão e registra a entrada no histórico. A entrada
+    leva os artefatos substituídos desde a versão anterior (retired_digests),
+    liberados quando ela sair do histórico.
+    """
+    if data.get('pdf_digest') and not pdf_is_current(data):
+        # PDF de uma cena anterior: não volta a ser servido
+        retire_artifact(data, data.pop('pdf_digest'))
+        data['artifact_bytes'] = {k: v for k, v in data.get('artifact_bytes', {}).items() if k != 'pdf'}
+    data['version'] = data.get('version', 0) + 1
+    # Lista nova em vez de append: leitores concorrentes podem estar percorrendo a atual
+    entry = {
+        'version': data['version'],
+        'kind': kind,
+        'at': time.time(),
+        'changes': changes or {},
+        'note': note,
+        'changed_layers': changed_layers or [],
+        'scene_digest': data.get('scene_digest'),
+        'retired_digests': data.pop('retired_digests', []),
+    }
+    revisions = data.get('revisions', []) + [entry]
+    data['revisions'] = revisions[-REVISION_HISTORY_LIMIT:]
+    release_versions(session_id, data, revisions[:-REVISION_HISTORY_LIMIT])
+
+def release_versions(session_id, data, entries):
+    """
+    Solta as referências da sessão aos blobs das versões que saíram do
+    histórico (cena e artefatos substituídos), exceto os ainda em uso: artefatos
+    atuais, fotos e cenas das versões que ficaram
+    """
+    live = {data.get(f'{kind}_digest') for kind in ('drawing', 'scene', 'svg', 'pdf')}
+    live.update(entry.get('scene_digest') for entry in data['revisions'])
+    live.update(img['digest'] for img in data['images'])
+    stale = {digest for entry in entries
+             for digest in [entry.get('scene_digest'), *entry.get('retired_digests', [])]}
+    freed = [digest for digest in stale - live if digest and blob_store.discard(digest, session_id)]
+    if freed:
+        print(f"[Revisão] Sessão {session_id[:8]}: {len(freed)} blob(s) de versões antigas liberado(s)")
+
+@app.route('/api/session/<session_id>', methods=['PATCH'])
+def revise_session(session_id):
+    """
+    Revisão incremental do desenho: aplica deltas do formulário e refaz só as
+    etapas que dependem dos campos alterados (sem nova análise nem provedor).
+    A cena e o SVG são refeitos inteiros (menos de 1 ms); o PNG local é
+    rasterizado inteiro, e só quando pedido. `changed_layers` apenas informa
+    quais camadas mudaram: redesenhar só a área delas sobre o PNG anterior não
+    compensa, porque decodificar e recodificar o PNG custa o mesmo que rasterizar.
+    Corpo: {"form": {...}, "note": "...", "base_version": N}
+    """
+    started = time.perf_counter()
+    
+    payload = request.get_json(silent=True) or {}
+    
+    # Sob _generation_lock: uma geração não começa no meio da revisão, e uma
+    # geração em andamento (que gravaria o formulário antigo) impede a revisão
+    with _generation_lock:
+        data = session_data.get(session_id)
+        if data is None:
+            return jsonify({'error': 'Sessão não encontrada'}), 404
+        if generation_running(data):
+            return jsonify({'error': 'Geração em andamento; revise quando ela terminar',
+                            'status': 'generating', 'status_url': f'/api/session/{session_id}'}), 409
         
-        # Desenha cada elemento de pedra nas posições especificadas pela IA
-        for pos in positions:
-            element = pos.get('element', '')
-            x_start = pos.get('x_start', 0)
-            x_end = pos.get('x_end', 100)
-            y_start = pos.get('y_start', 0)
-            y_end = pos.get('y_end', 100)
-            
-            # Converte porcentagem para coordenadas reais
-            x1 = x_base + int((x_start / 100) * canvas_width)
-            x2 = x_base + int((x_end / 100) * canvas_width)
-            y1 = y_base + int((y_start / 100) * canvas_height)
-            y2 = y_base + int((y_end / 100) * canvas_height)
-            
-            # Desenha retângulo do elemento com preenchimento
-            draw.rectangle([x1, y1, x2, y2], 
-                          outline=cor_principal, fill=(200, 220, 210), width=4)
-            
-            # Adiciona label do elemento
-            label_y = y1 - 20 if y1 > y_base + 30 else y1 + 5
-            draw.text((x1 + 10, label_y), element.upper(), fill=cor_principal, font=font)
+        base_version = payload.get('base_version')
+        if base_version is not None and base_version != data.get('version', 0):
+            return jsonify({'error': 'A sessão foi alterada por outra revisão',
+                            'version': data.get('version', 0)}), 409
         
-        # Desenha recortes nas posições especificadas
-        cutouts = ai_analysis.get('cutouts_positions', [])
-        for cutout in cutouts:
-            cutout_type = cutout.get('type', '')
-            x = cutout.get('x', 50)
-            y = cutout.get('y', 50)
-            size = cutout.get('size', 'médio')
-            
-            # Converte para coordenadas
-            cx = x_base + int((x / 100) * canvas_width)
-            cy = y_base + int((y / 100) * canvas_height)
-            
-            # Tamanho do círculo baseado no tipo
-            radius = 15 if size == 'pequeno' else 25 if size == 'médio' else 35
+        try:
+            form = dict(data['form'])
+            changes = apply_form_delta(form, payload.get('form', {}))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        data['form'] = form
+        
+        data['last_access'] = time.time()
+        invalidated = set().union(*(REVISION_FIELDS[field] for field in changes))
+        layers = []
+        
+        if changes:
+            if 'ai_layout' in invalidated and data.get('ai_analysis'):
+                data['ai_layout_overridden'] = True
             
-            # Desenha círculo vermelho para recorte
-            draw.ellipse([cx - radius, cy - radius, cx + radius, cy + radius],
-                        outline=(200, 50, 50), fill=(255, 200, 200), width=3)
+            if 'drawing' in data:
+                ai_analysis = drawing_analysis(data)
+                drawing_description = create_conceptual_drawing(data, ai_analysis)
+                scene = build_scene(drawing_description, data['form'], ai_analysis, session_id)
+                layers = scene_changed_layers(session_scene(data), scene)
+                
+                data['drawing'] = drawing_description
+                store_artifact(data, session_id, 'scene', scene_json(scene))
+                store_artifact(data, session_id, 'svg', render_svg(scene))
+                
+                # Imagem de provedor só continua válida se nenhum campo do prompt mudou;
+                # o PNG local é rasterizado de novo, inteiro, sob demanda (drawing-image)
+                keep_provider = data.get('drawing_source') == 'provider' and 'provider' not in invalidated
+                if layers and not keep_provider:
+                    if 'drawing_digest' in data:
+                        retire_artifact(data, data.pop('drawing_digest'))
+                    data['artifact_bytes'] = {kind: size for kind, size in data.get('artifact_bytes', {}).items()
+                                              if kind != 'drawing'}
+                    data['drawing_source'] = 'local'
+                data['status'] = 'drawing_revised'
             
-            # Label do recorte
-            draw.text((cx + radius + 5, cy - 10), cutout_type[:3].upper(), 
-                     fill=(200, 50, 50), font=font)
+            record_version(session_id, data, 'revision', changes, payload.get('note'), layers)
         
-        # Adiciona notas da IA se houver
-        drawing_instructions = ai_analysis.get('drawing_instructions', [])
-        if drawing_instructions:
-            y_note = y_base + canvas_height + 10
-            note_text = " | ".join(drawing_instructions[:2])  # Primeiras 2 instruções
-            if len(note_text) > 100:
-                note_text = note_text[:97] + "..."
-            draw.text((x_base, y_note), f"ℹ️ {note_text}", fill=cor_principal, font=font)
-            
-    except Exception as e:
-        print(f"⚠️ Erro ao desenhar layout inteligente: {e}")
-        # Se falhar, não desenha nada (grid já foi desenhado)
-
-def draw_format_shapes(draw, format_type, y_base, cor_principal, cor_borda):
-    """Desenha formas baseadas no tipo de formato"""
-    x_base = 120
-    
-    if format_type == 'Reto/Linear':
-        # Linha reta simples
-        draw.rectangle([x_base, y_base, x_base + 600, y_base + 120], 
-                      outline=cor_principal, width=3)
-    elif format_type == 'Em L':
-        # Forma em L
-        draw.rectangle([x_base, y_base, x_base + 350, y_base + 120], 
-                      outline=cor_principal, width=3)
-        draw.rectangle([x_base, y_base + 120, x_base + 150, y_base + 300], 
-                      outline=cor_principal, width=3)
-    elif format_type == 'Em U':
-        # Forma em U
-        draw.rectangle([x_base, y_base, x_base + 120, y_base + 280], 
-                      outline=cor_principal, width=3)
-        draw.rectangle([x_base + 120, y_base, x_base + 480, y_base + 120], 
-                      outline=cor_principal, width=3)
-        draw.rectangle([x_base + 360, y_base, x_base + 480, y_base + 280], 
-                      outline=cor_principal, width=3)
-    elif format_type == 'Ilha Central':
-        # Ilha central
-        draw.rectangle([x_base + 100, y_base + 80, x_base + 300, y_base + 200], 
-                      outline=cor_principal, width=3)
-        draw.rectangle([x_base, y_base, x_base + 400, y_base + 80], 
-                      outline=cor_principal, width=2)
-    elif format_type == 'Península':
-        # Península
-        draw.rectangle([x_base, y_base, x_base + 250, y_base + 120], 
-                      outline=cor_principal, width=3)
-        draw.rectangle([x_base + 200, y_base, x_base + 350, y_base + 250], 
-                      outline=cor_principal, width=3)
-    else:
-        # Formato irregular
-        pontos = [x_base, y_base, x_base + 300, y_base + 50, x_base + 450, y_base + 150,
-                 x_base + 400, y_base + 280, x_base + 100, y_base + 250]
-        draw.polygon(pontos, outline=cor_principal, fill=None, width=3)
-
-def draw_stone_elements(draw, elements, y_base, cor_principal):
-    """Desenha indicadores de elementos de pedra"""
-    x_pos = 150
-    y_pos = y_base + 200
-    
-    for i, element in enumerate(elements[:4]):
-        if i > 0:
-            x_pos += 120
-        # Desenha círculo com indicador
-        draw.ellipse([x_pos, y_pos, x_pos + 60, y_pos + 60], 
-                    outline=cor_principal, width=2)
-
-def draw_cutouts(draw, cutouts, y_base, cor_texto):
-    """Desenha indicadores de recortes"""
-    x_pos = 150
-    y_pos = y_base + 300
-    
-    for i, cutout in enumerate(cutouts[:5]):
-        if cutout == 'nenhum':
-            continue
-        if i > 0:
-            x_pos += 90
-        # Desenha pequena marca vermelha para recortes
-        draw.ellipse([x_pos, y_pos, x_pos + 30, y_pos + 30], 
-                    outline=(164, 90, 82), width=2, fill=(255, 200, 200))
-
-@app.route('/api/generate-pdf/<session_id>', methods=['GET'])
-def generate_pdf(session_id):
-    """Gera PDF do desenho conceitual"""
-    
-    if session_id not in session_data:
-        return jsonify({'error': 'Sessão não encontrada'}), 404
-    
-    data = session_data[session_id]
-    
-    if 'drawing' not in data:
-        return jsonify({'error': 'Desenho não foi gerado ainda'}), 400
+        session_data.save(session_id, data)
     
-    # Cria PDF em memória
-    pdf_buffer = io.BytesIO()
-    c = canvas.Canvas(pdf_buffer, pagesize=A4)
-    width, height = A4
-    
-    # Cabeçalho
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(2*cm, height - 2*cm, "MARMOVIEW")
-    
-    c.setFont("Helvetica", 10)
-    c.drawString(2*cm, height - 2.5*cm, f"Projeto: #{session_id[:8]}")
-    c.drawString(2*cm, height - 3*cm, f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
-    
-    # Linha divisória
-    c.line(2*cm, height - 3.5*cm, width - 2*cm, height - 3.5*cm)
-    
-    # Título do desenho
-    drawing = data['drawing']
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(2*cm, height - 4.5*cm, drawing['title'])
-    
-    # Informações do ambiente
-    y = height - 5.5*cm
-    c.setFont("Helvetica", 10)
-    c.drawString(2*cm, y, f"Ambiente: {drawing['environment']}")
-    
-    y -= 0.6*cm
-    c.drawString(2*cm, y, f"Formato: {drawing['format']}")
-    
-    y -= 0.6*cm
-    c.drawString(2*cm, y, f"Elementos: {', '.join(drawing['elements'])}")
-    
-    y -= 0.6*cm
-    if drawing['cutouts']:
-        c.drawString(2*cm, y, f"Recortes: {', '.join(drawing['cutouts'])}")
-        y -= 0.6*cm
-    
-    # Área de desenho (placeholder)
-    y -= 1*cm
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(2*cm, y, "Desenho Conceitual:")
-    
-    y -= 1*cm
-    # Desenha retângulo representando área de desenho
-    c.rect(2*cm, y - 10*cm, width - 4*cm, 10*cm)
-    
-    # Formas geométricas simples
-    c.setFont("Helvetica", 9)
-    shapes_text = " | ".join([s['description'] for s in drawing['shapes']])
-    c.drawString(2.5*cm, y - 5*cm, shapes_text)
-    
-    # Características descritas
-    y = y - 11*cm
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(2*cm, y, "Características Observadas:")
-    
-    y -= 0.6*cm
-    c.setFont("Helvetica", 9)
-    # Quebra texto em linhas
-    char_text = drawing['characteristics'][:200]  # Limita caracteres
-    c.drawString(2.5*cm, y, char_text)
-    
-    # Avisos legais
-    y -= 2*cm
-    c.setFont("Helvetica-Bold", 11)
-    c.setFillColorRGB(0.7, 0, 0)
-    c.drawString(2*cm, y, "AVISOS IMPORTANTES:")
-    
-    y -= 0.7*cm
-    c.setFont("Helvetica", 9)
-    c.setFillColorRGB(0, 0, 0)
-    for note in drawing['notes']:
-        c.drawString(2.5*cm, y, f"• {note}")
-        y -= 0.5*cm
-    
-    # Rodapé
-    c.setFont("Helvetica", 8)
-    c.drawString(2*cm, 2*cm, "MarmoView v1.0.0 - Sistema IA para Marmoraria")
-    c.drawString(2*cm, 1.5*cm, '"Quem mede, manda." - Desenho requer validacao em campo.')
-    
-    c.save()
-    
-    # Prepara para envio
-    pdf_buffer.seek(0)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+    print(f"[Revisão] Sessão {session_id[:8]} v{data.get('version', 0)}: "
+          f"{', '.join(changes) or 'sem alterações'} ({elapsed_ms} ms)")
     
-    # Atualiza status
-    session_data[session_id]['status'] = 'pdf_generated'
-    
-    return send_file(
-        pdf_buffer,
-        mimetype='application/pdf',
-        as_attachment=True,
-        download_name=f'marmoview_desenho_{session_id[:8]}.pdf'
-    )
+    return jsonify({
+        'success': True,
+        'session_id': session_id,
+        'version': data.get('version', 0),
+        'changes': changes,
+        'invalidated': sorted(invalidated),
+        'changed_layers': layers,
+        'drawing_url': f'/api/drawing-image/{session_id}',
+        'svg_url': f'/api/drawing-svg/{session_id}',
+        'elapsed_ms': elapsed_ms
+    })
 
-@app.route('/api/session/<session_id>', methods=['GET'])
-def get_session(session_id):
-    """Retorna dados da sessão (sem as imagens base64 para economizar)"""
+@app.route('/api/session/<session_id>/revisions', methods=['GET'])
+def get_revisions(session_id):
+    """Histórico de versões da sessão (gerações e revisões)"""
     
-    if session_id not in session_data:
+    data = session_data.get(session_id)
+    if data is None:
         return jsonify({'error': 'Sessão não encontrada'}), 404
     
-    data = session_data[session_id].copy()
-    
-    # Remove dados pesados das imagens
-    if 'images' in data:
-        data['images'] = [
-            {'filename': img['filename'], 'width': img['width'], 'height': img['height']}
-            for img in data['images']
-        ]
-    
-    return jsonify(data)
+    return jsonify({
+        'session_id': session_id,
+        'version': data.get('version', 0),
+        'revisions': data.get('revisions', [])
+    })
+
+@app.route('/api/render-stats', methods=['GET'])
+def render_stats():
+    """Tempos das últimas renderizações (desenho e PDF) e ocupação do pool"""
+    return jsonify(render_pool.stats())
+
+@app.errorhandler(RateLimited)
+def handle_rate_limited(e):
+    """Cliente acima do limite de gerações"""
+    response = jsonify({'error': 'Muitas requisições, tente novamente em instantes',
+                        'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    """Todas as vagas de geração ocupadas e fila cheia (ou prazo de espera esgotado)"""
+    print(f"[Admissão] ⚠️ Requisição recusada: {e}")
+    response = jsonify({'error': 'Servidor sobrecarregado, tente novamente em instantes',
+                        'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+@app.route('/api/admission-stats', methods=['GET'])
+def admission_stats():
+    """Ocupação das vagas de geração/provedores e rejeições por limite"""
+    return jsonify({
+        'generation': generation_gate.stats(),
+        'providers': provider_gate.stats(),
+        'rate_limit': generation_limiter.stats(),
+    })
+
+# Com BLOB_BACKEND=disk, blob_store.stats() varre o spool inteiro: os gauges do
+# /metrics e o health check reaproveitam a última varredura por BLOB_STATS_TTL s
+BLOB_STATS_TTL = 1.0
+_blob_stats = (0.0, None)
+
+def blob_stats():
+    """blob_store.stats() com cache curto (uma varredura por coleta do /metrics)"""
+    global _blob_stats
+    taken_at, stats = _blob_stats
+    if stats is None or time.monotonic() - taken_at > BLOB_STATS_TTL:
+        stats = blob_store.stats()
+        _blob_stats = (time.monotonic(), stats)
+    return stats
+
+def _blob_gauge(field):
+    return lambda: blob_stats()[field]
+
+def _running_speculative():
+    """Análises especulativas ainda rodando (as concluídas esperam quem as reivindique)"""
+    return sum(not future.done() for future, _cancel in list(_speculative_jobs.values()))
+
+# Gauges lidos a cada coleta do /metrics
+metrics.gauge('sessions', "Sessões no armazenamento", lambda: len(session_data))
+metrics.gauge('blobs', "Blobs no blob store", _blob_gauge('blobs'))
+metrics.gauge('blob_bytes', "Bytes ocupados pelo blob store", _blob_gauge('bytes'))
+metrics.gauge('in_flight', "Trabalhos em andamento neste processo", lambda: {
+    'generation': len(_generation_flights),
+    'speculative_analysis': _running_speculative(),
+    'async_core': async_core.in_flight(),
+    'render': render_pool.pending(),
+}, labelname='job')
+metrics.gauge('admission_active', "Vagas ocupadas nos controles de admissão", lambda: {
+    'generation': generation_gate.stats()['active'],
+    'providers': provider_gate.stats()['active'],
+}, labelname='gate')
+metrics.gauge('startup_seconds', "Tempo de inicialização do processo", lambda: STARTUP_SECONDS)
+metrics.gauge('provider_load_seconds', "Tempo de carga (import + cliente) de cada SDK de provedor",
+              providers.load_seconds, labelname='provider')
+metrics.gauge('admission_waiting', "Requisições na fila dos controles de admissão", lambda: {
+    'generation': generation_gate.stats()['waiting'],
+}, labelname='gate')
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métricas no formato de exposição do Prometheus (p95 por etapa/provedor etc.)"""
+    return metrics.render(), 200, {'Content-Type': METRICS_CONTENT_TYPE}
+
+@app.before_request
+def start_trace():
+    if request.endpoint in TRACED_ENDPOINTS:
+        trace, g.trace_token = tracing.start(request.endpoint)
+        trace.tags['session_id'] = (request.view_args or {}).get('session_id')
+
+@app.after_request
+def finish_trace(response):
+    """Server-Timing em toda resposta rastreada; ?debug=1 inclui o trace no JSON"""
+    token = g.pop('trace_token', None)
+    if token is None:
+        return response
+    trace = tracing.end(token)
+    trace.tags['status'] = response.status_code
+    response.headers['Server-Timing'] = trace.server_timing()
+    if slow_traces.record(trace):
+        print(f"[Trace] Requisição lenta: {trace.name} {trace.duration:.1f}s ({trace.server_timing()})")
+    
+    debug = request.args.get('debug') == '1' or request.headers.get('X-Debug-Trace') == '1'
+    if debug and response.is_json:
+        payload = response.get_json()
+        if isinstance(payload, dict):
+            payload['debug'] = {'trace': trace.to_dict()}
+            response.set_data(json.dumps(payload))
+    return response
+
+def admin_denied():
+    """
+    Resposta de erro para rota de administração, ou None se autorizada.
+    Sem ADMIN_TOKEN a rota fica desativada (404); com ele, exige
+    `Authorization: Bearer ADMIN_TOKEN` (401).
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Rota de administração desativada'}), 404
+    expected = f'Bearer {ADMIN_TOKEN}'.encode()
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected):
+        return jsonify({'error': 'Não autorizado'}), 401
+    return None
+
+@app.route('/api/admin/slow-traces', methods=['GET'])
+def get_slow_traces():
+    """Traces lentos recentes (mais recentes primeiro); ?limit=N"""
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    return jsonify({
+        'threshold_seconds': slow_traces.threshold,
+        'traces': slow_traces.recent(request.args.get('limit', type=int)),
+    })
+
+@app.errorhandler(RenderQueueFull)
+@app.errorhandler(RenderTimeout)
+def handle_render_queue_full(e):
+    """Pool de renderização saturado ou lento: pede para o cliente tentar de novo"""
+    response = jsonify({'error': 'Servidor ocupado renderizando, tente novamente'})
+    response.headers['Retry-After'] = '5'
+    return response, 503
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -1040,9 +2338,99 @@ def health_check():
     return jsonify({
         'status': 'ok',
         'sessions_active': len(session_data),
+        'blobs': blob_stats(),
+        'startup_ms': round(STARTUP_SECONDS * 1000, 1),
+        'providers': providers.stats(),
         'timestamp': datetime.now().isoformat()
     })
 
+# Estado do aquecimento: pending → running → done | failed
+warmup_state = {'state': 'pending' if WARMUP else 'done', 'steps': {}, 'errors': []}
+
+def _warmup_step(name, fn, required=True):
+    """Executa uma etapa do aquecimento; falha de etapa obrigatória deixa o worker não pronto"""
+    started = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        warmup_state['errors'].append(f"{name}: {e}")
+        print(f"[Aquecimento] ⚠️ {name} falhou: {e}")
+        return not required
+    warmup_state['steps'][name] = round((time.perf_counter() - started) * 1000, 1)
+    return True
+
+def _warmup_render():
+    """Desenho e PDF de teste (com pool, um por processo do pool)"""
+    form = {'characteristics': '', 'envType': 'cozinha', 'stoneElements': ['bancada'],
+            'format': 'l', 'cutouts': ['pia']}
+    drawing = create_conceptual_drawing({'form': form, 'images': []})
+    scene = build_scene(drawing, form, None, 'aquecimento')
+    
+    def render_both(_):
+        render_drawing(scene)
+        render_pdf(drawing, 'aquecimento', scene)
+    
+    with ThreadPoolExecutor(max_workers=max(1, RENDER_POOL_SIZE)) as executor:
+        list(executor.map(render_both, range(max(1, RENDER_POOL_SIZE))))
+
+def _warmup_layouts():
+    """Percorre o layout de todos os formatos (código e caches das formas)"""
+    for fmt in ('reto', 'l', 'u', 'ilha', 'pensula', 'irregular'):
+        form = {'characteristics': '', 'envType': 'cozinha', 'stoneElements': ['bancada', 'ilha'],
+                'format': fmt, 'cutouts': ['pia']}
+        build_scene(create_conceptual_drawing({'form': form, 'images': []}), form)
+
+async def _warmup_async_clients():
+    """Clientes assíncronos: abre as conexões TLS no pool do httpx de cada um"""
+    if HAS_CLAUDE_VISION:
+        await async_core.anthropic().with_options(timeout=WARMUP_PROVIDER_TIMEOUT,
+                                                  max_retries=0).models.list(limit=1)
+    if HAS_OPENAI:
+        await async_core.openai().with_options(timeout=WARMUP_PROVIDER_TIMEOUT,
+                                               max_retries=0).models.list()
+    hf_space_url, _hf_token, use_hf_image = hf_settings()
+    if use_hf_image and hf_space_url.startswith('http'):
+        await async_core.http().head(hf_space_url, timeout=WARMUP_PROVIDER_TIMEOUT)
+
+def _warmup_providers():
+    """Cria os clientes dos provedores configurados e abre suas conexões (GET barato de modelos)"""
+    if ASYNC_PROVIDERS:
+        async_core.run(_warmup_async_clients(), timeout=WARMUP_PROVIDER_TIMEOUT * 3)
+        return
+    if HAS_CLAUDE_VISION:
+        providers.get('anthropic').with_options(timeout=WARMUP_PROVIDER_TIMEOUT,
+                                                max_retries=0).models.list(limit=1)
+    if HAS_OPENAI:
+        providers.get('openai').with_options(timeout=WARMUP_PROVIDER_TIMEOUT,
+                                             max_retries=0).models.list()
+    if hf_settings()[2]:
+        # requests abre uma conexão por chamada: só o import fica adiantado
+        providers.get('http')
+
+def run_warmup():
+    """Aquecimento do worker; provedores indisponíveis não impedem o worker de ficar pronto"""
+    warmup_state['state'] = 'running'
+    started = time.perf_counter()
+    ok = _warmup_step('fonts', preload_fonts)
+    ok = _warmup_step('layouts', _warmup_layouts) and ok
+    ok = _warmup_step('render', _warmup_render) and ok
+    if WARMUP_PROVIDERS and (HAS_CLAUDE_VISION or providers_enabled()):
+        _warmup_step('providers', _warmup_providers, required=False)
+    warmup_state['seconds'] = round(time.perf_counter() - started, 3)
+    warmup_state['state'] = 'done' if ok else 'failed'
+    print(f"[Aquecimento] {'✓ Concluído' if ok else '⚠️ Falhou'} em {warmup_state['seconds']}s "
+          f"({warmup_state['steps']})")
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 só depois do aquecimento (o /api/health é só liveness)"""
+    ready = warmup_state['state'] == 'done'
+    response = jsonify({'ready': ready, 'warmup': warmup_state})
+    if not ready:
+        response.headers['Retry-After'] = '1'
+    return response, 200 if ready else 503
+
+@metrics.provider('dalle')
 def generate_image_with_dalle(prompt, size="1024x1024", quality="standard"):
     """
     Gera imagem usando OpenAI DALL-E 3
@@ -1054,12 +2442,11 @@ def generate_image_with_dalle(prompt, size="1024x1024", quality="standard"):
     - quality: "standard" (~$0.04) ou "hd" (~$0.08)
     """
     try:
-        from openai import OpenAI
-        
         print(f"[DALL-E] Iniciando geração de imagem...")
         print(f"[DALL-E] Tamanho: {size}, Qualidade: {quality}")
         
-        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        # Cliente compartilhado (SDK importado e cliente criado só na primeira geração)
+        client = providers.get('openai')
         
         # Gera imagem
         response = client.images.generate(
@@ -1075,7 +2462,8 @@ def generate_image_with_dalle(prompt, size="1024x1024", quality="standard"):
         print(f"[DALL-E] ✓ Imagem gerada: {image_url[:50]}...")
         
         # Baixa a imagem
-        img_response = requests.get(image_url, timeout=60)
+        with tracing.span('dalle_download'):
+            img_response = providers.get('http').get(image_url, timeout=60)
         if img_response.status_code == 200:
             print(f"[DALL-E] ✓ Imagem baixada ({len(img_response.content)} bytes)")
             return img_response.content
@@ -1089,21 +2477,62 @@ def generate_image_with_dalle(prompt, size="1024x1024", quality="standard"):
     
     return None
 
-def generate_image_with_hf_space(input_image_b64, prompt, hf_space_url, hf_token=None):
+@metrics.provider('dalle')
+async def generate_image_with_dalle_async(prompt, size="1024x1024", quality="standard"):
+    """Versão assíncrona de generate_image_with_dalle (AsyncOpenAI + httpx)"""
+    try:
+        print(f"[DALL-E] Iniciando geração de imagem (async)...")
+        response = await async_core.openai().images.generate(
+            model="dall-e-3",
+            prompt=prompt,
+            size=size,
+            quality=quality,
+            n=1
+        )
+        
+        image_url = response.data[0].url
+        print(f"[DALL-E] ✓ Imagem gerada: {image_url[:50]}...")
+        
+        with tracing.span('dalle_download'):
+            img_response = await async_core.http().get(image_url, timeout=60)
+        if img_response.status_code == 200:
+            print(f"[DALL-E] ✓ Imagem baixada ({len(img_response.content)} bytes)")
+            return img_response.content
+        print(f"[DALL-E] ⚠️ Erro ao baixar imagem: {img_response.status_code}")
+        
+    except Exception as e:
+        print(f"[DALL-E] ⚠️ Erro: {e}")
+    
+    return None
+
+async def generate_image_with_hf_space_async(input_image, prompt, hf_space_url, hf_token=None):
+    """
+    Versão assíncrona da geração via Hugging Face. O gradio_client só tem API
+    bloqueante, então quando está instalado roda no executor; sem ele, usa o
+    fallback HTTP com httpx direto no loop.
+    """
+    if not providers.installed('gradio'):
+        return await _generate_image_http_fallback_async(input_image, prompt, hf_space_url, hf_token)
+    return await async_core.offload(generate_image_with_hf_space, input_image,
+                                    prompt, hf_space_url, hf_token)
+
+def generate_image_with_hf_space(input_image, prompt, hf_space_url, hf_token=None):
     """
-    Envia imagem base64 + prompt para um Space Hugging Face usando Gradio Client
+    Envia imagem (bytes, mime, nome; ver hf_input_image) + prompt para um Space
+    Hugging Face usando Gradio Client
     Suporta tanto URL do space quanto nome do repositório
     Retorna bytes da imagem gerada ou None em caso de erro.
     """
+    # gradio_client é opcional (verificado sem importar; importado no primeiro uso)
+    if not providers.installed('gradio'):
+        print("[HF] ⚠️ gradio_client não instalado. Tentando método HTTP direto...")
+        return _generate_image_http_fallback(input_image, prompt, hf_space_url, hf_token)
+    return _generate_image_gradio(providers.get('gradio'), input_image, prompt, hf_space_url, hf_token)
+
+@metrics.provider('hf_gradio')
+def _generate_image_gradio(Client, input_image, prompt, hf_space_url, hf_token=None):
+    """Predição no Space pelo Gradio Client (medida como provedor 'hf_gradio')"""
     try:
-        # Importa gradio_client
-        try:
-            from gradio_client import Client
-            print("[HF] Gradio Client disponível")
-        except ImportError:
-            print("[HF] ⚠️ gradio_client não instalado. Tentando método HTTP direto...")
-            return _generate_image_http_fallback(input_image_b64, prompt, hf_space_url, hf_token)
-        
         print(f"[HF] Conectando ao Space: {hf_space_url}")
         print(f"[HF] Prompt: {prompt[:100]}...")
         
@@ -1125,13 +2554,12 @@ def generate_image_with_hf_space(input_image_b64, prompt, hf_space_url, hf_token
             client = Client(space_name)
         print(f"[HF] ✓ Conectado ao Space")
         
-        # Decodifica imagem base64 para salvar temporariamente
-        image_bytes = base64.b64decode(input_image_b64)
-        
-        # Salva temporariamente
-        temp_path = f"temp_input_{uuid.uuid4()}.png"
+        # Salva temporariamente, com a extensão do formato real
+        input_bytes, _mime, filename = input_image
+        temp_path = os.path.join(tempfile.gettempdir(),
+                                 f"temp_input_{uuid.uuid4()}.{filename.rsplit('.', 1)[-1]}")
         with open(temp_path, 'wb') as f:
-            f.write(image_bytes)
+            f.write(input_bytes)
         
         print(f"[HF] Enviando imagem e prompt para processamento...")
         
@@ -1172,7 +2600,7 @@ def generate_image_with_hf_space(input_image_b64, prompt, hf_space_url, hf_token
                 elif result.startswith('http'):
                     # É uma URL
                     print(f"[HF] Baixando de URL: {result}")
-                    img_resp = requests.get(result)
+                    img_resp = providers.get('http').get(result)
                     if img_resp.status_code == 200:
                         return img_resp.content
             elif isinstance(result, bytes):
@@ -1195,68 +2623,186 @@ def generate_image_with_hf_space(input_image_b64, prompt, hf_space_url, hf_token
     
     return None
 
-def _generate_image_http_fallback(input_image_b64, prompt, hf_space_url, hf_token=None):
-    """Método HTTP fallback quando Gradio Client não está disponível"""
+def hf_space_endpoints(hf_space_url):
+    """(raiz do Space, URL do /api/predict, URL do /upload de arquivos)"""
+    base = hf_space_url.rstrip("/")
+    if "huggingface.co/spaces/" in base:
+        # Converte para formato .hf.space
+        username, model = base.split("/spaces/")[-1].strip("/").split("/")
+        base = f"https://{username}-{model}.hf.space"
+    elif base.endswith("/api/predict"):
+        base = base[:-len("/api/predict")]
+    return base, f"{base}/api/predict", f"{base}/upload"
+
+def hf_file_data(path, input_image):
+    """Referência a um arquivo já enviado ao Space (FileData do Gradio 3 e 4)"""
+    _data, mime, filename = input_image
+    return {"path": path, "name": path, "orig_name": filename, "mime_type": mime,
+            "is_file": True, "data": None, "meta": {"_type": "gradio.FileData"}}
+
+def hf_inline_image(input_image):
+    """Imagem embutida como data URI (Spaces sem /upload), com o MIME real"""
+    data, mime, _filename = input_image
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+def hf_output(result, base):
+    """Imagem da resposta do /api/predict: bytes (data URI), URL a baixar ou None"""
+    output = (result.get("data") or [None])[0] if isinstance(result, dict) else None
+    if isinstance(output, dict):
+        # FileData: URL pronta (Gradio 4) ou caminho no servidor do Space (Gradio 3)
+        path = output.get("path") or output.get("name")
+        output = output.get("url") or (f"{base}/file={path}" if path else output.get("data"))
+    if isinstance(output, str):
+        if output.startswith("data:image"):
+            return base64.b64decode(output.split(",", 1)[1])
+        if output.startswith("http"):
+            return output
+    return None
+
+def same_origin(url, base):
+    """Mesmo esquema e host:porta (exatos, sem credenciais na URL)"""
+    url, base = urlsplit(url), urlsplit(base)
+    return (url.scheme.lower(), url.netloc.lower()) == (base.scheme.lower(), base.netloc.lower())
+
+def hf_auth_headers(hf_token, url=None, base=None):
+    """Token só vai para o próprio Space (não para URLs de terceiros)"""
+    if hf_token and (url is None or same_origin(url, base)):
+        return {"Authorization": f"Bearer {hf_token}"}
+    return {}
+
+def _download_hf_image(http, url, headers):
+    """Baixa a imagem gerada em pedaços, até HF_MAX_RESULT_BYTES"""
+    with http.get(url, headers=headers, stream=True, timeout=60) as response:
+        if response.status_code != 200:
+            print(f"[HF] ⚠️ Erro ao baixar imagem: {response.status_code}")
+            return None
+        buffer = io.BytesIO()
+        for chunk in response.iter_content(64 * 1024):
+            buffer.write(chunk)
+            if buffer.tell() > HF_MAX_RESULT_BYTES:
+                print(f"[HF] ⚠️ Imagem gerada acima de {HF_MAX_RESULT_BYTES} bytes, descartada")
+                return None
+    return buffer.getvalue()
+
+@metrics.provider('hf_http')
+def _generate_image_http_fallback(input_image, prompt, hf_space_url, hf_token=None):
+    """
+    Método HTTP fallback quando Gradio Client não está disponível: a foto
+    (já reduzida, ver hf_input_image) sobe em multipart pelo /upload do Space
+    e o /api/predict recebe só a referência ao arquivo
+    """
     try:
         print(f"[HF] Tentando método HTTP para: {hf_space_url}")
+        base, api_url, upload_url = hf_space_endpoints(hf_space_url)
+        print(f"[HF] URL da API: {api_url}")
         
-        # Converte para URL da API se necessário
-        api_url = hf_space_url
-        if "huggingface.co/spaces/" in hf_space_url:
-            # Converte para formato .hf.space
-            space_name = hf_space_url.split("/spaces/")[-1].strip("/")
-            username, model = space_name.split("/")
-            api_url = f"https://{username}-{model}.hf.space/api/predict"
-            print(f"[HF] URL da API: {api_url}")
-        elif not api_url.endswith("/api/predict"):
-            api_url = api_url.rstrip("/") + "/api/predict"
+        http = providers.get('http')
+        headers = hf_auth_headers(hf_token)
+        image_arg = None
+        with tracing.span('hf_upload'):
+            data, mime, filename = input_image
+            try:
+                upload = http.post(upload_url, files={"files": (filename, io.BytesIO(data), mime)},
+                                   headers=headers, timeout=60)
+                if upload.status_code == 200 and upload.json():
+                    image_arg = hf_file_data(upload.json()[0], input_image)
+                    print(f"[HF] ✓ Imagem enviada ({len(data)} bytes, {mime})")
+                else:
+                    print(f"[HF] Upload de arquivo indisponível ({upload.status_code}); "
+                          "enviando a imagem no corpo")
+            except Exception as e:
+                print(f"[HF] Upload de arquivo falhou ({e}); enviando a imagem no corpo")
+        if image_arg is None:
+            image_arg = hf_inline_image(input_image)
         
-        # Decodifica imagem
-        image_bytes = base64.b64decode(input_image_b64)
+        response = http.post(api_url, json={"data": [image_arg, prompt]}, headers=headers, timeout=120)
         
-        # Payload para Gradio API
-        payload = {
-            "data": [
-                f"data:image/png;base64,{input_image_b64}",
-                prompt
-            ]
-        }
+        print(f"[HF] Status HTTP: {response.status_code}")
         
-        headers = {"Content-Type": "application/json"}
-        if hf_token:
-            headers["Authorization"] = f"Bearer {hf_token}"
+        if response.status_code == 200:
+            output = hf_output(response.json(), base)
+            if isinstance(output, str):
+                return _download_hf_image(http, output, hf_auth_headers(hf_token, output, base))
+            return output
+        else:
+            print(f"[HF] Erro: {response.text[:300]}")
+            
+    except Exception as e:
+        print(f"[HF] Erro no fallback HTTP: {e}")
+    
+    return None
+
+async def _download_hf_image_async(http, url, headers):
+    """Versão assíncrona (httpx) de _download_hf_image"""
+    async with http.stream('GET', url, headers=headers, timeout=60) as response:
+        if response.status_code != 200:
+            print(f"[HF] ⚠️ Erro ao baixar imagem: {response.status_code}")
+            return None
+        buffer = io.BytesIO()
+        async for chunk in response.aiter_bytes(64 * 1024):
+            buffer.write(chunk)
+            if buffer.tell() > HF_MAX_RESULT_BYTES:
+                print(f"[HF] ⚠️ Imagem gerada acima de {HF_MAX_RESULT_BYTES} bytes, descartada")
+                return None
+    return buffer.getvalue()
+
+@metrics.provider('hf_http')
+async def _generate_image_http_fallback_async(input_image, prompt, hf_space_url, hf_token=None):
+    """Versão assíncrona (httpx) de _generate_image_http_fallback"""
+    try:
+        print(f"[HF] Tentando método HTTP (async) para: {hf_space_url}")
+        base, api_url, upload_url = hf_space_endpoints(hf_space_url)
         
-        response = requests.post(api_url, json=payload, headers=headers, timeout=120)
+        http = async_core.http()
+        headers = hf_auth_headers(hf_token)
+        image_arg = None
+        with tracing.span('hf_upload'):
+            data, mime, filename = input_image
+            try:
+                upload = await http.post(upload_url, files={"files": (filename, data, mime)},
+                                         headers=headers, timeout=60)
+                if upload.status_code == 200 and upload.json():
+                    image_arg = hf_file_data(upload.json()[0], input_image)
+                    print(f"[HF] ✓ Imagem enviada ({len(data)} bytes, {mime})")
+                else:
+                    print(f"[HF] Upload de arquivo indisponível ({upload.status_code}); "
+                          "enviando a imagem no corpo")
+            except Exception as e:
+                print(f"[HF] Upload de arquivo falhou ({e}); enviando a imagem no corpo")
+        if image_arg is None:
+            image_arg = hf_inline_image(input_image)
         
+        response = await http.post(api_url, json={"data": [image_arg, prompt]}, headers=headers,
+                                   timeout=120)
         print(f"[HF] Status HTTP: {response.status_code}")
         
         if response.status_code == 200:
-            result = response.json()
-            if "data" in result and len(result["data"]) > 0:
-                img_data = result["data"][0]
-                if isinstance(img_data, str):
-                    if img_data.startswith("data:image"):
-                        # Base64 embutido
-                        img_b64 = img_data.split(",")[1]
-                        return base64.b64decode(img_b64)
-                    elif img_data.startswith("http"):
-                        # URL
-                        img_resp = requests.get(img_data)
-                        if img_resp.status_code == 200:
-                            return img_resp.content
+            output = hf_output(response.json(), base)
+            if isinstance(output, str):
+                return await _download_hf_image_async(http, output,
+                                                      hf_auth_headers(hf_token, output, base))
+            return output
         else:
             print(f"[HF] Erro: {response.text[:300]}")
             
     except Exception as e:
-        print(f"[HF] Erro no fallback HTTP: {e}")
+        print(f"[HF] Erro no fallback HTTP (async): {e}")
     
     return None
 
+# Tempo de inicialização do módulo (imports + configuração; SDKs dos provedores
+# ficam para o primeiro uso)
+STARTUP_SECONDS = time.perf_counter() - _startup_started
+print(f"[CONFIG] Aplicação inicializada em {STARTUP_SECONDS * 1000:.0f} ms")
+
+if WARMUP:
+    threading.Thread(target=run_warmup, name='aquecimento', daemon=True).start()
+
 if __name__ == '__main__':
     print("=" * 60)
     print("MarmoView Backend - Iniciando...")
     print("=" * 60)
-    print("✓ Sem persistência: dados em memória")
+    print(f"✓ Sessões: {SESSION_BACKEND} | Blobs: {BLOB_BACKEND}")
     print("✓ Upload de imagens ativo")
     print("✓ Geração de PDF ativo")
     print("=" * 60)
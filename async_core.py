@@ -0,0 +1,103 @@
+"""
+MarmoView - Núcleo assíncrono para chamadas aos provedores de IA
+Um único event loop (numa thread dedicada) concentra toda a E/S com Claude,
+OpenAI e Hugging Face usando os clientes assíncronos (AsyncAnthropic,
+AsyncOpenAI, httpx.AsyncClient). As rotas Flask entram no loop com `run`
+(espera o resultado) ou `submit` (dispara e retorna na hora), então centenas
+de gerações lentas ficam pendentes no loop sem ocupar uma thread cada.
+Trabalho de CPU (PIL, reportlab) vai para um executor com `offload`.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Conexões simultâneas por provedor no cliente HTTP compartilhado
+MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', '200'))
+
+
+class AsyncCore:
+    """Event loop em thread própria + clientes assíncronos criados sob demanda"""
+
+    def __init__(self, cpu_workers=None):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._in_flight = 0
+        self.cpu_executor = ThreadPoolExecutor(max_workers=cpu_workers or os.cpu_count(),
+                                               thread_name_prefix='cpu')
+
+    @property
+    def loop(self):
+        """Loop do núcleo, iniciado na primeira utilização"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever,
+                                              name='async-core', daemon=True)
+                    thread.start()
+                    self._thread = thread
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """Agenda a corrotina no loop; retorna um concurrent.futures.Future"""
+        # Conta antes de agendar: uma corrotina rápida pode terminar (e descontar)
+        # antes de run_coroutine_threadsafe retornar
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def run(self, coro, timeout=None):
+        """Executa a corrotina no loop e bloqueia a thread chamadora até o fim"""
+        return self.submit(coro).result(timeout)
+
+    async def offload(self, fn, *args):
+        """Executa função de CPU fora do loop (no executor de CPU), no contexto atual"""
+        call = functools.partial(contextvars.copy_context().run, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(self.cpu_executor, call)
+
+    def _client(self, name, factory):
+        client = self._clients.get(name)
+        if client is None:
+            client = self._clients[name] = factory()
+        return client
+
+    def http(self):
+        """httpx.AsyncClient compartilhado (pool de conexões/TLS reaproveitado)"""
+        import httpx
+        return self._client('http', lambda: httpx.AsyncClient(
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                                max_keepalive_connections=MAX_CONNECTIONS // 4),
+            follow_redirects=True,
+        ))
+
+    def anthropic(self):
+        from anthropic import AsyncAnthropic
+        return self._client('anthropic', lambda: AsyncAnthropic(
+            api_key=os.getenv('ANTHROPIC_API_KEY', '')))
+
+    def openai(self):
+        from openai import AsyncOpenAI
+        return self._client('openai', lambda: AsyncOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY', '')))
+
+    def in_flight(self):
+        """Corrotinas submetidas ainda em andamento"""
+        return self._in_flight
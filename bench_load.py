@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+MarmoView - Teste de carga offline do fluxo upload → geração → imagem → PDF
+
+Roda a aplicação Flask real em processo (test client, sem servidor nem
+provedores de IA): cada fluxo envia de 1 a 5 fotos JPEG realistas, gera o
+desenho, baixa a imagem e o PDF. Ao final grava um JSON com vazão, latências
+p50/p95/p99 por endpoint e crescimento de memória (RSS e sessões).
+
+Uso:
+    python bench_load.py --flows 100 --concurrency 8 --output bench.json
+    python bench_load.py --baseline bench.json   # compara e falha se regredir
+
+As variáveis de ambiente da aplicação (SESSION_BACKEND, RENDER_POOL_SIZE...)
+valem normalmente; as chaves dos provedores são sempre ignoradas.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = ('upload', 'generate', 'image', 'pdf')
+
+
+def offline_environment():
+    """
+    Desativa os provedores antes de importar a aplicação: variáveis vazias
+    não são sobrescritas pelo .env. Um único cliente faz todas as requisições,
+    então o limite por cliente também é desligado (se não definido).
+    """
+    for name in ('ANTHROPIC_API_KEY', 'OPENAI_API_KEY', 'HF_SPACE_URL', 'HF_API_KEY'):
+        os.environ[name] = ''
+    os.environ.setdefault('GENERATION_RATE', '0')
+
+
+def make_photo(rng, width=1600, height=1200):
+    """Foto sintética com textura de mármore (veios e ruído), em JPEG"""
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFilter
+
+    base = rng.randint(150, 230)
+    noise = np.random.default_rng(rng.randint(0, 2**32 - 1)).normal(0, 18, (height // 4, width // 4))
+    small = Image.fromarray(np.clip(base + noise, 0, 255).astype('uint8'), 'L')
+    img = small.resize((width, height), Image.BICUBIC).filter(ImageFilter.GaussianBlur(2)).convert('RGB')
+
+    # Veios: poucas linhas escuras atravessando a peça
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(3, 8)):
+        y = rng.randint(0, height)
+        points = [(x, y + rng.randint(-60, 60)) for x in range(0, width + 200, 200)]
+        draw.line(points, fill=(base - 70,) * 3, width=rng.randint(2, 6))
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def make_payloads(flows, max_photos, seed):
+    """Fotos e formulário de cada fluxo (gerados antes da medição)"""
+    rng = random.Random(seed)
+    formats = ['reto', 'l', 'u', 'ilha']
+    payloads = []
+    for i in range(flows):
+        photos = [make_photo(rng) for _ in range(rng.randint(1, max_photos))]
+        payloads.append({
+            'photos': photos,
+            'form': {
+                'envType': rng.choice(['cozinha', 'banheiro', 'lavanderia']),
+                'format': formats[i % len(formats)],
+                'stoneElements': rng.sample(['bancada', 'ilha', 'nicho'], rng.randint(1, 3)),
+                'cutouts': rng.sample(['pia', 'cooktop', 'torneira'], rng.randint(0, 2)),
+                'characteristics': 'Mármore branco com veios cinza',
+            },
+        })
+    return payloads
+
+
+class RssSampler:
+    """Amostra o RSS do processo em segundo plano e guarda o pico"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start = self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def rss_bytes():
+    """RSS atual (Linux: /proc; outros: pico do processo via resource)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def percentile(values, p):
+    """Percentil por posição (nearest-rank) de uma lista ordenada"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values))) - 1))
+    return values[index]
+
+
+def summarize(samples, wall):
+    latencies = sorted(ms for ms, _status in samples)
+    errors = sum(1 for _ms, status in samples if status >= 400)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / wall, 2) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': latencies[-1] if latencies else None,
+    }
+
+
+def run_flow(app_module, payload, samples, lock):
+    """upload → generate → image → PDF de uma sessão; registra (ms, status) por endpoint"""
+    client = app_module.app.test_client()
+
+    def timed(endpoint, call):
+        started = time.perf_counter()
+        response = call()
+        elapsed = round((time.perf_counter() - started) * 1000, 2)
+        with lock:
+            samples[endpoint].append((elapsed, response.status_code))
+        return response
+
+    data = dict(payload['form'])
+    data['images'] = [(io.BytesIO(photo), f'foto_{i}.jpg') for i, photo in enumerate(payload['photos'])]
+    response = timed('upload', lambda: client.post('/api/upload', data=data,
+                                                   content_type='multipart/form-data'))
+    if response.status_code != 200:
+        return False
+    session_id = response.get_json()['session_id']
+
+    ok = timed('generate', lambda: client.post(f'/api/generate-drawing/{session_id}')).status_code == 200
+    ok = timed('image', lambda: client.get(f'/api/drawing-image/{session_id}')).status_code == 200 and ok
+    ok = timed('pdf', lambda: client.get(f'/api/generate-pdf/{session_id}')).status_code == 200 and ok
+    return ok
+
+
+def session_bytes(app_module):
+    """Tamanho (JSON) dos registros de sessão armazenados"""
+    total = 0
+    for session_id in app_module.session_data.ids():
+        record = app_module.session_data.get(session_id)
+        if record is not None:
+            total += len(json.dumps(record, default=str))
+    return total
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(args):
+    offline_environment()
+    print(f"🔧 Gerando fotos de {args.flows + args.warmup} fluxos...")
+    payloads = make_payloads(args.flows + args.warmup, args.max_photos, args.seed)
+    warmup, payloads = payloads[:args.warmup], payloads[args.warmup:]
+
+    import app as app_module
+    lock = threading.Lock()
+
+    # Aquecimento (fontes, pool de renderização, imports tardios) fora da medição
+    for payload in warmup:
+        run_flow(app_module, payload, {e: [] for e in ENDPOINTS}, lock)
+
+    samples = {e: [] for e in ENDPOINTS}
+    sessions_before = len(app_module.session_data)
+    session_bytes_before = session_bytes(app_module)
+    print(f"🚀 {args.flows} fluxos com concorrência {args.concurrency}...")
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            results = list(executor.map(lambda p: run_flow(app_module, p, samples, lock), payloads))
+        wall = time.perf_counter() - started
+
+    blobs = app_module.blob_store.stats()
+    return {
+        'tool': 'bench_load',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'config': {
+            'flows': args.flows,
+            'concurrency': args.concurrency,
+            'max_photos': args.max_photos,
+            'seed': args.seed,
+            'session_backend': app_module.SESSION_BACKEND,
+            'blob_backend': app_module.BLOB_BACKEND,
+            'render_pool_size': app_module.RENDER_POOL_SIZE,
+            'async_providers': app_module.ASYNC_PROVIDERS,
+        },
+        'wall_seconds': round(wall, 3),
+        'flows_ok': sum(results),
+        'flows_per_second': round(len(payloads) / wall, 2),
+        'requests_per_second': round(sum(len(s) for s in samples.values()) / wall, 2),
+        'endpoints': {endpoint: summarize(samples[endpoint], wall) for endpoint in ENDPOINTS},
+        'memory': {
+            'rss_start_mb': round(rss.start / 2**20, 1),
+            'rss_peak_mb': round(rss.peak / 2**20, 1),
+            'rss_growth_mb': round((rss.peak - rss.start) / 2**20, 1),
+            'sessions_added': len(app_module.session_data) - sessions_before,
+            'session_bytes_added': session_bytes(app_module) - session_bytes_before,
+            'blobs': blobs['blobs'],
+            'blob_bytes': blobs['bytes'],
+        },
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Regressões de p95 por endpoint e de vazão acima da tolerância (fração)"""
+    regressions = []
+    for endpoint, stats in result['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(endpoint, {}).get('p95_ms')
+        if before and stats['p95_ms'] and stats['p95_ms'] > before * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {before}ms → {stats['p95_ms']}ms")
+    before = baseline.get('flows_per_second')
+    if before and result['flows_per_second'] < before * (1 - tolerance):
+        regressions.append(f"vazão: {before} → {result['flows_per_second']} fluxos/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga offline do MarmoView')
+    parser.add_argument('--flows', type=int, default=50, help='fluxos completos medidos')
+    parser.add_argument('--concurrency', type=int, default=8, help='fluxos simultâneos')
+    parser.add_argument('--max-photos', type=int, default=5, help='fotos por upload (1 a N)')
+    parser.add_argument('--warmup', type=int, default=2, help='fluxos de aquecimento (não medidos)')
+    parser.add_argument('--seed', type=int, default=1, help='semente das fotos e formulários')
+    parser.add_argument('--output', default='bench_load.json', help='arquivo JSON de resultado')
+    parser.add_argument('--baseline', help='JSON de uma execução anterior para comparar')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='regressão tolerada em relação ao baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    result = run(args)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+
+    print("=" * 60)
+    print(f"MarmoView - Teste de carga ({result['wall_seconds']}s, "
+          f"{result['flows_per_second']} fluxos/s)")
+    print("=" * 60)
+    for endpoint, stats in result['endpoints'].items():
+        print(f"  {endpoint:<9} n={stats['count']:<4} erros={stats['errors']:<3} "
+              f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms")
+    memory = result['memory']
+    print(f"  RSS: {memory['rss_start_mb']} → {memory['rss_peak_mb']} MB "
+          f"(+{memory['rss_growth_mb']} MB), sessões +{memory['sessions_added']} "
+          f"({memory['session_bytes_added']} bytes)")
+    print(f"✅ Resultado gravado em {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Regressões em relação ao baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print("✅ Sem regressões em relação ao baseline")
+
+
+if __name__ == '__main__':
+    main()
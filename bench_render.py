@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+MarmoView - Microbenchmarks da renderização (CPU)
+
+Para cada formato de draw_improved_format (reto, l, u, ilha, pensula,
+irregular), com e sem uma análise de IA grande (muitas posições e recortes),
+mede separadamente:
+
+- layout:  build_scene (cena vetorial)
+- raster:  rasterização da cena (PIL)
+- encode:  codificação PNG
+- drawing: o caminho completo de generate_drawing_image (layout + PNG)
+- pdf:     build_pdf com a cena vetorial (caminho do /api/generate-pdf)
+
+Reporta ops/s, alocações (pico e memória retida, via tracemalloc) e bytes
+de saída. A verificação golden compara o hash dos pixels de cada desenho com
+bench_render_golden.json: otimizações da renderização não podem mudar a saída.
+
+Uso:
+    python bench_render.py                     # mede e verifica o golden
+    python bench_render.py --update-golden     # regrava os hashes de referência
+    python bench_render.py --json bench_render.json --min-time 1
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import PIL
+
+from rendering import build_scene, build_pdf
+from scene import _pil_font, encode_png, rasterize
+
+FORMATS = ('reto', 'l', 'u', 'ilha', 'pensula', 'irregular')
+FORMAT_LABELS = {
+    'reto': 'Reto/Linear', 'l': 'Em L', 'u': 'Em U', 'ilha': 'Ilha Central',
+    'pensula': 'Península', 'irregular': 'Irregular',
+}
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_render_golden.json')
+
+# Data e sessão fixas: o rodapé entra na imagem e precisa ser determinístico
+GENERATED_AT = datetime(2024, 1, 1, 12, 0)
+SESSION_ID = '00000000-bench-render'
+
+
+def large_analysis():
+    """Análise de IA no limite do que a ferramenta devolve: muitos elementos e recortes"""
+    positions = []
+    for i in range(24):
+        col, row = i % 6, i // 6
+        positions.append({'element': f'elemento {i}', 'x_start': 2 + col * 16, 'x_end': 14 + col * 16,
+                          'y_start': 5 + row * 23, 'y_end': 20 + row * 23,
+                          'description': 'Peça em mármore com acabamento polido'})
+    sizes = ['pequeno', 'médio', 'grande']
+    cutouts = [{'type': ['pia', 'cooktop', 'torneira'][i % 3], 'x': 5 + (i * 37) % 90,
+                'y': 8 + (i * 53) % 85, 'size': sizes[i % 3], 'notes': 'Conferir no local'}
+               for i in range(30)]
+    return {
+        'layout_analysis': 'Ambiente amplo com várias bancadas e ilhas',
+        'space_dimensions': {'width_ratio': 1.8, 'depth_ratio': 0.5, 'height_estimate': 260},
+        'stone_layout': {'main_surface': 'bancada', 'positions': positions},
+        'cutouts_positions': cutouts,
+        'format_recommendation': 'Distribuição em módulos ao longo das paredes',
+        'visual_references': ['mármore branco', 'veios cinza', 'madeira clara'],
+        'drawing_instructions': ['Bancadas com 60cm de profundidade', 'Frontão de 10cm em todas as peças',
+                                 'Ilhas com borda reta'],
+        'challenges': ['Emendas nos cantos', 'Recortes próximos às bordas'],
+        'confidence': 81,
+    }
+
+
+def make_case(fmt, ai_analysis=None):
+    """(drawing, form) no formato que app.create_conceptual_drawing produz"""
+    form = {
+        'characteristics': 'Mármore branco com veios cinza, acabamento polido',
+        'envType': 'cozinha',
+        'stoneElements': ['bancada', 'ilha', 'nicho'],
+        'format': fmt,
+        'cutouts': ['pia', 'cooktop', 'torneira'],
+    }
+    drawing = {
+        'title': 'Desenho Conceitual - Cozinha Residencial',
+        'environment': 'Cozinha Residencial',
+        'format': FORMAT_LABELS[fmt],
+        'elements': form['stoneElements'],
+        'cutouts': form['cutouts'],
+        'characteristics': form['characteristics'],
+        'images_analyzed': 3,
+        'shapes': [{'type': 'rectangle', 'description': 'Bancada principal'},
+                   {'type': 'rectangle', 'description': 'Ilha central'},
+                   {'type': 'small-rect', 'description': 'Nicho/Prateleira'}],
+        'ai_analysis': ai_analysis,
+        'notes': ['DESENHO CONCEITUAL - NÃO UTILIZAR PARA FABRICAÇÃO',
+                  'Requer medição precisa em campo', 'Sem escala ou dimensões'],
+    }
+    return drawing, form
+
+
+def pixel_hash(img):
+    """SHA-256 dos pixels (independe do zlib/compressão do PNG)"""
+    return hashlib.sha256(img.tobytes()).hexdigest()
+
+
+def measure(fn, min_time):
+    """Executa `fn` repetidamente por pelo menos `min_time` s; retorna estatísticas"""
+    fn()  # aquecimento (fontes, caches de import)
+    runs, best, started = 0, float('inf'), time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        output = fn()
+        elapsed = time.perf_counter() - t0
+        best = min(best, elapsed)
+        runs += 1
+        if time.perf_counter() - started >= min_time and runs >= 3:
+            break
+    total = time.perf_counter() - started
+
+    # Alocações numa execução separada (tracemalloc deixa tudo mais lento)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {
+        'ops_per_sec': round(runs / total, 1),
+        'mean_ms': round(total / runs * 1000, 3),
+        'best_ms': round(best * 1000, 3),
+        'alloc_peak_kb': round((peak - before) / 1024, 1),
+        'alloc_retained_kb': round((current - before) / 1024, 1),
+        'output_bytes': output_size(output),
+    }
+
+
+def output_size(output):
+    if isinstance(output, (bytes, bytearray)):
+        return len(output)
+    if isinstance(output, dict):
+        return len(json.dumps(output, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    if hasattr(output, 'tobytes'):
+        return output.width * output.height * len(output.getbands())
+    return None
+
+
+def bench_case(fmt, variant, min_time):
+    analysis = large_analysis() if variant == 'ia' else None
+    drawing, form = make_case(fmt, analysis)
+
+    def layout():
+        return build_scene(drawing, form, analysis, SESSION_ID, GENERATED_AT)
+
+    scene = layout()
+    img = rasterize(scene)
+    results = {
+        'layout': measure(layout, min_time),
+        'raster': measure(lambda: rasterize(scene), min_time),
+        'encode': measure(lambda: encode_png(img), min_time),
+        'drawing': measure(lambda: encode_png(rasterize(layout())), min_time),
+        'pdf': measure(lambda: build_pdf(drawing, SESSION_ID, scene), min_time),
+    }
+    return results, pixel_hash(img)
+
+
+def environment():
+    """O que influencia os pixels além do código: versão do Pillow e fonte disponível"""
+    return {'pillow': PIL.__version__,
+            'font': 'truetype' if hasattr(_pil_font('texto'), 'path') else 'default'}
+
+
+def check_golden(hashes, env):
+    """Compara os hashes com o golden; retorna os casos divergentes (None sem golden)"""
+    if not os.path.exists(GOLDEN_PATH):
+        print(f"⚠️  {os.path.basename(GOLDEN_PATH)} não existe (use --update-golden)")
+        return None
+    with open(GOLDEN_PATH) as f:
+        golden = json.load(f)
+    mismatches = [case for case, digest in hashes.items()
+                  if golden['hashes'].get(case) not in (None, digest)]
+    if mismatches and golden.get('environment') != env:
+        print(f"⚠️  Ambiente diferente do golden ({golden.get('environment')} vs {env}): "
+              "divergências podem vir da fonte/Pillow, não do código")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks da renderização do MarmoView')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS))
+    parser.add_argument('--min-time', type=float, default=0.3, help='segundos mínimos por medição')
+    parser.add_argument('--json', help='grava os resultados neste arquivo JSON')
+    parser.add_argument('--update-golden', action='store_true', help='regrava os hashes de referência')
+    args = parser.parse_args()
+
+    env = environment()
+    results, hashes = {}, {}
+    print("=" * 78)
+    print(f"MarmoView - Benchmark de renderização (Pillow {env['pillow']}, fonte {env['font']})")
+    print("=" * 78)
+    print(f"{'caso':<16} {'etapa':<8} {'ops/s':>9} {'média ms':>10} {'pico KB':>9} {'retido KB':>10} {'bytes':>9}")
+    for fmt in args.formats:
+        for variant in ('form', 'ia'):
+            case = f"{fmt}/{variant}"
+            results[case], hashes[case] = bench_case(fmt, variant, args.min_time)
+            for stage, stats in results[case].items():
+                print(f"{case:<16} {stage:<8} {stats['ops_per_sec']:>9} {stats['mean_ms']:>10} "
+                      f"{stats['alloc_peak_kb']:>9} {stats['alloc_retained_kb']:>10} "
+                      f"{stats['output_bytes'] or '-':>9}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': env, 'min_time': args.min_time, 'results': results,
+                       'pixel_hashes': hashes}, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultados gravados em {args.json}")
+
+    if args.update_golden:
+        golden = {'hashes': {}}
+        if os.path.exists(GOLDEN_PATH):
+            with open(GOLDEN_PATH) as f:
+                golden = json.load(f)
+        golden['environment'] = env
+        golden['hashes'].update(hashes)
+        with open(GOLDEN_PATH, 'w') as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"✅ Golden atualizado ({len(hashes)} casos)")
+        return
+
+    mismatches = check_golden(hashes, env)
+    if mismatches is None:
+        return
+    if mismatches:
+        print(f"❌ Saída diferente do golden: {', '.join(mismatches)}")
+        sys.exit(1)
+    print("✅ Pixels idênticos ao golden")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""
+MarmoView - Armazenamento de blobs endereçado por conteúdo
+Cada blob é identificado pelo SHA-256 dos seus bytes e guardado uma única vez,
+com contagem de referências por dono (sessão). Uploads idênticos em sessões
+diferentes compartilham o mesmo buffer; o blob é liberado quando a última
+sessão que o referencia é removida.
+
+Dois backends com a mesma interface:
+- MemoryBlobStore: bytes no heap do processo (padrão)
+- DiskBlobStore: arquivos num diretório de spool, lidos via mmap e servidos
+  com send_file direto do page cache; só os metadados ficam em memória
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# prune não mexe em donos com referências mais novas que isto: podem ser de um
+# upload em andamento noutro processo, cuja sessão ainda não foi gravada
+PRUNE_GRACE_SECONDS = 600
+
+
+def blob_digest(data):
+    """SHA-256 hexadecimal dos bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class MemoryBlobStore:
+    """Blobs em memória com contagem de referências por dono"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blobs = {}   # digest -> bytes
+        self._meta = {}    # digest -> dict (caches derivados: dimensões, score...)
+        self._owners = {}  # digest -> set(dono)
+        self._owned = {}   # dono -> set(digest)
+
+    def put(self, data, owner):
+        """Guarda os bytes (se ainda não existirem) e registra a referência do dono"""
+        digest = blob_digest(data)
+        with self._lock:
+            if digest not in self._blobs:
+                self._blobs[digest] = bytes(data)
+                self._meta[digest] = {}
+            self._add_ref(digest, owner)
+        return digest
+
+    def add_ref(self, digest, owner):
+        """Registra mais um dono para um blob existente"""
+        with self._lock:
+            if digest not in self._blobs:
+                raise KeyError(digest)
+            self._add_ref(digest, owner)
+
+    def _add_ref(self, digest, owner):
+        self._owners.setdefault(digest, set()).add(owner)
+        self._owned.setdefault(owner, set()).add(digest)
+
+    def get(self, digest):
+        """Retorna os bytes do blob (KeyError se não existir)"""
+        return self._blobs[digest]
+
+    def meta(self, digest):
+        """Dict de metadados/caches associados ao blob (liberado junto com ele)"""
+        return self._meta[digest]
+
+    def size(self, digest):
+        return len(self._blobs[digest])
+
+    def refcount(self, digest):
+        return len(self._owners.get(digest, ()))
+
+    def release(self, owner):
+        """Remove todas as referências do dono; retorna os digests liberados"""
+        freed = []
+        with self._lock:
+            for digest in self._owned.pop(owner, ()):
+                owners = self._owners.get(digest)
+                if owners is None:
+                    continue
+                owners.discard(owner)
+                if not owners:
+                    del self._owners[digest]
+                    self._blobs.pop(digest, None)
+                    self._meta.pop(digest, None)
+                    freed.append(digest)
+        return freed
+
+    def discard(self, digest, owner):
+        """Remove só a referência do dono a este blob; retorna True se o blob foi liberado"""
+        with self._lock:
+            owned = self._owned.get(owner)
+            if not owned or digest not in owned:
+                return False
+            owned.discard(digest)
+            if not owned:
+                del self._owned[owner]
+            owners = self._owners.get(digest)
+            owners.discard(owner)
+            if owners:
+                return False
+            del self._owners[digest]
+            self._blobs.pop(digest, None)
+            self._meta.pop(digest, None)
+            return True
+
+    def path(self, digest):
+        """Blobs em memória não têm arquivo"""
+        return None
+
+    def owners(self):
+        return list(self._owned)
+
+    def prune(self, live_owners):
+        live = set(live_owners)
+        freed = []
+        for owner in self.owners():
+            if owner not in live:
+                freed.extend(self.release(owner))
+        return freed
+
+    def __contains__(self, digest):
+        return digest in self._blobs
+
+    def stats(self):
+        with self._lock:
+            return {
+                'blobs': len(self._blobs),
+                'bytes': sum(len(b) for b in self._blobs.values()),
+                'owners': len(self._owned),
+            }
+
+
+class DiskBlobStore:
+    """
+    Blobs em diretório de spool local.
+
+    Layout:
+        <raiz>/objects/ab/abcdef...    conteúdo (gravado uma vez, somente leitura)
+        <raiz>/owners/<dono>/abcdef... hardlink por referência de dono
+
+    A contagem de referências é o número de hardlinks do objeto menos um, então
+    ela sobrevive a reinícios e é compartilhada entre processos do mesmo nó.
+    Criar um link e apagar um objeto sem links acontecem sob flock em
+    <raiz>/.lock, para um processo não apagar o objeto que outro acabou de
+    referenciar.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join(tempfile.gettempdir(), 'marmoview-spool')
+        self._objects = os.path.join(self.root, 'objects')
+        self._owners_dir = os.path.join(self.root, 'owners')
+        os.makedirs(self._objects, exist_ok=True)
+        os.makedirs(self._owners_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._meta = {}  # caches derivados, apenas neste processo
+
+    @contextmanager
+    def _locked(self):
+        """Exclusão entre threads e processos que usam o mesmo spool"""
+        with self._lock, open(os.path.join(self.root, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def path(self, digest):
+        """Caminho do arquivo do blob (para send_file)"""
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def _owner_dir(self, owner):
+        return os.path.join(self._owners_dir, owner.replace(os.sep, '_'))
+
+    def put(self, data, owner):
+        """Grava o blob (escrita atômica via rename) e registra a referência do dono"""
+        digest = blob_digest(data)
+        path = self.path(digest)
+        while True:
+            tmp_path = None
+            if not os.path.exists(path):
+                # Escreve fora do lock; sob ele ficam só o rename e o link
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.chmod(tmp_path, 0o444)
+            with self._locked():
+                if tmp_path is not None:
+                    if os.path.exists(path):
+                        # Outro processo gravou o mesmo conteúdo: mantém o inode dele (e os links)
+                        os.unlink(tmp_path)
+                    else:
+                        os.rename(tmp_path, path)
+                if os.path.exists(path):
+                    self._link(digest, owner)
+                    return digest
+            # Objeto apagado por outro release entre a checagem e o lock: regrava
+
+    def add_ref(self, digest, owner):
+        """Registra mais um dono para um blob existente"""
+        with self._locked():
+            if not os.path.exists(self.path(digest)):
+                raise KeyError(digest)
+            self._link(digest, owner)
+
+    def _link(self, digest, owner):
+        owner_dir = self._owner_dir(owner)
+        os.makedirs(owner_dir, exist_ok=True)
+        try:
+            os.link(self.path(digest), os.path.join(owner_dir, digest))
+        except FileExistsError:
+            pass
+
+    def get(self, digest):
+        """Retorna o conteúdo mapeado em memória (somente leitura, sem cópia)"""
+        try:
+            with open(self.path(digest), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b''
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise KeyError(digest)
+
+    def meta(self, digest):
+        if digest not in self:
+            raise KeyError(digest)
+        with self._lock:
+            return self._meta.setdefault(digest, {})
+
+    def size(self, digest):
+        return os.stat(self.path(digest)).st_size
+
+    def refcount(self, digest):
+        try:
+            return os.stat(self.path(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def release(self, owner):
+        """Remove as referências do dono; objetos sem referências são apagados"""
+        owner_dir = self._owner_dir(owner)
+        freed = []
+        try:
+            names = os.listdir(owner_dir)
+        except FileNotFoundError:
+            return freed
+        for digest in names:
+            os.unlink(os.path.join(owner_dir, digest))
+            if self._drop_if_unreferenced(digest):
+                freed.append(digest)
+        try:
+            os.rmdir(owner_dir)
+        except OSError:
+            pass
+        return freed
+
+    def discard(self, digest, owner):
+        """Remove só a referência do dono a este blob; retorna True se o blob foi apagado"""
+        try:
+            os.unlink(os.path.join(self._owner_dir(owner), digest))
+        except FileNotFoundError:
+            return False
+        return self._drop_if_unreferenced(digest)
+
+    def _drop_if_unreferenced(self, digest):
+        path = self.path(digest)
+        with self._locked():
+            try:
+                if os.stat(path).st_nlink > 1:
+                    return False
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self._meta.pop(digest, None)
+        return True
+
+    def owners(self):
+        return os.listdir(self._owners_dir)
+
+    def prune(self, live_owners, grace=PRUNE_GRACE_SECONDS):
+        """
+        Libera donos que não existem mais (ex: sessões perdidas num reinício).
+        Donos referenciados há menos de `grace` segundos ficam: podem ser de
+        um upload de outro processo que ainda vai gravar a sessão.
+        """
+        live = set(live_owners)
+        cutoff = time.time() - grace
+        freed = []
+        for owner in self.owners():
+            if owner in live:
+                continue
+            try:
+                if os.stat(os.path.join(self._owners_dir, owner)).st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            freed.extend(self.release(owner))
+        return freed
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def stats(self):
+        """Varre o spool inteiro (custo proporcional ao número de blobs)"""
+        blobs = 0
+        total = 0
+        for prefix in os.listdir(self._objects):
+            try:
+                entries = list(os.scandir(os.path.join(self._objects, prefix)))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    continue  # apagado por um release durante a varredura
+                blobs += 1
+        return {'blobs': blobs, 'bytes': total, 'owners': len(self.owners())}
+
+
+def create_blob_store(backend=None, root=None):
+    """Cria o blob store configurado ('memory' ou 'disk')"""
+    backend = (backend or 'memory').lower()
+    if backend == 'disk':
+        return DiskBlobStore(root)
+    if backend == 'memory':
+        return MemoryBlobStore()
+    raise ValueError(f"Backend de blobs desconhecido: {backend}")
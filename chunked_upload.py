@@ -0,0 +1,334 @@
+"""
+MarmoView - Uploads retomáveis em pedaços
+Em conexões instáveis, um upload multipart de várias fotos se perde inteiro
+na primeira queda. Aqui o cliente declara as fotos (nome e tamanho), envia
+cada uma em pedaços com offset, consulta as faixas já recebidas e reenvia
+só as que faltam; ao final, o upload vira uma sessão.
+
+Os pedaços vão direto para arquivos no disco (nunca o upload inteiro em
+memória), e o SHA-256 de cada foto é calculado à medida que o trecho
+contíguo a partir do início cresce; a finalização só hasheia o que sobrou.
+
+    <raiz>/<upload_id>/state.json   fotos declaradas, faixas recebidas, formulário
+    <raiz>/<upload_id>/<i>.part     conteúdo da foto i (esparso até completar)
+
+O estado é atualizado com flock, então vários processos do mesmo nó podem
+receber pedaços do mesmo upload.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+COPY_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    """Requisição de upload inválida; `status` é o código HTTP da resposta"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def add_range(ranges, start, end):
+    """Acrescenta [start, end) às faixas (ordenadas, sem sobreposição)"""
+    merged = []
+    for s, e in sorted(ranges + [[start, end]]):
+        if merged and s <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], e)
+        else:
+            merged.append([s, e])
+    return merged
+
+
+def missing_ranges(ranges, size):
+    """Faixas [início, fim) ainda não recebidas de um arquivo de `size` bytes"""
+    missing, position = [], 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+class SpooledFile:
+    """Foto completa no spool, com a interface usada por store_upload (filename, read)"""
+
+    def __init__(self, filename, path, sha256):
+        self.filename = filename
+        self.path = path
+        self.sha256 = sha256
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+
+class UploadSpool:
+    def __init__(self, root=None, max_files=5, max_file_size=10 * 1024 * 1024):
+        self.root = root or os.path.join(tempfile.gettempdir(), 'marmoview-uploads')
+        self.max_files = max_files
+        self.max_file_size = max_file_size
+        os.makedirs(self.root, exist_ok=True)
+        # SHA-256 do trecho contíguo já recebido: (upload, foto) -> (hash, bytes hasheados)
+        self._hashers = {}
+        self._lock = threading.Lock()
+
+    def _dir(self, upload_id):
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+            raise UploadError('Upload não encontrado', 404)
+        path = os.path.join(self.root, upload_id)
+        if not os.path.isdir(path):
+            raise UploadError('Upload não encontrado', 404)
+        return path
+
+    def _part(self, upload_id, index):
+        return os.path.join(self.root, upload_id, f'{index}.part')
+
+    @contextmanager
+    def _state(self, upload_id, write=True):
+        """Estado do upload sob flock; gravado de volta (atomicamente) ao sair, mesmo com erro"""
+        path = self._dir(upload_id)
+        with open(os.path.join(path, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(os.path.join(path, 'state.json')) as f:
+                state = json.load(f)
+            try:
+                yield state
+            finally:
+                if write:
+                    self._save(path, state)
+
+    @staticmethod
+    def _save(path, state):
+        state['updated_at'] = time.time()
+        tmp_path = os.path.join(path, 'state.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(path, 'state.json'))
+
+    def create(self, files, form):
+        """Declara as fotos [{filename, size, sha256?}]; retorna o estado do novo upload"""
+        if not isinstance(files, list) or not files:
+            raise UploadError('Nenhuma imagem declarada')
+        if len(files) > self.max_files:
+            raise UploadError(f'Máximo de {self.max_files} imagens permitido')
+        declared = []
+        for file in files:
+            size = file.get('size') if isinstance(file, dict) else None
+            if not isinstance(size, int) or size <= 0:
+                raise UploadError('Cada imagem precisa de filename e size (bytes)')
+            if size > self.max_file_size:
+                raise UploadError(f"Arquivo {file.get('filename')} excede "
+                                  f"{self.max_file_size // (1024 * 1024)}MB")
+            sha256 = file.get('sha256')
+            if sha256 is not None and not (isinstance(sha256, str)
+                                           and re.fullmatch(r'[0-9a-fA-F]{64}', sha256)):
+                raise UploadError(f"sha256 de {file.get('filename')} deve ter 64 dígitos hexadecimais")
+            declared.append({'filename': str(file.get('filename') or ''), 'size': size,
+                             'sha256': sha256.lower() if sha256 else None, 'ranges': []})
+
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.root, upload_id)
+        os.makedirs(path)
+        for index, file in enumerate(declared):
+            with open(self._part(upload_id, index), 'wb') as f:
+                f.truncate(file['size'])
+        state = {'id': upload_id, 'created_at': time.time(), 'files': declared,
+                 'form': form or {}, 'session_id': None, 'response': None}
+        self._save(path, state)
+        return self.describe(state)
+
+    def write_chunk(self, upload_id, index, offset, stream, length, chunk_sha256=None):
+        """
+        Grava `length` bytes de `stream` a partir de `offset` na foto `index`.
+        Pedaço truncado ou com SHA-256 diferente de `chunk_sha256` não conta
+        como recebido. Retorna o estado do upload.
+        """
+        with self._state(upload_id, write=False) as state:
+            if state['session_id']:
+                raise UploadError('Upload já finalizado', 409)
+            if not 0 <= index < len(state['files']):
+                raise UploadError(f'Imagem {index} não declarada', 404)
+            size = state['files'][index]['size']
+            if offset < 0 or length <= 0 or offset + length > size:
+                raise UploadError(f'Faixa {offset}+{length} fora do arquivo ({size} bytes)', 416)
+            # Aberta sob o flock: a finalização apaga as partes com ele, então
+            # daqui em diante a escrita não falha mesmo que ela aconteça
+            try:
+                part = open(self._part(upload_id, index), 'r+b')
+            except FileNotFoundError:
+                raise UploadError('Upload não encontrado', 404)
+
+        key = (upload_id, index)
+        hasher = self._take_hasher(key, offset)
+        before = hasher.copy() if hasher is not None else None
+        check = hashlib.sha256() if chunk_sha256 else None
+        received = 0
+        with part as f:
+            f.seek(offset)
+            while received < length:
+                piece = stream.read(min(COPY_SIZE, length - received))
+                if not piece:
+                    break
+                f.write(piece)
+                for h in (hasher, check):
+                    if h is not None:
+                        h.update(piece)
+                received += len(piece)
+
+        if received < length or (check is not None and check.hexdigest() != chunk_sha256.lower()):
+            # Pedaço descartado: o hash contíguo volta ao ponto anterior a ele
+            if before is not None:
+                self._put_hasher(key, before, offset)
+            raise UploadError('Pedaço incompleto' if received < length
+                              else 'SHA-256 do pedaço não confere', 400,
+                              received=received)
+        if hasher is not None:
+            self._put_hasher(key, hasher, offset + received)
+
+        with self._state(upload_id) as state:
+            if state['session_id']:
+                # Finalizado enquanto o pedaço era gravado: a parte já foi apagada
+                raise UploadError('Upload já finalizado', 409)
+            file = state['files'][index]
+            file['ranges'] = add_range(file['ranges'], offset, offset + received)
+            ranges = file['ranges']
+        self._catch_up(key, ranges)
+        return self.describe(state)
+
+    def _take_hasher(self, key, offset):
+        """Hash contíguo da foto, se o pedaço começa exatamente onde ele parou"""
+        with self._lock:
+            entry = self._hashers.get(key)
+            if entry is None:
+                return hashlib.sha256() if offset == 0 else None
+            if entry[1] != offset:
+                return None
+            del self._hashers[key]
+            return entry[0]
+
+    def _put_hasher(self, key, hasher, position):
+        with self._lock:
+            entry = self._hashers.get(key)
+            if entry is None or entry[1] < position:
+                self._hashers[key] = (hasher, position)
+
+    def _catch_up(self, key, ranges):
+        """Pedaços fora de ordem: hasheia do disco o que já ficou contíguo ao início"""
+        contiguous = ranges[0][1] if ranges and ranges[0][0] == 0 else 0
+        with self._lock:
+            entry = self._hashers.get(key)
+            if entry is None or entry[1] >= contiguous:
+                return
+            del self._hashers[key]
+        hasher, position = entry
+        position = self._hash_file(self._part(*key), hasher, position, contiguous)
+        self._put_hasher(key, hasher, position)
+
+    @staticmethod
+    def _hash_file(path, hasher, start, end):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            while start < end:
+                piece = f.read(min(COPY_SIZE, end - start))
+                if not piece:
+                    break
+                hasher.update(piece)
+                start += len(piece)
+        return start
+
+    def status(self, upload_id):
+        with self._state(upload_id, write=False) as state:
+            return self.describe(state)
+
+    @staticmethod
+    def describe(state):
+        """Estado público: faixas recebidas e faltantes de cada foto"""
+        files = []
+        for index, file in enumerate(state['files']):
+            missing = missing_ranges(file['ranges'], file['size'])
+            files.append({'index': index, 'filename': file['filename'], 'size': file['size'],
+                          'received': file['ranges'], 'missing': missing,
+                          'bytes_received': file['size'] - sum(e - s for s, e in missing),
+                          'complete': not missing})
+        return {'upload_id': state['id'], 'files': files,
+                'complete': all(f['complete'] for f in files),
+                'session_id': state['session_id'], 'updated_at': state.get('updated_at')}
+
+    def complete_files(self, upload_id):
+        """
+        Fotos completas como SpooledFile, com o SHA-256 conferido contra o
+        declarado; UploadError 409 se faltar algo, 422 se o hash não conferir
+        (a foto volta a ser aguardada do zero). Retorna (fotos, formulário).
+        """
+        with self._state(upload_id) as state:
+            described = self.describe(state)
+            if not described['complete']:
+                raise UploadError('Upload incompleto', 409, upload=described)
+            files = []
+            for index, file in enumerate(state['files']):
+                key = (upload_id, index)
+                with self._lock:
+                    hasher, position = self._hashers.pop(key, (hashlib.sha256(), 0))
+                self._hash_file(self._part(upload_id, index), hasher, position, file['size'])
+                digest = hasher.hexdigest()
+                if file.get('sha256') and file['sha256'] != digest:
+                    file['ranges'] = []
+                    raise UploadError(f"SHA-256 de {file['filename']} não confere; reenvie a imagem",
+                                      422, index=index)
+                files.append(SpooledFile(file['filename'], self._part(upload_id, index), digest))
+            return files, state['form']
+
+    def finish(self, upload_id, session_id, response):
+        """
+        Registra a sessão criada e a resposta da finalização (devolvida nas
+        repetições) e apaga as partes; o estado fica para as repetições
+        """
+        with self._state(upload_id) as state:
+            state['session_id'] = session_id
+            state['response'] = response
+            for index in range(len(state['files'])):
+                try:
+                    os.remove(self._part(upload_id, index))
+                except FileNotFoundError:
+                    pass
+
+    def result(self, upload_id):
+        """(sessão criada, resposta da finalização), ou (None, None) se não finalizado"""
+        with self._state(upload_id, write=False) as state:
+            return state['session_id'], state.get('response')
+
+    def delete(self, upload_id):
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+        with self._lock:
+            for key in [k for k in self._hashers if k[0] == upload_id]:
+                del self._hashers[key]
+
+    def expire(self, before):
+        """Remove uploads sem atividade desde `before` (timestamp); retorna quantos"""
+        removed = 0
+        for upload_id in os.listdir(self.root):
+            try:
+                updated_at = os.stat(os.path.join(self.root, upload_id, 'state.json')).st_mtime
+            except OSError:
+                continue
+            if updated_at < before:
+                try:
+                    self.delete(upload_id)
+                except UploadError:
+                    continue
+                removed += 1
+        return removed
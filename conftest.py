@@ -0,0 +1,66 @@
+"""
+Configuração dos testes (pytest): o app é importado sem provedores externos,
+com sessões e blobs em memória e sem aquecimento, gerando só desenhos locais.
+"""
+
+import io
+import os
+import tempfile
+
+import pytest
+
+# Antes de importar o app: variáveis já definidas não são sobrescritas pelo .env
+for _name in ('ANTHROPIC_API_KEY', 'OPENAI_API_KEY', 'HF_SPACE_URL', 'HF_API_KEY',
+              'ASYNC_PROVIDERS', 'SPECULATIVE_ANALYSIS', 'ADMIN_TOKEN'):
+    os.environ[_name] = ''
+os.environ['WARMUP'] = '0'
+os.environ['SESSION_BACKEND'] = 'memory'
+os.environ['BLOB_BACKEND'] = 'memory'
+# Todas as gerações da suíte saem do mesmo IP: o balde de fichas por cliente
+# (testado à parte em test_admission.py) não pode esgotar no meio da suíte
+os.environ['GENERATION_BURST'] = '1000'
+os.environ['UPLOAD_SPOOL_DIR'] = tempfile.mkdtemp(prefix='marmoview-test-uploads-')
+
+
+def jpeg_bytes(seed=0, size=(320, 240)):
+    """JPEG pequeno e determinístico, diferente para cada seed"""
+    from PIL import Image, ImageDraw
+    img = Image.new('RGB', size, (100, 110, 120))
+    draw = ImageDraw.Draw(img)
+    shift = seed * 7 % 200  # retângulos sempre dentro da imagem
+    for i in range(8):
+        draw.rectangle([shift + i * 30, i * 20, shift + i * 30 + 40, i * 20 + 25],
+                       fill=(i * 25, seed * 30 % 255, 90))
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='session')
+def marmo_app():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(marmo_app):
+    return marmo_app.app.test_client()
+
+
+@pytest.fixture
+def upload(client):
+    """Cria uma sessão com `n` fotos e retorna o session_id"""
+    def _upload(n=2, seed=0, **form):
+        data = {'images': [(io.BytesIO(jpeg_bytes(seed + i)), f'foto{i}.jpg') for i in range(n)],
+                'envType': 'cozinha', 'format': 'l', **form}
+        response = client.post('/api/upload', data=data, content_type='multipart/form-data')
+        assert response.status_code == 200, response.json
+        return response.json['session_id']
+    return _upload
+
+
+@pytest.fixture
+def admin(marmo_app, monkeypatch):
+    """Ativa as rotas de administração; retorna os headers autorizados"""
+    monkeypatch.setattr(marmo_app, 'ADMIN_TOKEN', 'token-de-teste')
+    return {'Authorization': 'Bearer token-de-teste'}
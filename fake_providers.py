@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+MarmoView - Servidor local que imita os provedores de IA (Anthropic, OpenAI
+Images e o /api/predict de um Space Gradio), para testes de carga sem gastar
+créditos. Latência, taxa de erros, travamentos e tamanho das imagens são
+configuráveis por provedor (arquivo JSON, linha de comando ou em tempo de
+execução via PUT /_fake/config).
+
+Uso:
+    python fake_providers.py --port 8900 --latency-scale 0.1
+
+Apontando a aplicação para ele (.env):
+    ANTHROPIC_API_KEY=fake
+    ANTHROPIC_BASE_URL=http://localhost:8900
+    OPENAI_API_KEY=fake
+    OPENAI_BASE_URL=http://localhost:8900/v1
+    HF_SPACE_URL=http://localhost:8900
+
+Os SDKs da Anthropic e da OpenAI leem ANTHROPIC_BASE_URL/OPENAI_BASE_URL
+diretamente. O Hugging Face só é usado sem OpenAI configurado, e o servidor
+atende o caminho HTTP (/upload e /api/predict) usado quando gradio_client
+não está instalado. As estatísticas do 'hf' incluem os bytes recebidos
+(request_bytes), para comparar o tamanho das requisições.
+
+Distribuições de latência (segundos, multiplicadas por latency_scale):
+    {"dist": "fixed", "value": 1.0}
+    {"dist": "uniform", "min": 0.5, "max": 2.0}
+    {"dist": "lognormal", "median": 3.0, "sigma": 0.5}
+"""
+
+import argparse
+import base64
+import copy
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, jsonify, request, send_file
+
+DEFAULT_CONFIG = {
+    'latency_scale': 1.0,
+    # Duração de um "travamento" (requisição que não responde a tempo)
+    'hang_seconds': 300,
+    'anthropic': {
+        'latency': {'dist': 'lognormal', 'median': 4.0, 'sigma': 0.4},
+        'error_rate': 0.0,
+        'error_status': 529,
+        'hang_rate': 0.0,
+        # Fração de respostas sem alguma chave obrigatória (exercita o reparo)
+        'partial_rate': 0.0,
+    },
+    'openai': {
+        'latency': {'dist': 'lognormal', 'median': 12.0, 'sigma': 0.3},
+        'error_rate': 0.0,
+        'error_status': 500,
+        'hang_rate': 0.0,
+        # Latência do download da imagem pela URL devolvida
+        'download_latency': {'dist': 'fixed', 'value': 0.3},
+        # Lado da imagem gerada em pixels (None = o tamanho pedido)
+        'image_size': None,
+    },
+    'hf': {
+        'latency': {'dist': 'lognormal', 'median': 20.0, 'sigma': 0.5},
+        'error_rate': 0.0,
+        'error_status': 500,
+        'hang_rate': 0.0,
+        'image_size': 512,
+        # 'base64' (data URI no corpo), 'url' (arquivo para baixar) ou
+        # 'file' (FileData do Gradio com o caminho e a URL do arquivo)
+        'mode': 'base64',
+        # /upload disponível (Spaces antigos só aceitam a imagem no corpo)
+        'upload': True,
+    },
+}
+
+# Análise enlatada: cobre todas as chaves do schema da ferramenta de análise
+CANNED_ANALYSIS = {
+    'layout_analysis': 'Cozinha em L com parede de azulejos ao fundo e janela à direita',
+    'space_dimensions': {'width_ratio': 1.6, 'depth_ratio': 0.4, 'height_estimate': 240},
+    'stone_layout': {
+        'main_surface': 'bancada',
+        'positions': [
+            {'element': 'bancada', 'x_start': 10, 'x_end': 80, 'y_start': 55, 'y_end': 70,
+             'description': 'Bancada principal ao longo da parede'},
+            {'element': 'ilha', 'x_start': 35, 'x_end': 65, 'y_start': 78, 'y_end': 92,
+             'description': 'Ilha central'},
+        ],
+    },
+    'cutouts_positions': [
+        {'type': 'pia', 'x': 30, 'y': 60, 'size': 'médio', 'notes': 'Cuba sob a janela'},
+        {'type': 'cooktop', 'x': 65, 'y': 60, 'size': 'médio'},
+    ],
+    'format_recommendation': 'O formato em L aproveita a parede lateral sem bloquear a circulação',
+    'visual_references': ['mármore branco', 'veios cinza', 'armários em madeira clara'],
+    'drawing_instructions': ['Bancada com 60cm de profundidade', 'Frontão de 10cm'],
+    'challenges': ['Emenda no canto do L', 'Recorte da pia próximo à borda'],
+    'confidence': 72,
+}
+
+fake = Flask(__name__)
+_config = copy.deepcopy(DEFAULT_CONFIG)
+_config_lock = threading.Lock()
+_stats = {}
+_rng = random.Random()
+_images = {}  # lado em pixels -> PNG
+
+
+def config(provider=None):
+    with _config_lock:
+        return copy.deepcopy(_config[provider] if provider else _config)
+
+
+def _merge(target, changes):
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict) and 'dist' not in value:
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def sample_latency(spec):
+    """Sorteia uma latência (segundos) da distribuição `spec`, já escalada"""
+    if not spec:
+        return 0.0
+    dist = spec.get('dist', 'fixed')
+    if dist == 'uniform':
+        value = _rng.uniform(spec['min'], spec['max'])
+    elif dist == 'lognormal':
+        value = _rng.lognormvariate(math.log(spec['median']), spec.get('sigma', 0.5))
+    else:
+        value = spec.get('value', 0.0)
+    return max(0.0, value * config()['latency_scale'])
+
+
+def count(provider, outcome):
+    with _config_lock:
+        provider_stats = _stats.setdefault(provider, {})
+        provider_stats[outcome] = provider_stats.get(outcome, 0) + 1
+
+
+def count_bytes(provider):
+    with _config_lock:
+        provider_stats = _stats.setdefault(provider, {})
+        provider_stats['request_bytes'] = provider_stats.get('request_bytes', 0) + (request.content_length or 0)
+
+
+def simulate(provider):
+    """
+    Espera a latência do provedor e aplica as falhas configuradas.
+    Retorna o status de erro a responder, ou None para responder normalmente.
+    """
+    settings = config(provider)
+    roll = _rng.random()
+    if roll < settings['hang_rate']:
+        count(provider, 'hang')
+        time.sleep(config()['hang_seconds'])
+        return 504
+    time.sleep(sample_latency(settings['latency']))
+    if roll < settings['hang_rate'] + settings['error_rate']:
+        count(provider, 'error')
+        return settings['error_status']
+    count(provider, 'ok')
+    return None
+
+
+def placeholder_png(size):
+    """PNG de `size`x`size` com textura de mármore (gerado uma vez por tamanho)"""
+    if size not in _images:
+        from PIL import Image, ImageDraw
+        img = Image.new('RGB', (size, size), (228, 226, 222))
+        draw = ImageDraw.Draw(img)
+        rng = random.Random(size)
+        for _ in range(12):
+            y = rng.randint(0, size)
+            points = [(x, y + rng.randint(-size // 10, size // 10)) for x in range(0, size + 64, 64)]
+            draw.line(points, fill=(150, 150, 155), width=max(1, size // 256))
+        buffer = io.BytesIO()
+        img.save(buffer, format='PNG')
+        _images[size] = buffer.getvalue()
+    return _images[size]
+
+
+def _schema_value(schema):
+    """Valor mínimo válido para um trecho de JSON schema sem resposta enlatada"""
+    kind = schema.get('type')
+    if kind == 'object':
+        return {k: _schema_value(v) for k, v in schema.get('properties', {}).items()
+                if k in schema.get('required', [])}
+    return {'string': '', 'number': 0, 'integer': 0, 'array': [], 'boolean': False}.get(kind)
+
+
+# --- Anthropic (POST /v1/messages) ---
+
+@fake.route('/v1/messages', methods=['POST'])
+def anthropic_messages():
+    body = request.get_json(force=True)
+    status = simulate('anthropic')
+    if status:
+        return jsonify({'type': 'error', 'error': {'type': 'overloaded_error' if status == 529 else 'api_error',
+                                                   'message': 'Falha simulada pelo servidor falso'}}), status
+
+    tool = (body.get('tools') or [{}])[0]
+    schema = tool.get('input_schema', {})
+    keys = schema.get('required') or list(schema.get('properties', {}))
+    analysis = {k: copy.deepcopy(CANNED_ANALYSIS[k]) if k in CANNED_ANALYSIS
+                else _schema_value(schema['properties'][k]) for k in keys}
+    if len(keys) > 1 and _rng.random() < config('anthropic')['partial_rate']:
+        analysis.pop(keys[-1])
+
+    content = [{'type': 'tool_use', 'id': f"toolu_{uuid.uuid4().hex[:24]}",
+                'name': tool.get('name', 'tool'), 'input': analysis}]
+    if not tool:
+        content = [{'type': 'text', 'text': json.dumps(CANNED_ANALYSIS, ensure_ascii=False)}]
+    request_bytes = len(request.get_data())
+    return jsonify({
+        'id': f"msg_{uuid.uuid4().hex[:24]}",
+        'type': 'message',
+        'role': 'assistant',
+        'model': body.get('model', 'claude-fake'),
+        'content': content,
+        'stop_reason': 'tool_use' if tool else 'end_turn',
+        'stop_sequence': None,
+        # Estimativa grosseira: ~4 bytes por token de entrada
+        'usage': {'input_tokens': request_bytes // 4,
+                  'output_tokens': len(json.dumps(analysis)) // 4},
+    })
+
+
+# --- Lista de modelos (GET /v1/models: usado no aquecimento das conexões) ---
+
+@fake.route('/v1/models', methods=['GET'])
+def list_models():
+    models = [{'id': 'claude-3-5-sonnet-20241022', 'type': 'model', 'object': 'model',
+               'display_name': 'Claude (falso)', 'created_at': '2024-10-22T00:00:00Z',
+               'created': 1729555200, 'owned_by': 'fake'},
+              {'id': 'dall-e-3', 'type': 'model', 'object': 'model', 'display_name': 'DALL-E 3 (falso)',
+               'created_at': '2023-10-31T00:00:00Z', 'created': 1698710400, 'owned_by': 'fake'}]
+    return jsonify({'object': 'list', 'data': models, 'has_more': False,
+                    'first_id': models[0]['id'], 'last_id': models[-1]['id']})
+
+
+# --- OpenAI Images (POST /v1/images/generations) ---
+
+@fake.route('/v1/images/generations', methods=['POST'])
+def openai_images():
+    body = request.get_json(force=True)
+    status = simulate('openai')
+    if status:
+        return jsonify({'error': {'message': 'Falha simulada pelo servidor falso',
+                                  'type': 'server_error', 'code': None}}), status
+
+    settings = config('openai')
+    size = settings['image_size'] or int(str(body.get('size', '1024x1024')).split('x')[0])
+    if body.get('response_format') == 'b64_json':
+        item = {'b64_json': base64.b64encode(placeholder_png(size)).decode('ascii')}
+    else:
+        item = {'url': f"{request.host_url}files/{size}.png?id={uuid.uuid4().hex}"}
+    item['revised_prompt'] = body.get('prompt', '')
+    return jsonify({'created': int(time.time()), 'data': [item] * int(body.get('n', 1))})
+
+
+@fake.route('/files/<int:size>.png', methods=['GET'])
+def download_image(size):
+    time.sleep(sample_latency(config('openai')['download_latency']))
+    return send_file(io.BytesIO(placeholder_png(size)), mimetype='image/png')
+
+
+# --- Hugging Face Space / Gradio (POST /upload e /api/predict) ---
+
+@fake.route('/upload', methods=['POST'])
+def gradio_upload():
+    """Recebe os arquivos em multipart e devolve os caminhos "no servidor" do Space"""
+    count_bytes('hf')
+    if not config('hf')['upload']:
+        return jsonify({'detail': 'Not Found'}), 404
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({'error': 'Nenhum arquivo'}), 422
+    return jsonify([f"/tmp/gradio/{uuid.uuid4().hex}/{f.filename}" for f in files])
+
+
+@fake.route('/api/predict', methods=['POST'])
+@fake.route('/api/predict/', methods=['POST'])
+def gradio_predict():
+    started = time.time()
+    count_bytes('hf')
+    status = simulate('hf')
+    if status:
+        return jsonify({'error': 'Falha simulada pelo servidor falso'}), status
+
+    settings = config('hf')
+    size = settings['image_size']
+    if settings['mode'] == 'url':
+        output = f"{request.host_url}files/{size}.png?id={uuid.uuid4().hex}"
+    elif settings['mode'] == 'file':
+        path = f"/tmp/gradio/{uuid.uuid4().hex}/image.png"
+        output = {'path': path, 'url': f"{request.host_url}files/{size}.png?id={uuid.uuid4().hex}",
+                  'orig_name': 'image.png', 'meta': {'_type': 'gradio.FileData'}}
+    else:
+        output = 'data:image/png;base64,' + base64.b64encode(placeholder_png(size)).decode('ascii')
+    return jsonify({'data': [output], 'is_generating': False,
+                    'duration': round(time.time() - started, 3), 'average_duration': None})
+
+
+# --- Controle ---
+
+@fake.route('/_fake/config', methods=['GET', 'PUT'])
+def fake_config():
+    """GET: configuração atual; PUT: mescla o JSON enviado (ex.: {"openai": {"error_rate": 0.2}})"""
+    if request.method == 'PUT':
+        with _config_lock:
+            _merge(_config, request.get_json(force=True))
+    return jsonify(config())
+
+
+@fake.route('/_fake/stats', methods=['GET', 'DELETE'])
+def fake_stats():
+    """Requisições por provedor e desfecho (ok/error/hang); DELETE zera"""
+    with _config_lock:
+        if request.method == 'DELETE':
+            _stats.clear()
+        return jsonify(copy.deepcopy(_stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Provedores de IA falsos para testes de carga')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--config', help='JSON com a configuração (mesclada aos padrões)')
+    parser.add_argument('--latency-scale', type=float, help='multiplica todas as latências')
+    parser.add_argument('--seed', type=int, help='semente das latências e falhas')
+    args = parser.parse_args()
+
+    if args.config:
+        with open(args.config) as f:
+            _merge(_config, json.load(f))
+    if args.latency_scale is not None:
+        _config['latency_scale'] = args.latency_scale
+    if args.seed is not None:
+        _rng.seed(args.seed)
+
+    print("=" * 60)
+    print(f"MarmoView - Provedores falsos em http://{args.host}:{args.port}")
+    print("=" * 60)
+    print(json.dumps(_config, indent=2, ensure_ascii=False))
+    fake.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+MarmoView - Preparação de imagens para os provedores de IA
+Folha de contato (várias fotos em um único bloco de imagem) e seleção das
+fotos mais informativas (nitidez, exposição e detecção de quase-duplicatas)
+"""
+
+import io
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Limites de resolução para a folha de contato: o modelo reduz internamente
+# imagens acima de ~1568px no lado maior / ~1.15 megapixels, então enviar mais
+# que isso só aumenta custo e latência.
+CONTACT_SHEET_MAX_SIDE = 1568
+CONTACT_SHEET_MAX_PIXELS = 1_150_000
+CONTACT_SHEET_GAP = 8
+
+
+def _sheet_grid(count):
+    """Retorna (colunas, linhas, lado do tile) para `count` fotos"""
+    cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    tile = min(
+        (CONTACT_SHEET_MAX_SIDE - CONTACT_SHEET_GAP * (cols - 1)) // cols,
+        (CONTACT_SHEET_MAX_SIDE - CONTACT_SHEET_GAP * (rows - 1)) // rows,
+        int(math.sqrt(CONTACT_SHEET_MAX_PIXELS / (cols * rows))),
+    )
+    return cols, rows, tile
+
+
+def build_contact_sheet(images_bytes, quality=85):
+    """
+    Monta uma folha de contato JPEG com as fotos lado a lado, numeradas 1..N.
+    Cada foto é reduzida para caber no seu tile (mantendo proporção).
+    Retorna bytes JPEG.
+    """
+    count = len(images_bytes)
+    if count == 0:
+        raise ValueError("Nenhuma imagem para a folha de contato")
+
+    cols, rows, tile = _sheet_grid(count)
+    sheet_w = cols * tile + CONTACT_SHEET_GAP * (cols - 1)
+    sheet_h = rows * tile + CONTACT_SHEET_GAP * (rows - 1)
+
+    # Canvas em NumPy: cada foto é copiada por fatiamento no seu tile
+    sheet = np.full((sheet_h, sheet_w, 3), 255, dtype=np.uint8)
+    origins = []
+    for index, img_bytes in enumerate(images_bytes):
+        img = Image.open(io.BytesIO(img_bytes))
+        img.draft('RGB', (tile, tile))  # JPEG: decodifica já reduzido
+        img = img.convert('RGB')
+        img.thumbnail((tile, tile), Image.LANCZOS)
+        pixels = np.asarray(img)
+
+        col, row = index % cols, index // cols
+        x0 = col * (tile + CONTACT_SHEET_GAP) + (tile - pixels.shape[1]) // 2
+        y0 = row * (tile + CONTACT_SHEET_GAP) + (tile - pixels.shape[0]) // 2
+        sheet[y0:y0 + pixels.shape[0], x0:x0 + pixels.shape[1]] = pixels
+        origins.append((col * (tile + CONTACT_SHEET_GAP), row * (tile + CONTACT_SHEET_GAP)))
+
+    # Rótulos numerados no canto de cada tile
+    out = Image.fromarray(sheet)
+    draw = ImageDraw.Draw(out)
+    try:
+        font = ImageFont.truetype("arial.ttf", max(18, tile // 12))
+    except Exception:
+        font = ImageFont.load_default()
+    badge = max(28, tile // 9)
+    for index, (x, y) in enumerate(origins):
+        draw.rectangle([x, y, x + badge, y + badge], fill=(20, 20, 20))
+        draw.text((x + badge // 4, y + badge // 8), str(index + 1), fill=(255, 255, 255), font=font)
+
+    buffer = io.BytesIO()
+    out.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+# --- Pontuação e seleção de fotos ---
+
+# Lado da cópia reduzida usada na pontuação (rápido e suficiente para nitidez)
+SCORE_SIDE = 256
+# Distância de Hamming (em 64 bits) abaixo da qual duas fotos são quase iguais
+NEAR_DUPLICATE_DISTANCE = 10
+
+
+def _dct_matrix(n):
+    """Matriz da DCT-II ortonormal n x n"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def _perceptual_hash(gray):
+    """pHash de 64 bits: DCT 32x32, bloco 8x8 de baixa frequência vs mediana"""
+    small = np.asarray(Image.fromarray(gray).resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    coeffs = (_DCT_32 @ small @ _DCT_32.T)[:8, :8].flatten()
+    bits = coeffs > np.median(coeffs[1:])  # mediana sem o termo DC
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:016x}"
+
+
+def hash_distance(hash_a, hash_b):
+    """Distância de Hamming entre dois pHash hexadecimais"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def score_image(img_bytes):
+    """
+    Pontua uma foto a partir de uma cópia reduzida em tons de cinza.
+    Retorna dict com phash, sharpness (variância do Laplaciano),
+    exposure (0-1, penaliza fotos escuras/estouradas) e score final.
+    """
+    img = Image.open(io.BytesIO(img_bytes))
+    img.draft('L', (SCORE_SIDE, SCORE_SIDE))
+    img = img.convert('L')
+    img.thumbnail((SCORE_SIDE, SCORE_SIDE))
+    gray = np.asarray(img)
+
+    # Nitidez: variância do Laplaciano 4-vizinhos
+    g = gray.astype(np.float32)
+    lap = (g[1:-1, :-2] + g[1:-1, 2:] + g[:-2, 1:-1] + g[2:, 1:-1] - 4 * g[1:-1, 1:-1])
+    sharpness = float(lap.var()) if lap.size else 0.0
+
+    # Exposição: brilho médio perto do meio-tom e poucos pixels saturados
+    mean = float(g.mean()) / 255.0
+    clipped = float(np.mean((gray <= 5) | (gray >= 250)))
+    exposure = max(0.0, 1.0 - 2.0 * abs(mean - 0.5)) * (1.0 - clipped)
+
+    return {
+        'phash': _perceptual_hash(gray),
+        'sharpness': round(sharpness, 2),
+        'exposure': round(exposure, 3),
+        'score': round(float(np.log1p(sharpness)) * (0.5 + 0.5 * exposure), 4),
+    }
+
+
+def rank_images(qualities, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    Ordena as fotos da melhor para a pior, descartando quase-duplicatas.
+    `qualities` é a lista de dicts de score_image (None = sem pontuação).
+    Retorna a lista de índices das fotos distintas, melhor primeiro.
+    """
+    order = sorted(range(len(qualities)),
+                   key=lambda i: qualities[i]['score'] if qualities[i] else -1.0,
+                   reverse=True)
+    selected = []
+    for i in order:
+        quality = qualities[i]
+        if quality and any(
+            qualities[j] and hash_distance(quality['phash'], qualities[j]['phash']) <= max_distance
+            for j in selected
+        ):
+            continue
+        selected.append(i)
+    return selected
@@ -0,0 +1,238 @@
+"""
+MarmoView - Métricas no formato de exposição do Prometheus (texto 0.0.4)
+Implementação mínima, sem dependências: histogramas de latência por etapa,
+contadores de chamadas aos provedores (sucesso/falha) e de acertos de cache,
+e gauges calculados na hora da coleta (sessões, blobs, jobs em andamento).
+Cada etapa medida também vira um span do trace da requisição (tracing.py).
+
+Valores são por processo: com vários workers, cada um expõe os seus em
+/metrics e o Prometheus agrega por instância.
+"""
+
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+import tracing
+
+# Limites dos buckets de latência (segundos): de renderizações de poucos ms
+# até gerações de imagem de dezenas de segundos
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for key, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}  # labels -> [contagens por bucket, soma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {k: (list(c), s, n) for k, (c, s, n) in self._series.items()}
+        for key, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _labels(self.labelnames, key, ('le', _number(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_number(round(total, 6))}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge calculado na coleta: `fn` retorna um número ou {rótulo: número}"""
+
+    def __init__(self, name, help_text, fn, labelname=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelname = labelname
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"[Métricas] ⚠️ Falha ao coletar {self.name}: {e}")
+            return lines
+        if isinstance(value, dict):
+            for label, item in sorted(value.items()):
+                lines.append(f"{self.name}{_labels((self.labelname,), (label,))} {_number(item)}")
+        else:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Metrics:
+    """Registro das métricas da aplicação"""
+
+    def __init__(self, prefix='marmoview'):
+        self.prefix = prefix
+        self._metrics = []
+        self.stage_seconds = self.add(Histogram(
+            f"{prefix}_stage_duration_seconds",
+            "Duração de cada etapa (upload, análise, renderização, provedores, PDF)",
+            ('stage',)))
+        self.provider_requests = self.add(Counter(
+            f"{prefix}_provider_requests_total",
+            "Chamadas aos provedores de IA por resultado",
+            ('provider', 'outcome')))
+        self.cache_requests = self.add(Counter(
+            f"{prefix}_cache_requests_total",
+            "Consultas a caches e reaproveitamentos por resultado (hit/miss)",
+            ('cache', 'result')))
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, fn, labelname=None):
+        """Registra um gauge calculado na coleta"""
+        return self.add(Gauge(f"{self.prefix}_{name}", help_text, fn, labelname))
+
+    def observe_stage(self, stage, started):
+        """Registra a etapa iniciada em `started` (perf_counter) no histograma e no trace"""
+        elapsed = time.perf_counter() - started
+        self.stage_seconds.observe(elapsed, stage=stage)
+        tracing.add_span(stage, started, elapsed)
+
+    @contextmanager
+    def time_stage(self, stage):
+        """Mede o bloco como uma etapa (registra mesmo se levantar exceção)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, started)
+
+    def timed(self, stage):
+        """Decorador: mede cada chamada da função (síncrona ou corrotina) como etapa"""
+        def decorate(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper_async(*args, **kwargs):
+                    with self.time_stage(stage):
+                        return await fn(*args, **kwargs)
+                return wrapper_async
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.time_stage(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def provider(self, name, stage=None, enabled=None):
+        """
+        Decorador para chamadas a provedores: mede a duração (etapa `stage`,
+        padrão = nome do provedor) e conta sucesso/falha. Resultado vazio
+        (None) ou exceção contam como falha. Com `enabled` retornando False
+        (provedor não configurado) a chamada não é medida.
+        """
+        stage = stage or name
+
+        def record(started, result):
+            self.observe_stage(stage, started)
+            self.provider_requests.inc(provider=name, outcome='success' if result else 'failure')
+
+        def decorate(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def wrapper_async(*args, **kwargs):
+                    if enabled is not None and not enabled():
+                        return await fn(*args, **kwargs)
+                    started, result = time.perf_counter(), None
+                    try:
+                        result = await fn(*args, **kwargs)
+                        return result
+                    finally:
+                        record(started, result)
+                return wrapper_async
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if enabled is not None and not enabled():
+                    return fn(*args, **kwargs)
+                started, result = time.perf_counter(), None
+                try:
+                    result = fn(*args, **kwargs)
+                    return result
+                finally:
+                    record(started, result)
+            return wrapper
+        return decorate
+
+    def cache(self, cache, hit):
+        """Conta um acerto (hit=True) ou falta no cache `cache`"""
+        self.cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+    def render(self):
+        """Todas as métricas no formato de exposição do Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,55 @@
+"""
+MarmoView - Registro dos clientes/SDKs dos provedores, carregados sob demanda
+Importar os SDKs da Anthropic e da OpenAI custa mais de um segundo; com o
+registro, cada SDK só é importado (e seu cliente construído) no primeiro uso,
+e um worker que nunca chama um provedor nunca o carrega. `installed` diz se
+o pacote existe sem importá-lo.
+"""
+
+import importlib.util
+import threading
+import time
+
+
+class ProviderRegistry:
+    def __init__(self):
+        self._factories = {}  # nome -> (fábrica, pacote)
+        self._clients = {}
+        self._load_seconds = {}
+        self._installed = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, module=None):
+        """Registra a fábrica do cliente `name` (pacote `module`, para `installed`)"""
+        self._factories[name] = (factory, module or name)
+
+    def installed(self, name):
+        """O pacote do provedor está instalado? (sem importá-lo; resultado em cache)"""
+        module = self._factories[name][1] if name in self._factories else name
+        if module not in self._installed:
+            self._installed[module] = importlib.util.find_spec(module) is not None
+        return self._installed[module]
+
+    def get(self, name):
+        """Cliente de `name`, construído (com o import do SDK) no primeiro uso"""
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._lock:
+            if name not in self._clients:
+                started = time.perf_counter()
+                self._clients[name] = self._factories[name][0]()
+                self._load_seconds[name] = time.perf_counter() - started
+                print(f"[Provedores] {name} carregado em {self._load_seconds[name] * 1000:.0f} ms")
+            return self._clients[name]
+
+    def load_seconds(self):
+        """Tempo de carga (import + construção) dos clientes já carregados"""
+        return dict(self._load_seconds)
+
+    def stats(self):
+        return {name: {'installed': self.installed(name),
+                       'loaded': name in self._clients,
+                       'load_ms': round(self._load_seconds[name] * 1000, 1)
+                       if name in self._load_seconds else None}
+                for name in self._factories}
@@ -0,0 +1,211 @@
+"""
+MarmoView - Pool de processos para renderização (PIL e reportlab)
+O desenho 1200x800 + codificação PNG e o PDF são CPU puros e seguram o GIL;
+num pool de processos as renderizações concorrentes escalam com os núcleos.
+
+Entrada: spec compacta em JSON (cena vetorial do desenho, dados do PDF).
+Saída: bytes PNG/PDF escritos pelo worker num bloco de memória compartilhada
+(multiprocessing.shared_memory), sem passar pelo pickle da fila de retorno.
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+
+class RenderQueueFull(Exception):
+    """Fila de renderização cheia (RENDER_QUEUE_DEPTH) além do tempo de espera"""
+
+
+class RenderTimeout(Exception):
+    """Renderização no pool passou de RENDER_TIMEOUT segundos"""
+
+
+def encode_spec(**fields):
+    """Serializa a spec de renderização (JSON compacto em bytes)"""
+    return json.dumps(fields, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _render(kind, spec):
+    import rendering
+    if kind == 'drawing':
+        return rendering.render_png(spec['scene'])
+    if kind == 'pdf':
+        return rendering.build_pdf(spec['drawing'], spec['session_id'], spec.get('scene'))
+    raise ValueError(f"Tipo de renderização desconhecido: {kind}")
+
+
+def _worker(kind, spec_bytes):
+    """Executa no processo do pool: renderiza e devolve (nome shm, tamanho, segundos)"""
+    started = time.perf_counter()
+    output = _render(kind, json.loads(spec_bytes))
+    elapsed = time.perf_counter() - started
+
+    shm = shared_memory.SharedMemory(create=True, size=max(len(output), 1))
+    shm.buf[:len(output)] = output
+    name = shm.name
+    shm.close()
+    # Quem libera o bloco é o processo principal (unlink após copiar)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return name, len(output), elapsed
+
+
+def _collect(name, size):
+    """Copia o resultado da memória compartilhada e libera o bloco"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _discard_result(future):
+    """Resultado que chegou depois do timeout: só libera a memória compartilhada"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    name, size, _elapsed = future.result()
+    _collect(name, size)
+
+
+class RenderPool:
+    """
+    Pool de renderização. size=0 renderiza na própria thread (sem pool).
+    queue_depth limita renderizações pendentes (em execução + na fila);
+    acima disso, `render` espera até queue_timeout e então levanta RenderQueueFull.
+    Uma renderização que passa de render_timeout levanta RenderTimeout; se um
+    worker morre, o pool é recriado e a renderização é feita na própria thread.
+    """
+
+    def __init__(self, size=0, queue_depth=None, queue_timeout=30.0, render_timeout=60.0,
+                 history=500):
+        self.size = size
+        self.queue_depth = queue_depth or max(size * 4, 1)
+        self.queue_timeout = queue_timeout
+        self.render_timeout = render_timeout or None
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._timings = deque(maxlen=history)
+        self._pending = 0
+        self._fallbacks = 0
+
+    def start(self):
+        """
+        Cria os processos do pool. Deve ser chamado na importação da aplicação,
+        antes de existirem outras threads: com fork os workers nascem todos de
+        uma vez, sem reimportar o módulo principal (com spawn, cada worker
+        reexecutaria a inicialização do app).
+        """
+        if self.size <= 0 or self._executor is not None:
+            return
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self._executor = ProcessPoolExecutor(max_workers=self.size, mp_context=context)
+        # Força a criação dos workers agora
+        self._executor.submit(os.getpid).result()
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                self.start()
+        return self._executor
+
+    def _replace(self, broken):
+        """
+        Descarta o pool quebrado; o próximo `render` cria outro. Esse fork já
+        acontece com threads rodando, ao contrário do de `start`.
+        """
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+                self._fallbacks += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _render_here(self, kind, spec, queued):
+        output = _render(kind, spec)
+        total = time.perf_counter() - queued
+        self._record(kind, 0.0, total, total, len(output))
+        return output
+
+    def render(self, kind, **spec):
+        """Renderiza 'drawing' (PNG) ou 'pdf' e retorna os bytes"""
+        queued = time.perf_counter()
+        if self.size <= 0:
+            return self._render_here(kind, spec, queued)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise RenderQueueFull(f"Fila de renderização cheia ({self.queue_depth})")
+        try:
+            with self._lock:
+                self._pending += 1
+            executor = self._pool()
+            try:
+                future = executor.submit(_worker, kind, encode_spec(**spec))
+                name, size, worker_seconds = future.result(timeout=self.render_timeout)
+            except BrokenProcessPool:
+                # Um worker morreu (falta de memória, sinal): o pool inteiro fica inutilizável
+                print(f"[Render] ⚠️ Pool de renderização quebrado; recriando e renderizando "
+                      f"'{kind}' na thread da requisição")
+                self._replace(executor)
+                return self._render_here(kind, spec, queued)
+            except FutureTimeout:
+                future.cancel()
+                future.add_done_callback(_discard_result)
+                raise RenderTimeout(f"Renderização '{kind}' passou de {self.render_timeout} s")
+            output = _collect(name, size)
+        finally:
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+        total = time.perf_counter() - queued
+        self._record(kind, total - worker_seconds, worker_seconds, total, size)
+        return output
+
+    def _record(self, kind, overhead, worker, total, size):
+        self._timings.append({
+            'kind': kind,
+            'overhead_ms': round(overhead * 1000, 2),
+            'render_ms': round(worker * 1000, 2),
+            'total_ms': round(total * 1000, 2),
+            'bytes': size,
+            'at': time.time(),
+        })
+
+    def pending(self):
+        return self._pending
+
+    def stats(self):
+        """Resumo das últimas renderizações por tipo (contagem, p50/p95, bytes)"""
+        by_kind = {}
+        for timing in list(self._timings):
+            by_kind.setdefault(timing['kind'], []).append(timing)
+        summary = {}
+        for kind, items in by_kind.items():
+            totals = sorted(t['total_ms'] for t in items)
+            summary[kind] = {
+                'count': len(items),
+                'p50_ms': totals[len(totals) // 2],
+                'p95_ms': totals[min(len(totals) - 1, int(len(totals) * 0.95))],
+                'avg_render_ms': round(sum(t['render_ms'] for t in items) / len(items), 2),
+                'avg_bytes': sum(t['bytes'] for t in items) // len(items),
+            }
+        return {
+            'pool_size': self.size,
+            'queue_depth': self.queue_depth,
+            'pending': self._pending,
+            'fallbacks': self._fallbacks,
+            'kinds': summary,
+            'recent': list(self._timings)[-10:],
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,496 @@
+"""
+MarmoView - Layout dos desenhos conceituais e geração do PDF (reportlab)
+O layout é montado uma vez como cena vetorial (scene.py) e dela saem o SVG,
+o PNG e os vetores embutidos no PDF (reportlab importado só no primeiro PDF). Módulo sem dependência do Flask, para
+poder ser importado pelos processos do pool de renderização (render_pool)
+sem carregar a aplicação.
+"""
+
+import io
+from datetime import datetime
+
+from scene import Scene, render_png, draw_scene_pdf
+
+def build_scene(drawing, form, ai_analysis=None, session_id=None, generated_at=None):
+    """
+    Monta a cena vetorial do desenho conceitual (1200x800 unidades).
+    Camadas: cabecalho, desenho (área quadriculada), notas, avisos e rodape;
+    a região 'desenho' é a área quadriculada. Retorna o dict da cena.
+    """
+    generated_at = generated_at or datetime.now()
+    
+    # Canvas 1200x800, fundo branco puro
+    scene = Scene(1200, 800, background=(255, 255, 255))
+    
+    # Configuração de cores profissionais
+    cor_principal = (70, 100, 90)  # verde-escuro elegante
+    cor_secundaria = (120, 160, 140)  # verde-médio
+    cor_texto = (30, 30, 30)  # quase preto
+    cor_titulo = (50, 50, 50)  # cinza escuro
+    cor_grid = (240, 240, 240)  # cinza muito claro
+    cor_recorte = (200, 50, 50)  # vermelho para recortes
+    cor_medida = (100, 100, 180)  # azul para medidas
+    
+    # === CABEÇALHO ===
+    scene.layer('cabecalho')
+    
+    # Título
+    scene.text((30, 20), "MARMOVIEW - DESENHO CONCEITUAL", fill=cor_titulo, font='titulo')
+    
+    # Linha divisória
+    scene.line([(30, 55), (1170, 55)], fill=cor_grid, width=2)
+    
+    # Informações do projeto
+    y = 70
+    info_text = f"Ambiente: {drawing['environment'].upper()}"
+    scene.text((30, y), info_text, fill=cor_texto, font='subtitulo')
+    
+    y = 95
+    formato_text = f"Configuração: {drawing['format']}"
+    scene.text((30, y), formato_text, fill=cor_texto, font='texto')
+    
+    # Elementos identificados
+    if drawing['elements'] and drawing['elements'][0] != 'nenhum':
+        y = 115
+        elementos = ', '.join([e.capitalize() for e in drawing['elements'][:5]])
+        scene.text((30, y), f"Elementos: {elementos}", fill=cor_secundaria, font='texto')
+    
+    # Mostra se análise IA foi aplicada
+    if ai_analysis and 'confidence' in ai_analysis:
+        y = 135
+        ai_confidence = ai_analysis.get('confidence', 0)
+        scene.text((30, y), f"✓ Análise IA aplicada - Confiança: {ai_confidence}%", 
+                 fill=cor_principal, font='texto')
+        y_offset = 170
+    else:
+        y = 135
+        scene.text((30, y), "⚠ Desenho baseado em formulário (sem análise de IA)", 
+                 fill=(150, 150, 150), font='nota')
+        y_offset = 160
+    
+    # === ÁREA DE DESENHO PRINCIPAL ===
+    scene.layer('desenho')
+    canvas_x = 50
+    canvas_y = y_offset
+    canvas_width = 1100
+    canvas_height = 500
+    scene.regions['desenho'] = [canvas_x, canvas_y, canvas_width, canvas_height]
+    
+    # Fundo da área de desenho
+    scene.rect([canvas_x, canvas_y, canvas_x + canvas_width, canvas_y + canvas_height], 
+                   fill=(250, 250, 250), outline=cor_titulo, width=2)
+    
+    # Grid profissional mais sutil
+    grid_spacing = 50
+    for i in range(0, canvas_width, grid_spacing):
+        scene.line([canvas_x + i, canvas_y, canvas_x + i, canvas_y + canvas_height], 
+                 fill=cor_grid, width=1)
+    for i in range(0, canvas_height, grid_spacing):
+        scene.line([canvas_x, canvas_y + i, canvas_x + canvas_width, canvas_y + i], 
+                 fill=cor_grid, width=1)
+    
+    # === DESENHO DA CONFIGURAÇÃO ===
+    margin_x = 100
+    margin_y = 50
+    drawing_area_width = canvas_width - 2 * margin_x
+    drawing_area_height = canvas_height - 2 * margin_y
+    base_x = canvas_x + margin_x
+    base_y = canvas_y + margin_y
+    
+    # Desenha baseado na configuração e análise IA
+    if ai_analysis and 'stone_layout' in ai_analysis:
+        draw_intelligent_layout(scene, ai_analysis, canvas_y, canvas_width, canvas_height, 
+                               cor_principal, cor_titulo, cor_texto, canvas_x, 'texto')
+    else:
+        # Desenho melhorado baseado no formato
+        draw_improved_format(scene, form['format'], base_x, base_y, drawing_area_width, 
+                           drawing_area_height, cor_principal, cor_secundaria, cor_titulo, 'texto')
+        
+        # Adiciona elementos de pedra
+        draw_improved_elements(scene, form['stoneElements'], base_x, base_y, 
+                              drawing_area_width, drawing_area_height, cor_secundaria, 'nota')
+        
+        # Adiciona recortes
+        draw_improved_cutouts(scene, form['cutouts'], base_x, base_y, 
+                            drawing_area_width, drawing_area_height, cor_recorte, 'nota')
+    
+    # === INFORMAÇÕES ADICIONAIS ===
+    scene.layer('notas')
+    y = canvas_y + canvas_height + 20
+    
+    # Recortes identificados
+    if drawing['cutouts'] and drawing['cutouts'][0] != 'nenhum':
+        recortes = ', '.join([c.capitalize() for c in drawing['cutouts'][:5]])
+        scene.text((canvas_x, y), f"Recortes previstos: {recortes}", 
+                 fill=cor_recorte, font='texto')
+        y += 20
+    
+    # === AVISOS IMPORTANTES ===
+    scene.layer('avisos')
+    y += 10
+    scene.rect([canvas_x, y, canvas_x + canvas_width, y + 60], 
+                   fill=(255, 245, 240), outline=cor_recorte, width=2)
+    
+    y += 10
+    scene.text((canvas_x + 20, y), "⚠️  IMPORTANTE - DESENHO CONCEITUAL", 
+             fill=cor_recorte, font='subtitulo')
+    y += 25
+    scene.text((canvas_x + 20, y), 
+             "• Não utilizar para fabricação • Requer medição precisa em campo • Sem escala exata", 
+             fill=cor_texto, font='nota')
+    
+    # === RODAPÉ ===
+    scene.layer('rodape')
+    scene.text((30, 775), f"MarmoView v1.0 - Gerado em {generated_at.strftime('%d/%m/%Y %H:%M')}", 
+             fill=(180, 180, 180), font='nota')
+    scene.text((900, 775), f"Sessão: {(session_id or 'N/A')[:12]}", 
+             fill=(180, 180, 180), font='nota')
+    
+    return scene.to_dict()
+
+def generate_drawing_image(drawing, data, ai_analysis=None):
+    """Gera imagem PNG do desenho conceitual (rasteriza a cena vetorial)"""
+    scene = build_scene(drawing, data['form'], ai_analysis, data.get('session_id'))
+    return render_png(scene)
+
+def draw_improved_format(scene, format_type, base_x, base_y, width, height, cor_principal, cor_secundaria, cor_borda, font):
+    """Desenha configuração de formato melhorada e proporcional"""
+    
+    # Mapeamento de formatos
+    format_map = {
+        'reto': 'Reto/Linear',
+        'l': 'Em L',
+        'u': 'Em U',
+        'ilha': 'Ilha Central',
+        'pensula': 'Península',
+        'irregular': 'Irregular'
+    }
+    
+    if format_type == 'reto':
+        # Bancada linear - ocupa 80% da largura
+        w = int(width * 0.8)
+        h = int(height * 0.25)
+        x = base_x + (width - w) // 2
+        y = base_y + height // 3
+        
+        # Bancada principal
+        scene.rect([x, y, x + w, y + h], outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x + 10, y + 10), "BANCADA", fill=cor_borda, font=font)
+        
+        # Linha de parede atrás
+        scene.line([base_x, y - 20, base_x + width, y - 20], fill=cor_borda, width=3)
+        scene.text((base_x + 10, y - 35), "PAREDE", fill=(150, 150, 150), font=font)
+        
+    elif format_type == 'l':
+        # Configuração em L
+        # Bancada horizontal
+        w1 = int(width * 0.6)
+        h1 = int(height * 0.2)
+        x1 = base_x + 50
+        y1 = base_y + 50
+        scene.rect([x1, y1, x1 + w1, y1 + h1], outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x1 + 10, y1 + 10), "BANCADA 1", fill=cor_borda, font=font)
+        
+        # Bancada vertical (perpendicular)
+        w2 = int(height * 0.2)
+        h2 = int(height * 0.5)
+        x2 = x1
+        y2 = y1 + h1
+        scene.rect([x2, y2, x2 + w2, y2 + h2], outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x2 + 10, y2 + 20), "BANCADA 2", fill=cor_borda, font=font)
+        
+        # Paredes
+        scene.line([base_x, y1 - 15, base_x + width, y1 - 15], fill=cor_borda, width=2)
+        scene.line([x2 - 15, y1, x2 - 15, base_y + height], fill=cor_borda, width=2)
+        
+    elif format_type == 'u':
+        # Configuração em U
+        espessura = int(height * 0.18)
+        
+        # Bancada direita
+        x1 = base_x + 50
+        y1 = base_y + 40
+        h1 = int(height * 0.7)
+        scene.rect([x1, y1, x1 + espessura, y1 + h1], 
+                      outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x1 + 5, y1 + 20), "BANC.\nLAT.", fill=cor_borda, font=font)
+        
+        # Bancada central (fundo)
+        x2 = x1
+        y2 = y1
+        w2 = int(width * 0.7)
+        scene.rect([x2, y2, x2 + w2, y2 + espessura], 
+                      outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x2 + w2//2 - 30, y2 + 10), "BANCADA FUNDO", fill=cor_borda, font=font)
+        
+        # Bancada esquerda
+        x3 = x2 + w2 - espessura
+        y3 = y2
+        scene.rect([x3, y3, x3 + espessura, y3 + h1], 
+                      outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x3 + 5, y3 + 20), "BANC.\nLAT.", fill=cor_borda, font=font)
+        
+    elif format_type == 'ilha':
+        # Ilha central com bancadas laterais
+        # Ilha no centro
+        ilha_w = int(width * 0.4)
+        ilha_h = int(height * 0.35)
+        ilha_x = base_x + (width - ilha_w) // 2
+        ilha_y = base_y + (height - ilha_h) // 2
+        scene.rect([ilha_x, ilha_y, ilha_x + ilha_w, ilha_y + ilha_h], 
+                      outline=cor_principal, fill=cor_secundaria, width=5)
+        scene.text((ilha_x + ilha_w//2 - 20, ilha_y + ilha_h//2), "ILHA", fill=cor_borda, font=font)
+        
+        # Bancada na parede
+        banc_w = int(width * 0.6)
+        banc_h = int(height * 0.15)
+        banc_x = base_x + (width - banc_w) // 2
+        banc_y = base_y + 30
+        scene.rect([banc_x, banc_y, banc_x + banc_w, banc_y + banc_h], 
+                      outline=cor_secundaria, fill=(200, 220, 210), width=3)
+        scene.text((banc_x + 10, banc_y + 5), "BANCADA PAREDE", fill=cor_borda, font=font)
+        
+    elif format_type == 'pensula':
+        # Península - bancada principal + extensão
+        # Bancada na parede
+        w1 = int(width * 0.7)
+        h1 = int(height * 0.2)
+        x1 = base_x + 40
+        y1 = base_y + 40
+        scene.rect([x1, y1, x1 + w1, y1 + h1], 
+                      outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x1 + 10, y1 + 10), "BANCADA PRINCIPAL", fill=cor_borda, font=font)
+        
+        # Península (perpendicular)
+        w2 = int(height * 0.25)
+        h2 = int(height * 0.45)
+        x2 = x1 + w1 - w2
+        y2 = y1 + h1
+        scene.rect([x2, y2, x2 + w2, y2 + h2], 
+                      outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((x2 + 10, y2 + 20), "PENÍNSULA", fill=cor_borda, font=font)
+        
+    else:
+        # Formato irregular - polígono assimétrico
+        points = [
+            (base_x + 100, base_y + 80),
+            (base_x + width - 150, base_y + 50),
+            (base_x + width - 100, base_y + height - 150),
+            (base_x + width - 250, base_y + height - 80),
+            (base_x + 80, base_y + height - 100)
+        ]
+        scene.polygon(points, outline=cor_principal, fill=cor_secundaria, width=4)
+        scene.text((base_x + width//2 - 50, base_y + height//2), 
+                 "FORMATO IRREGULAR", fill=cor_borda, font=font)
+
+def draw_improved_elements(scene, elements, base_x, base_y, width, height, cor, font):
+    """Desenha elementos de pedra melhorados"""
+    if not elements or elements[0] == 'nenhum':
+        return
+    
+    # Posiciona elementos de forma distribuída
+    element_positions = {
+        'bancada': (base_x + width * 0.3, base_y + height * 0.3),
+        'pia': (base_x + width * 0.5, base_y + height * 0.4),
+        'cooktop': (base_x + width * 0.6, base_y + height * 0.35),
+        'mesa': (base_x + width * 0.4, base_y + height * 0.6),
+        'soleira': (base_x + width * 0.7, base_y + height * 0.2)
+    }
+    
+    for element in elements[:4]:
+        if element in element_positions:
+            x, y = element_positions[element]
+            # Desenha ícone do elemento
+            scene.ellipse([x-25, y-25, x+25, y+25], outline=cor, width=3)
+            scene.text((x-20, y-5), element[:3].upper(), fill=cor, font=font)
+
+def draw_improved_cutouts(scene, cutouts, base_x, base_y, width, height, cor, font):
+    """Desenha recortes melhorados"""
+    if not cutouts or cutouts[0] == 'nenhum':
+        return
+    
+    # Posiciona recortes estrategicamente
+    cutout_positions = []
+    spacing_x = width // (len(cutouts) + 1)
+    
+    for i, cutout in enumerate(cutouts[:5]):
+        x = base_x + spacing_x * (i + 1)
+        y = base_y + height * 0.4
+        
+        # Desenha marca de recorte
+        size = 20
+        scene.ellipse([x-size, y-size, x+size, y+size], 
+                    outline=cor, fill=(255, 220, 220), width=3)
+        
+        # Label
+        label = cutout[:4].upper() if cutout != 'nenhum' else ''
+        scene.text((x-15, y-8), label, fill=cor, font=font)
+
+def draw_intelligent_layout(scene, ai_analysis, canvas_y, canvas_width, canvas_height, cor_principal, cor_borda, cor_texto, canvas_x, font):
+    """Desenha layout inteligente baseado na análise da IA"""
+    
+    # Offset base para desenho (margem da área de desenho)
+    x_base = canvas_x
+    y_base = canvas_y
+    
+    try:
+        stone_layout = ai_analysis.get('stone_layout', {})
+        positions = stone_layout.get('positions', [])
+        
+        # Desenha cada elemento de pedra nas posições especificadas pela IA
+        for pos in positions:
+            element = pos.get('element', '')
+            x_start = pos.get('x_start', 0)
+            x_end = pos.get('x_end', 100)
+            y_start = pos.get('y_start', 0)
+            y_end = pos.get('y_end', 100)
+            
+            # Converte porcentagem para coordenadas reais
+            x1 = x_base + int((x_start / 100) * canvas_width)
+            x2 = x_base + int((x_end / 100) * canvas_width)
+            y1 = y_base + int((y_start / 100) * canvas_height)
+            y2 = y_base + int((y_end / 100) * canvas_height)
+            
+            # Desenha retângulo do elemento com preenchimento
+            scene.rect([x1, y1, x2, y2], 
+                          outline=cor_principal, fill=(200, 220, 210), width=4)
+            
+            # Adiciona label do elemento
+            label_y = y1 - 20 if y1 > y_base + 30 else y1 + 5
+            scene.text((x1 + 10, label_y), element.upper(), fill=cor_principal, font=font)
+        
+        # Desenha recortes nas posições especificadas
+        cutouts = ai_analysis.get('cutouts_positions', [])
+        for cutout in cutouts:
+            cutout_type = cutout.get('type', '')
+            x = cutout.get('x', 50)
+            y = cutout.get('y', 50)
+            size = cutout.get('size', 'médio')
+            
+            # Converte para coordenadas
+            cx = x_base + int((x / 100) * canvas_width)
+            cy = y_base + int((y / 100) * canvas_height)
+            
+            # Tamanho do círculo baseado no tipo
+            radius = 15 if size == 'pequeno' else 25 if size == 'médio' else 35
+            
+            # Desenha círculo vermelho para recorte
+            scene.ellipse([cx - radius, cy - radius, cx + radius, cy + radius],
+                        outline=(200, 50, 50), fill=(255, 200, 200), width=3)
+            
+            # Label do recorte
+            scene.text((cx + radius + 5, cy - 10), cutout_type[:3].upper(), 
+                     fill=(200, 50, 50), font=font)
+        
+        # Adiciona notas da IA se houver
+        drawing_instructions = ai_analysis.get('drawing_instructions', [])
+        if drawing_instructions:
+            scene.layer('notas')
+            y_note = y_base + canvas_height + 10
+            note_text = " | ".join(drawing_instructions[:2])  # Primeiras 2 instruções
+            if len(note_text) > 100:
+                note_text = note_text[:97] + "..."
+            scene.text((x_base, y_note), f"ℹ️ {note_text}", fill=cor_principal, font=font)
+            
+    except Exception as e:
+        print(f"⚠️ Erro ao desenhar layout inteligente: {e}")
+        # Se falhar, não desenha nada (grid já foi desenhado)
+
+
+def build_pdf(drawing, session_id, scene=None):
+    """
+    Gera o PDF do desenho conceitual; retorna os bytes do PDF.
+    Com `scene`, a área de desenho é embutida como vetores (sem imagem).
+    """
+    # reportlab só é carregado quando o primeiro PDF é gerado
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen import canvas
+    
+    # Cria PDF em memória
+    pdf_buffer = io.BytesIO()
+    c = canvas.Canvas(pdf_buffer, pagesize=A4)
+    width, height = A4
+    
+    # Cabeçalho
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(2*cm, height - 2*cm, "MARMOVIEW")
+    
+    c.setFont("Helvetica", 10)
+    c.drawString(2*cm, height - 2.5*cm, f"Projeto: #{session_id[:8]}")
+    c.drawString(2*cm, height - 3*cm, f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
+    
+    # Linha divisória
+    c.line(2*cm, height - 3.5*cm, width - 2*cm, height - 3.5*cm)
+    
+    # Título do desenho
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(2*cm, height - 4.5*cm, drawing['title'])
+    
+    # Informações do ambiente
+    y = height - 5.5*cm
+    c.setFont("Helvetica", 10)
+    c.drawString(2*cm, y, f"Ambiente: {drawing['environment']}")
+    
+    y -= 0.6*cm
+    c.drawString(2*cm, y, f"Formato: {drawing['format']}")
+    
+    y -= 0.6*cm
+    c.drawString(2*cm, y, f"Elementos: {', '.join(drawing['elements'])}")
+    
+    y -= 0.6*cm
+    if drawing['cutouts']:
+        c.drawString(2*cm, y, f"Recortes: {', '.join(drawing['cutouts'])}")
+        y -= 0.6*cm
+    
+    # Área de desenho
+    y -= 1*cm
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(2*cm, y, "Desenho Conceitual:")
+    
+    y -= 1*cm
+    # Moldura da área de desenho
+    c.rect(2*cm, y - 10*cm, width - 4*cm, 10*cm)
+    
+    if scene:
+        # Cena vetorial: só a área quadriculada, ajustada à moldura
+        draw_scene_pdf(c, scene, 2.2*cm, y - 9.8*cm, width - 4.4*cm, 9.6*cm,
+                       region='desenho', layers={'desenho'})
+    else:
+        # Sem cena (desenhos antigos): descrição das formas
+        c.setFont("Helvetica", 9)
+        shapes_text = " | ".join([s['description'] for s in drawing['shapes']])
+        c.drawString(2.5*cm, y - 5*cm, shapes_text)
+    
+    # Características descritas
+    y = y - 11*cm
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(2*cm, y, "Características Observadas:")
+    
+    y -= 0.6*cm
+    c.setFont("Helvetica", 9)
+    # Quebra texto em linhas
+    char_text = drawing['characteristics'][:200]  # Limita caracteres
+    c.drawString(2.5*cm, y, char_text)
+    
+    # Avisos legais
+    y -= 2*cm
+    c.setFont("Helvetica-Bold", 11)
+    c.setFillColorRGB(0.7, 0, 0)
+    c.drawString(2*cm, y, "AVISOS IMPORTANTES:")
+    
+    y -= 0.7*cm
+    c.setFont("Helvetica", 9)
+    c.setFillColorRGB(0, 0, 0)
+    for note in drawing['notes']:
+        c.drawString(2.5*cm, y, f"• {note}")
+        y -= 0.5*cm
+    
+    # Rodapé
+    c.setFont("Helvetica", 8)
+    c.drawString(2*cm, 2*cm, "MarmoView v1.0.0 - Sistema IA para Marmoraria")
+    c.drawString(2*cm, 1.5*cm, '"Quem mede, manda." - Desenho requer validacao em campo.')
+    
+    c.save()
+    
+    return pdf_buffer.getvalue()
@@ -0,0 +1,311 @@
+"""
+MarmoView - Grafo de cena vetorial dos desenhos conceituais
+O layout do desenho é calculado uma única vez como uma lista de formas
+(retângulos, elipses, polígonos, linhas e textos) num espaço de coordenadas
+abstrato (1200x800 unidades). A mesma cena é então:
+
+- serializada em SVG (poucos KB, escala sem perda)
+- rasterizada em PNG com PIL, só quando alguém precisa dos pixels
+- desenhada como caminhos vetoriais no PDF (reportlab)
+
+A cena é um dict JSON puro, então pode ir para o blob store e para os
+processos do pool de renderização sem conversão.
+"""
+
+import hashlib
+import io
+import json
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw, ImageFont
+
+# Tamanho (em unidades da cena) de cada estilo de fonte
+FONT_SIZES = {
+    'titulo': 24,
+    'subtitulo': 16,
+    'texto': 12,
+    'nota': 10,
+}
+
+SVG_FONT_FAMILY = 'Arial, Helvetica, sans-serif'
+PDF_FONT = 'Helvetica'
+
+
+def hex_color(color):
+    """(r, g, b) -> '#rrggbb' (None e strings passam direto)"""
+    if color is None or isinstance(color, str):
+        return color
+    return '#{:02x}{:02x}{:02x}'.format(*color)
+
+
+class Scene:
+    """
+    Construtor da cena. Cada método acrescenta um nó marcado com a camada
+    atual (ver `layer`); `regions` guarda retângulos nomeados (x, y, w, h) usados
+    para recortar partes da cena, como a área de desenho embutida no PDF.
+    """
+
+    def __init__(self, width=1200, height=800, background=(255, 255, 255)):
+        self.width = width
+        self.height = height
+        self.background = hex_color(background)
+        self.nodes = []
+        self.regions = {}
+        self._layer = 'base'
+
+    def layer(self, name):
+        """Os próximos nós pertencem à camada `name`"""
+        self._layer = name
+        return self
+
+    def _add(self, kind, **fields):
+        node = {'type': kind, 'layer': self._layer}
+        node.update(fields)
+        self.nodes.append(node)
+        return node
+
+    def rect(self, box, fill=None, outline=None, width=1):
+        return self._add('rect', box=list(box), fill=hex_color(fill),
+                         outline=hex_color(outline), width=width)
+
+    def ellipse(self, box, fill=None, outline=None, width=1):
+        return self._add('ellipse', box=list(box), fill=hex_color(fill),
+                         outline=hex_color(outline), width=width)
+
+    def polygon(self, points, fill=None, outline=None, width=1):
+        return self._add('polygon', points=[list(p) for p in points], fill=hex_color(fill),
+                         outline=hex_color(outline), width=width)
+
+    def line(self, points, fill, width=1):
+        """Segmento(s): [(x0, y0), (x1, y1), ...] ou [x0, y0, x1, y1]"""
+        if points and not isinstance(points[0], (list, tuple)):
+            points = list(zip(points[0::2], points[1::2]))
+        return self._add('line', points=[list(p) for p in points], fill=hex_color(fill),
+                         width=width)
+
+    def text(self, xy, text, fill, font='texto'):
+        """Texto com o canto superior esquerdo em `xy` (aceita '\\n')"""
+        return self._add('text', xy=list(xy), text=text, fill=hex_color(fill), font=font)
+
+    def to_dict(self):
+        return {
+            'width': self.width,
+            'height': self.height,
+            'background': self.background,
+            'regions': self.regions,
+            'nodes': self.nodes,
+        }
+
+
+def scene_json(scene):
+    """Cena serializada (JSON compacto em bytes), para o blob store"""
+    return json.dumps(scene, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def layer_digests(scene):
+    """SHA-1 do conteúdo de cada camada da cena"""
+    groups = {}
+    for node in scene['nodes']:
+        groups.setdefault(node['layer'], []).append(node)
+    return {layer: hashlib.sha1(json.dumps(nodes, sort_keys=True).encode('utf-8')).hexdigest()
+            for layer, nodes in groups.items()}
+
+
+def changed_layers(old, new):
+    """Camadas que diferem entre duas cenas (todas, se não houver cena anterior)"""
+    after = layer_digests(new)
+    if old is None:
+        return sorted(after)
+    before = layer_digests(old)
+    return sorted(layer for layer in set(before) | set(after)
+                  if before.get(layer) != after.get(layer))
+
+
+def _visible(scene, layers):
+    for node in scene['nodes']:
+        if layers is None or node['layer'] in layers:
+            yield node
+
+
+# --- PNG (PIL) ---
+
+@lru_cache(maxsize=None)
+def _pil_font(style):
+    try:
+        return ImageFont.truetype("arial.ttf", FONT_SIZES[style])
+    except Exception:
+        return ImageFont.load_default()
+
+
+def preload_fonts():
+    """Carrega as fontes de todos os estilos (aquecimento do processo)"""
+    for style in FONT_SIZES:
+        _pil_font(style)
+
+
+def rasterize(scene, layers=None):
+    """Rasteriza a cena numa imagem PIL RGB (1 unidade = 1 pixel)"""
+    img = Image.new('RGB', (scene['width'], scene['height']), color=scene['background'])
+    draw = ImageDraw.Draw(img)
+
+    for node in _visible(scene, layers):
+        kind = node['type']
+        if kind == 'rect':
+            draw.rectangle(node['box'], fill=node['fill'], outline=node['outline'], width=node['width'])
+        elif kind == 'ellipse':
+            draw.ellipse(node['box'], fill=node['fill'], outline=node['outline'], width=node['width'])
+        elif kind == 'polygon':
+            draw.polygon([tuple(p) for p in node['points']], fill=node['fill'],
+                         outline=node['outline'], width=node['width'])
+        elif kind == 'line':
+            draw.line([tuple(p) for p in node['points']], fill=node['fill'], width=node['width'])
+        elif kind == 'text':
+            draw.text(tuple(node['xy']), node['text'], fill=node['fill'], font=_pil_font(node['font']))
+    return img
+
+
+def encode_png(img):
+    """Codifica a imagem PIL em PNG; retorna bytes"""
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def render_png(scene, layers=None):
+    """Rasteriza a cena em PNG; retorna bytes"""
+    return encode_png(rasterize(scene, layers))
+
+
+# --- SVG ---
+
+def _svg_paint(node):
+    fill = node.get('fill') or 'none'
+    attrs = f'fill="{fill}"'
+    if node.get('outline'):
+        attrs += f' stroke="{node["outline"]}" stroke-width="{node["width"]}"'
+    return attrs
+
+
+def _num(value):
+    return f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def render_svg(scene, layers=None):
+    """Serializa a cena em SVG; retorna bytes UTF-8"""
+    w, h = scene['width'], scene['height']
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{w}" height="{h}" viewBox="0 0 {w} {h}">',
+        f'<rect width="{w}" height="{h}" fill="{scene["background"]}"/>',
+    ]
+    for node in _visible(scene, layers):
+        kind = node['type']
+        if kind == 'rect':
+            x0, y0, x1, y1 = node['box']
+            parts.append(f'<rect x="{_num(x0)}" y="{_num(y0)}" width="{_num(x1 - x0)}" '
+                         f'height="{_num(y1 - y0)}" {_svg_paint(node)}/>')
+        elif kind == 'ellipse':
+            x0, y0, x1, y1 = node['box']
+            parts.append(f'<ellipse cx="{_num((x0 + x1) / 2)}" cy="{_num((y0 + y1) / 2)}" '
+                         f'rx="{_num((x1 - x0) / 2)}" ry="{_num((y1 - y0) / 2)}" {_svg_paint(node)}/>')
+        elif kind in ('polygon', 'line'):
+            points = ' '.join(f"{_num(x)},{_num(y)}" for x, y in node['points'])
+            if kind == 'polygon':
+                parts.append(f'<polygon points="{points}" {_svg_paint(node)}/>')
+            else:
+                parts.append(f'<polyline points="{points}" fill="none" stroke="{node["fill"]}" '
+                             f'stroke-width="{node["width"]}"/>')
+        elif kind == 'text':
+            x, y = node['xy']
+            size = FONT_SIZES[node['font']]
+            lines = node['text'].split('\n')
+            spans = ''.join(
+                f'<tspan x="{_num(x)}" dy="{0 if i == 0 else round(size * 1.2, 1)}">{escape(line)}</tspan>'
+                for i, line in enumerate(lines))
+            parts.append(f'<text x="{_num(x)}" y="{_num(y)}" font-family="{SVG_FONT_FAMILY}" '
+                         f'font-size="{size}" fill="{node["fill"]}" '
+                         f'dominant-baseline="hanging">{spans}</text>')
+    parts.append('</svg>')
+    return '\n'.join(parts).encode('utf-8')
+
+
+# --- PDF (reportlab) ---
+
+def _pdf_text(text):
+    """Helvetica só cobre Latin-1: símbolos (✓, ⚠, ℹ️) são descartados"""
+    return text.encode('latin-1', 'ignore').decode('latin-1').strip()
+
+
+def draw_scene_pdf(c, scene, x, y, width, height, region=None, layers=None):
+    """
+    Desenha a cena (ou só `region`) como vetores no canvas reportlab `c`,
+    ajustada ao retângulo (x, y, width, height) em pontos, com origem no canto
+    inferior esquerdo, mantendo a proporção e centralizada.
+    """
+    from reportlab.lib.colors import HexColor
+
+    rx, ry, rw, rh = scene['regions'][region] if region else (0, 0, scene['width'], scene['height'])
+    scale = min(width / rw, height / rh)
+    offset_x = x + (width - rw * scale) / 2
+    offset_y = y + (height - rh * scale) / 2
+
+    c.saveState()
+    # Coordenadas da cena: origem no topo, y para baixo
+    c.translate(offset_x, offset_y + rh * scale)
+    c.scale(scale, -scale)
+    c.translate(-rx, -ry)
+    clip = c.beginPath()
+    clip.rect(rx, ry, rw, rh)
+    c.clipPath(clip, stroke=0, fill=0)
+
+    for node in _visible(scene, layers):
+        kind = node['type']
+        if kind == 'text':
+            text = _pdf_text(node['text'])
+            if not text:
+                continue
+            size = FONT_SIZES[node['font']]
+            c.setFillColor(HexColor(node['fill']))
+            c.setFont(PDF_FONT, size)
+            tx, ty = node['xy']
+            for i, line in enumerate(text.split('\n')):
+                c.saveState()
+                c.translate(tx, ty + size * (0.8 + 1.2 * i))
+                c.scale(1, -1)
+                c.drawString(0, 0, line)
+                c.restoreState()
+            continue
+
+        if kind == 'line':
+            c.setStrokeColor(HexColor(node['fill']))
+            c.setLineWidth(node['width'])
+            path = c.beginPath()
+            (x0, y0), *rest = node['points']
+            path.moveTo(x0, y0)
+            for px, py in rest:
+                path.lineTo(px, py)
+            c.drawPath(path, stroke=1, fill=0)
+            continue
+
+        fill, outline = node['fill'], node['outline']
+        if fill:
+            c.setFillColor(HexColor(fill))
+        if outline:
+            c.setStrokeColor(HexColor(outline))
+            c.setLineWidth(node['width'])
+        stroke, filled = int(bool(outline)), int(bool(fill))
+        if kind == 'rect':
+            x0, y0, x1, y1 = node['box']
+            c.rect(x0, y0, x1 - x0, y1 - y0, stroke=stroke, fill=filled)
+        elif kind == 'ellipse':
+            c.ellipse(*node['box'], stroke=stroke, fill=filled)
+        elif kind == 'polygon':
+            path = c.beginPath()
+            (x0, y0), *rest = node['points']
+            path.moveTo(x0, y0)
+            for px, py in rest:
+                path.lineTo(px, py)
+            path.close()
+            c.drawPath(path, stroke=stroke, fill=filled)
+
+    c.restoreState()
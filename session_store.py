@@ -0,0 +1,781 @@
+"""
+MarmoView - Armazenamento de sessões
+Interface única para os metadados das sessões, com três backends:
+
+- MemorySessionStore: dict no próprio processo (padrão, um único worker)
+- SQLiteSessionStore: arquivo SQLite em modo WAL, compartilhado pelos workers
+  do mesmo nó
+- RedisSessionStore: qualquer servidor que fale o protocolo Redis (RESP),
+  compartilhado entre nós
+
+As sessões guardam apenas metadados serializáveis em JSON (formulário, status,
+digests). Imagens, PNGs e PDFs ficam fora de banda no blob store, então cada
+acesso serializa poucos KB em vez de megabytes.
+
+Uso: `get` devolve um dict; depois de alterá-lo, chame `save` (ou use
+`update` para gravar só alguns campos). No backend em memória esse dict é o
+próprio registro, alterado por outras threads; leituras que só percorrem a
+sessão (serialização, projeções) usam `snapshot`, uma cópia rasa estável.
+
+Cada backend mantém também um índice das sessões por status, envType e
+criação, atualizado em `save`/`update`/`delete` (ou seja, em toda transição
+de status). `list_sessions` pagina esse índice por cursor, do mais recente
+para o mais antigo, em O(tamanho da página) sem ler os registros completos.
+
+Além das sessões, cada backend guarda chaves auxiliares com validade
+(`claim_key`, `get_key`, `set_key`, `delete_key`), usadas pelas chaves de
+idempotência: `claim_key` grava só se a chave não existir, de forma atômica
+entre threads e processos que compartilham o backend.
+"""
+
+import base64
+import heapq
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from bisect import bisect_left, insort
+from urllib.parse import urlparse
+
+
+def index_entry(session_id, data):
+    """Entrada do índice de sessões: o que a listagem mostra sem ler o registro"""
+    return {
+        'id': session_id,
+        'status': data.get('status'),
+        'env_type': (data.get('form') or {}).get('envType') or None,
+        'created_at': data.get('created_at') or 0,
+        'last_access': data.get('last_access'),
+    }
+
+def encode_cursor(created_at, session_id):
+    """Cursor opaco da listagem: posição (criação, id) do último item da página"""
+    return base64.urlsafe_b64encode(f"{created_at!r}|{session_id}".encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(criação, id) do cursor; ValueError se inválido"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, session_id = raw.split('|', 1)
+        return float(created_at), session_id
+    except Exception:
+        raise ValueError(f"Cursor inválido: {cursor}")
+
+
+class MemorySessionStore:
+    """Sessões em dict na memória do processo"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._keys = {}  # chave -> (valor, expira_em)
+        self._key_expiry = []  # heap de (expira_em, chave), para varrer só as vencidas
+        self._lock = threading.Lock()
+        # Índice: (status, envType), com None = qualquer -> lista ordenada de (criação, id)
+        self._index = {}
+        self._entries = {}
+
+    def get(self, session_id):
+        return self._sessions.get(session_id)
+
+    def snapshot(self, session_id):
+        """Cópia rasa da sessão, para percorrê-la sem colidir com quem a altera"""
+        with self._lock:
+            data = self._sessions.get(session_id)
+            return dict(data) if data is not None else None
+
+    def save(self, session_id, data):
+        self._sessions[session_id] = data
+        self._reindex(session_id, data)
+
+    def update(self, session_id, fields):
+        with self._lock:
+            data = self._sessions.get(session_id)
+            if data is None:
+                return None
+            data.update(fields)
+        self._reindex(session_id, data)
+        return data
+
+    def delete(self, session_id):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._unindex(entry)
+        return self._sessions.pop(session_id, None)
+
+    @staticmethod
+    def _index_keys(entry):
+        status, env_type = entry['status'], entry['env_type']
+        return {(None, None), (status, None), (None, env_type), (status, env_type)}
+
+    def _reindex(self, session_id, data):
+        entry = index_entry(session_id, data)
+        with self._lock:
+            old = self._entries.get(session_id)
+            self._entries[session_id] = entry
+            if old is not None:
+                if (old['status'], old['env_type'], old['created_at']) == \
+                        (entry['status'], entry['env_type'], entry['created_at']):
+                    return
+                self._unindex(old)
+            for key in self._index_keys(entry):
+                insort(self._index.setdefault(key, []), (entry['created_at'], session_id))
+
+    def _unindex(self, entry):
+        item = (entry['created_at'], entry['id'])
+        for key in self._index_keys(entry):
+            items = self._index.get(key, [])
+            i = bisect_left(items, item)
+            if i < len(items) and items[i] == item:
+                del items[i]
+            if not items:
+                self._index.pop(key, None)
+
+    def list_sessions(self, status=None, env_type=None, since=None, until=None,
+                      cursor=None, limit=50):
+        """
+        Página de entradas do índice, mais recentes primeiro, criadas em
+        [since, until); retorna (entradas, próximo cursor ou None)
+        """
+        with self._lock:
+            items = self._index.get((status, env_type), [])
+            lo = bisect_left(items, (since, '')) if since is not None else 0
+            hi = len(items)
+            if until is not None:
+                hi = bisect_left(items, (until, ''))
+            if cursor:
+                hi = min(hi, bisect_left(items, decode_cursor(cursor)))
+            page = items[max(lo, hi - limit):hi][::-1]
+            entries = [dict(self._entries[session_id]) for _created, session_id in page]
+        more = hi - limit > lo
+        return entries, encode_cursor(*page[-1]) if page and more else None
+
+    def status_counts(self):
+        """Sessões por status"""
+        with self._lock:
+            return {status: len(items) for (status, env_type), items in self._index.items()
+                    if status is not None and env_type is None}
+
+    def ids(self):
+        return list(self._sessions)
+
+    def expired(self, before):
+        """IDs das sessões sem acesso desde `before` (timestamp)"""
+        return [sid for sid, data in list(self._sessions.items())
+                if data.get('last_access', 0) < before]
+
+    def claim_key(self, key, value, ttl):
+        """Grava `value` se a chave não existir; retorna o valor em vigor"""
+        now = time.time()
+        with self._lock:
+            self._expire_keys(now)
+            current = self._keys.get(key)
+            if current is not None and current[1] > now:
+                return current[0]
+            self._store_key(key, value, now + ttl)
+            return value
+
+    def _store_key(self, key, value, expires_at):
+        self._keys[key] = (value, expires_at)
+        heapq.heappush(self._key_expiry, (expires_at, key))
+
+    def _expire_keys(self, now):
+        """Remove as chaves vencidas (chamar com o lock); custo proporcional às removidas"""
+        while self._key_expiry and self._key_expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._key_expiry)
+            current = self._keys.get(key)
+            # Entrada antiga de uma chave regravada depois: a chave continua
+            if current is not None and current[1] == expires_at:
+                del self._keys[key]
+
+    def get_key(self, key):
+        current = self._keys.get(key)
+        if current is None or current[1] <= time.time():
+            return None
+        return current[0]
+
+    def set_key(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self._expire_keys(now)
+            self._store_key(key, value, now + ttl)
+
+    def delete_key(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """
+    Sessões num arquivo SQLite (WAL) compartilhado por vários processos.
+    Cada thread usa sua própria conexão; leituras não bloqueiam escritas.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'marmoview-sessions.db')
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                status TEXT,
+                created_at REAL,
+                last_access REAL,
+                env_type TEXT,
+                data TEXT NOT NULL
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        if 'env_type' not in columns:
+            # Banco de uma versão anterior: coluna nova preenchida a partir do JSON
+            conn.execute("ALTER TABLE sessions ADD COLUMN env_type TEXT")
+            conn.execute("UPDATE sessions SET env_type = json_extract(data, '$.form.envType')")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_access ON sessions(last_access)")
+        # Índices da listagem: cada combinação de filtros ordena por (created_at, id)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions(created_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_status ON sessions(status, created_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_env ON sessions(env_type, created_at, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_status_env "
+                     "ON sessions(status, env_type, created_at, id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS keys (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def snapshot(self, session_id):
+        # `get` já devolve uma cópia desserializada
+        return self.get(session_id)
+
+    def save(self, session_id, data):
+        entry = index_entry(session_id, data)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (id, status, created_at, last_access, env_type, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (session_id, entry['status'], entry['created_at'], entry['last_access'],
+             entry['env_type'], json.dumps(data, separators=(',', ':'))))
+
+    def update(self, session_id, fields):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            data = self.get(session_id)
+            if data is not None:
+                data.update(fields)
+                self.save(session_id, data)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return data
+
+    def delete(self, session_id):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            data = self.get(session_id)
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return data
+
+    def ids(self):
+        return [row[0] for row in self._conn().execute("SELECT id FROM sessions")]
+
+    def expired(self, before):
+        return [row[0] for row in self._conn().execute(
+            "SELECT id FROM sessions WHERE last_access < ?", (before,))]
+
+    def list_sessions(self, status=None, env_type=None, since=None, until=None,
+                      cursor=None, limit=50):
+        where, params = [], []
+        for column, value in (('status', status), ('env_type', env_type)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("created_at < ?")
+            params.append(until)
+        if cursor:
+            where.append("(created_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        rows = self._conn().execute(
+            "SELECT id, status, env_type, created_at, last_access FROM sessions "
+            f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+            "ORDER BY created_at DESC, id DESC LIMIT ?", (*params, limit + 1)).fetchall()
+        entries = [{'id': row[0], 'status': row[1], 'env_type': row[2],
+                    'created_at': row[3], 'last_access': row[4]} for row in rows[:limit]]
+        more = len(rows) > limit
+        return entries, encode_cursor(entries[-1]['created_at'], entries[-1]['id']) if more else None
+
+    def status_counts(self):
+        return dict(self._conn().execute(
+            "SELECT status, COUNT(*) FROM sessions GROUP BY status").fetchall())
+
+    def claim_key(self, key, value, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM keys WHERE expires_at <= ?", (now,))
+            row = conn.execute("SELECT value FROM keys WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO keys (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, json.dumps(value), now + ttl))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return json.loads(row[0]) if row else value
+
+    def get_key(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM keys WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_key(self, key, value, ttl):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO keys (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl))
+
+    def delete_key(self, key):
+        self._conn().execute("DELETE FROM keys WHERE key = ?", (key,))
+
+    def __contains__(self, session_id):
+        return self._conn().execute(
+            "SELECT 1 FROM sessions WHERE id = ?", (session_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class RespError(RuntimeError):
+    """Erro devolvido pelo servidor Redis (resposta '-ERR ...')"""
+
+
+class RespClient:
+    """
+    Cliente mínimo do protocolo Redis (RESP2), usado quando o pacote `redis`
+    não está instalado. Implementa só os comandos que o RedisSessionStore usa.
+    """
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self._addr = (parsed.hostname or 'localhost', parsed.port or 6379)
+        self._password = parsed.password
+        self._db = int((parsed.path or '/0').lstrip('/') or 0)
+        self._local = threading.local()
+
+    def _sock(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection(self._addr, timeout=10)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self._password:
+                self.execute_command('AUTH', self._password)
+            if self._db:
+                self.execute_command('SELECT', self._db)
+        return conn
+
+    @staticmethod
+    def _encode(args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            value = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+            parts.append(f"${len(value)}\r\n".encode() + value + b"\r\n")
+        return b''.join(parts)
+
+    def _roundtrip(self, commands):
+        """Envia os comandos num único write e lê uma resposta por comando"""
+        sock, reader = self._sock()
+        try:
+            sock.sendall(b''.join(self._encode(args) for args in commands))
+            return [self._read(reader) for _ in commands]
+        except (OSError, ValueError):
+            self._local.conn = None
+            raise
+
+    def execute_command(self, *args):
+        reply = self._roundtrip([args])[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    def pipeline(self, transaction=True):
+        return RespPipeline(self, transaction)
+
+    def _read(self, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Conexão Redis fechada")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            # Devolvido, não levantado: as respostas seguintes continuam no socket
+            return RespError(payload.decode('utf-8', 'replace'))
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            size = int(payload)
+            if size < 0:
+                return None
+            value = reader.read(size + 2)
+            return value[:-2]
+        if kind == b'*':
+            count = int(payload)
+            if count < 0:
+                return None
+            return [self._read(reader) for _ in range(count)]
+        raise ValueError(f"Resposta RESP inválida: {line!r}")
+
+    # Subconjunto da API do redis-py
+    def get(self, key):
+        return self.execute_command('GET', key)
+
+    def set(self, key, value, ex=None, nx=False):
+        args = ['SET', key, value]
+        if ex:
+            args += ['EX', ex]
+        if nx:
+            args.append('NX')
+        return self.execute_command(*args)
+
+    def delete(self, *keys):
+        return self.execute_command('DEL', *keys)
+
+    def exists(self, key):
+        return self.execute_command('EXISTS', key)
+
+    def sadd(self, key, *members):
+        return self.execute_command('SADD', key, *members)
+
+    def srem(self, key, *members):
+        return self.execute_command('SREM', key, *members)
+
+    def smembers(self, key):
+        return set(self.execute_command('SMEMBERS', key) or [])
+
+    def scard(self, key):
+        return self.execute_command('SCARD', key)
+
+    def hget(self, name, key):
+        return self.execute_command('HGET', name, key)
+
+    def hset(self, name, key, value):
+        return self.execute_command('HSET', name, key, value)
+
+    def hdel(self, name, *keys):
+        return self.execute_command('HDEL', name, *keys)
+
+    def hmget(self, name, keys):
+        return self.execute_command('HMGET', name, *keys)
+
+    def zadd(self, name, mapping):
+        args = []
+        for member, score in mapping.items():
+            args += [repr(float(score)), member]
+        return self.execute_command('ZADD', name, *args)
+
+    def zrem(self, name, *members):
+        return self.execute_command('ZREM', name, *members)
+
+    def zcard(self, name):
+        return self.execute_command('ZCARD', name)
+
+    def zrangebyscore(self, name, min, max):
+        return self.execute_command('ZRANGEBYSCORE', name, min, max) or []
+
+    def zrevrangebyscore(self, name, max, min, start=None, num=None, withscores=False):
+        args = ['ZREVRANGEBYSCORE', name, max, min]
+        if withscores:
+            args.append('WITHSCORES')
+        if start is not None and num is not None:
+            args += ['LIMIT', start, num]
+        reply = self.execute_command(*args) or []
+        if withscores:
+            return [(reply[i], float(reply[i + 1])) for i in range(0, len(reply), 2)]
+        return reply
+
+
+class RespPipeline(RespClient):
+    """
+    Pipeline do RespClient: os comandos são enfileirados e `execute` envia
+    todos num único round trip (entre MULTI/EXEC com transaction=True),
+    devolvendo a lista de respostas como o redis-py. Só os comandos cuja
+    resposta é usada crua (escritas: set, sadd, zadd, hset, zrem...).
+    """
+
+    def __init__(self, client, transaction=True):
+        self._client = client
+        self._transaction = transaction
+        self._commands = []
+
+    def execute_command(self, *args):
+        self._commands.append(args)
+        return self
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        if not commands:
+            return []
+        if not self._transaction:
+            replies = self._client._roundtrip(commands)
+        else:
+            replies = self._client._roundtrip([('MULTI',), *commands, ('EXEC',)])
+            # Erros ao enfileirar aparecem no lugar do QUEUED; o EXEC vem abortado
+            errors = [r for r in replies[:-1] if isinstance(r, RespError)]
+            if errors:
+                raise errors[0]
+            replies = replies[-1]
+            if isinstance(replies, RespError):
+                raise replies
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+
+class _Unbatched:
+    """Clientes sem `pipeline`: executa cada comando na hora (mesma interface)"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def execute(self):
+        return []
+
+
+class RedisSessionStore:
+    """
+    Sessões num servidor Redis (ou compatível), uma chave JSON por sessão com
+    TTL igual ao tempo de expiração das sessões. Aceita um cliente com a API do
+    redis-py (redis.Redis, fakeredis.FakeRedis) ou cria um a partir da URL.
+    """
+
+    def __init__(self, url=None, client=None, prefix='marmoview', ttl=0):
+        if client is None:
+            url = url or 'redis://localhost:6379/0'
+            # redis-py só é importado aqui: quem usa memory/sqlite não paga o import
+            try:
+                import redis
+            except ImportError:
+                client = RespClient(url)
+            else:
+                client = redis.Redis.from_url(url)
+        self._client = client
+        self._prefix = prefix
+        self._index = f"{prefix}:sessions"
+        # Listagem: um sorted set (score = criação) por combinação de filtros e
+        # um hash com a entrada de cada sessão
+        self._entries = f"{prefix}:session-entries"
+        self._statuses = f"{prefix}:session-statuses"
+        # Expiração: sorted set com score = último acesso
+        self._access = f"{prefix}:session-access"
+        self._access_backfilled = False
+        self._ttl = ttl
+
+    def _key(self, session_id):
+        return f"{self._prefix}:session:{session_id}"
+
+    def _index_keys(self, status, env_type):
+        return {f"{self._prefix}:by:{s or '*'}:{e or '*'}"
+                for s in (None, status) for e in (None, env_type)}
+
+    def get(self, session_id):
+        raw = self._client.get(self._key(session_id))
+        return json.loads(raw) if raw else None
+
+    def snapshot(self, session_id):
+        # `get` já devolve uma cópia desserializada
+        return self.get(session_id)
+
+    def _pipeline(self):
+        """Comandos de uma escrita num só round trip (MULTI/EXEC quando disponível)"""
+        pipeline = getattr(self._client, 'pipeline', None)
+        return pipeline(transaction=True) if pipeline else _Unbatched(self._client)
+
+    def save(self, session_id, data):
+        entry = index_entry(session_id, data)
+        raw = self._client.hget(self._entries, session_id)
+        pipe = self._pipeline()
+        pipe.set(self._key(session_id), json.dumps(data, separators=(',', ':')),
+                 ex=self._ttl or None)
+        pipe.sadd(self._index, session_id)
+        pipe.zadd(self._access, {session_id: data.get('last_access') or 0})
+        self._reindex(pipe, session_id, entry, json.loads(raw) if raw else None)
+        pipe.execute()
+
+    def _reindex(self, pipe, session_id, entry, old):
+        pipe.hset(self._entries, session_id, json.dumps(entry))
+        if old is not None:
+            if (old['status'], old['env_type'], old['created_at']) == \
+                    (entry['status'], entry['env_type'], entry['created_at']):
+                return
+            for key in self._index_keys(old['status'], old['env_type']):
+                pipe.zrem(key, session_id)
+        for key in self._index_keys(entry['status'], entry['env_type']):
+            pipe.zadd(key, {session_id: entry['created_at']})
+        if entry['status']:
+            pipe.sadd(self._statuses, entry['status'])
+
+    def update(self, session_id, fields):
+        data = self.get(session_id)
+        if data is None:
+            return None
+        data.update(fields)
+        self.save(session_id, data)
+        return data
+
+    def delete(self, session_id):
+        data = self.get(session_id)
+        raw = self._client.hget(self._entries, session_id)
+        pipe = self._pipeline()
+        pipe.delete(self._key(session_id))
+        pipe.srem(self._index, session_id)
+        pipe.zrem(self._access, session_id)
+        if raw:
+            old = json.loads(raw)
+            for key in self._index_keys(old['status'], old['env_type']):
+                pipe.zrem(key, session_id)
+            pipe.hdel(self._entries, session_id)
+        pipe.execute()
+        return data
+
+    def ids(self):
+        return [m.decode() if isinstance(m, bytes) else m
+                for m in self._client.smembers(self._index)]
+
+    def expired(self, before):
+        # O Redis expira as chaves sozinho (TTL); o sorted set de último acesso
+        # aponta também os IDs que ficaram órfãos no índice (score antigo)
+        self._backfill_access()
+        return [m.decode() if isinstance(m, bytes) else m
+                for m in self._client.zrangebyscore(self._access, '-inf', f"({float(before)!r}")]
+
+    def _backfill_access(self):
+        """Sessões gravadas antes do sorted set de acesso entram nele (uma vez por processo)"""
+        if self._access_backfilled:
+            return
+        self._access_backfilled = True
+        if self._client.zcard(self._access) >= len(self):
+            return
+        known = {m.decode() if isinstance(m, bytes) else m
+                 for m in self._client.zrangebyscore(self._access, '-inf', '+inf')}
+        missing = [session_id for session_id in self.ids() if session_id not in known]
+        raw = self._client.hmget(self._entries, missing) if missing else []
+        for session_id, entry in zip(missing, raw):
+            last_access = (json.loads(entry) if entry else {}).get('last_access') or 0
+            self._client.zadd(self._access, {session_id: last_access})
+
+    def list_sessions(self, status=None, env_type=None, since=None, until=None,
+                      cursor=None, limit=50):
+        key = f"{self._prefix}:by:{status or '*'}:{env_type or '*'}"
+        low = repr(float(since)) if since is not None else '-inf'
+        if cursor:
+            created_at, after_id = decode_cursor(cursor)
+            high = repr(created_at)
+        else:
+            created_at = after_id = None
+            high = f"({float(until)!r}" if until is not None else '+inf'
+
+        # Empates de criação com o cursor vêm primeiro (ordem reversa do id) e são pulados
+        members, offset = [], 0
+        while len(members) <= limit:
+            batch = self._client.zrevrangebyscore(key, high, low, start=offset,
+                                                  num=limit + 1, withscores=True)
+            for member, score in batch:
+                member = member.decode() if isinstance(member, bytes) else member
+                if score == created_at and member >= after_id:
+                    continue
+                members.append(member)
+            offset += len(batch)
+            if len(batch) < limit + 1:
+                break
+
+        page = members[:limit]
+        raw = self._client.hmget(self._entries, page) if page else []
+        entries = [json.loads(r) for r in raw if r]
+        more = len(members) > limit and entries
+        return entries, encode_cursor(entries[-1]['created_at'], entries[-1]['id']) if more else None
+
+    def status_counts(self):
+        counts = {}
+        for status in self._client.smembers(self._statuses):
+            status = status.decode() if isinstance(status, bytes) else status
+            count = self._client.zcard(f"{self._prefix}:by:{status}:*")
+            if count:
+                counts[status] = count
+        return counts
+
+    def claim_key(self, key, value, ttl):
+        name = f"{self._prefix}:key:{key}"
+        if self._client.set(name, json.dumps(value), ex=int(ttl), nx=True):
+            return value
+        current = self._client.get(name)
+        # Expirou entre o SET NX e o GET: tenta de novo
+        return json.loads(current) if current else self.claim_key(key, value, ttl)
+
+    def get_key(self, key):
+        raw = self._client.get(f"{self._prefix}:key:{key}")
+        return json.loads(raw) if raw else None
+
+    def set_key(self, key, value, ttl):
+        self._client.set(f"{self._prefix}:key:{key}", json.dumps(value), ex=int(ttl))
+
+    def delete_key(self, key):
+        self._client.delete(f"{self._prefix}:key:{key}")
+
+    def __contains__(self, session_id):
+        return bool(self._client.exists(self._key(session_id)))
+
+    def __len__(self):
+        return self._client.scard(self._index)
+
+
+def create_session_store(backend=None, ttl=0):
+    """Cria o armazenamento de sessões configurado (memory, sqlite ou redis)"""
+    backend = (backend or 'memory').lower()
+    if backend == 'memory':
+        return MemorySessionStore()
+    if backend == 'sqlite':
+        return SQLiteSessionStore(os.getenv('SESSION_SQLITE_PATH'))
+    if backend == 'redis':
+        return RedisSessionStore(os.getenv('SESSION_REDIS_URL'), ttl=ttl)
+    raise ValueError(f"Backend de sessões desconhecido: {backend}")
@@ -0,0 +1,34 @@
+"""
+Testes das rotas de administração: listagem de sessões
+"""
+
+
+def test_admin_routes_disabled_without_token(client):
+    assert client.get('/api/sessions').status_code == 404
+
+
+def test_admin_routes_require_bearer_token(client, admin):
+    assert client.get('/api/sessions').status_code == 401
+    assert client.get('/api/sessions', headers={'Authorization': 'Bearer outro'}).status_code == 401
+    assert client.get('/api/sessions', headers=admin).status_code == 200
+
+
+def test_list_sessions_paginates_newest_first(client, admin, upload):
+    created = [upload(n=1, seed=70 + i, envType='lavanderia') for i in range(5)]
+    ids, cursor = [], None
+    while True:
+        query = {'env': 'lavanderia', 'limit': 2, **({'cursor': cursor} if cursor else {})}
+        page = client.get('/api/sessions', query_string=query, headers=admin).json
+        ids.extend(entry['id'] for entry in page['sessions'])
+        assert all(entry['idle_seconds'] is not None for entry in page['sessions'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert ids == created[::-1]
+
+
+def test_list_sessions_counts_and_bad_cursor(client, admin, upload):
+    upload(n=1, seed=80)
+    response = client.get('/api/sessions?counts=1', headers=admin)
+    assert response.json['counts']['uploaded'] >= 1
+    assert client.get('/api/sessions?cursor=%25%25', headers=admin).status_code == 400
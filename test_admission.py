@@ -0,0 +1,122 @@
+"""
+Testes do controle de admissão: balde de fichas (429) e AdmissionGate (503)
+"""
+
+import threading
+
+import pytest
+
+import admission
+from admission import AdmissionGate, Overloaded, RateLimited, TokenBucketLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission.time, 'monotonic', fake)
+    return fake
+
+
+def test_token_bucket_burst_then_429(clock):
+    limiter = TokenBucketLimiter(rate=1, burst=3)
+    for _ in range(3):
+        limiter.take('cliente')
+    with pytest.raises(RateLimited) as excinfo:
+        limiter.take('cliente')
+    assert excinfo.value.retry_after == 1
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_token_bucket_refill(clock):
+    limiter = TokenBucketLimiter(rate=2, burst=2)
+    limiter.take('cliente')
+    limiter.take('cliente')
+    with pytest.raises(RateLimited):
+        limiter.take('cliente')
+    clock.now += 0.5  # 2 fichas/s: uma ficha de volta
+    limiter.take('cliente')
+    with pytest.raises(RateLimited):
+        limiter.take('cliente')
+    clock.now += 60  # recarga limitada ao burst
+    limiter.take('cliente')
+    limiter.take('cliente')
+    with pytest.raises(RateLimited):
+        limiter.take('cliente')
+
+
+def test_token_bucket_per_client_and_disabled(clock):
+    limiter = TokenBucketLimiter(rate=1, burst=1)
+    limiter.take('a')
+    limiter.take('b')
+    with pytest.raises(RateLimited):
+        limiter.take('a')
+    unlimited = TokenBucketLimiter(rate=0, burst=1)
+    for _ in range(100):
+        unlimited.take('a')
+
+
+def test_gate_full_queue_is_503():
+    gate = AdmissionGate(limit=1, queue_size=0, name='teste')
+    started = gate.acquire()
+    with pytest.raises(Overloaded) as excinfo:
+        gate.acquire()
+    assert 'fila cheia' in str(excinfo.value)
+    assert excinfo.value.retry_after >= 1
+    gate.release(started)
+    gate.release(gate.acquire())
+    assert gate.stats()['active'] == 0
+    assert gate.stats()['rejected'] == 1
+
+
+def test_gate_queue_timeout_is_503():
+    gate = AdmissionGate(limit=1, queue_size=1, queue_timeout=0.05, name='teste')
+    gate.acquire()
+    with pytest.raises(Overloaded) as excinfo:
+        gate.acquire()
+    assert 'tempo de espera esgotado' in str(excinfo.value)
+    assert gate.stats()['waiting'] == 0
+
+
+def test_gate_queued_request_gets_released_slot():
+    gate = AdmissionGate(limit=1, queue_size=1, queue_timeout=5)
+    started = gate.acquire()
+    admitted = threading.Event()
+
+    def waiter():
+        gate.acquire()
+        admitted.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    assert not admitted.wait(0.1)
+    gate.release(started)
+    assert admitted.wait(5)
+    thread.join()
+    assert gate.stats()['active'] == 1
+
+
+def test_gate_try_acquire():
+    gate = AdmissionGate(limit=1)
+    assert gate.try_acquire() is not None
+    assert gate.try_acquire() is None
+
+
+def test_generation_limit_is_per_client_ip(client, marmo_app, upload, monkeypatch):
+    monkeypatch.setattr(marmo_app, 'generation_limiter', TokenBucketLimiter(rate=0.001, burst=1))
+    session_id = upload(n=1, seed=90)
+    url = f'/api/generate-drawing/{session_id}'
+    assert client.post(url, headers={'X-Tenant-Id': 'a'}).status_code == 200
+
+    # Trocar o X-Tenant-Id não dá um balde novo: o limite é pelo IP
+    limited = client.post(url, headers={'X-Tenant-Id': 'b'})
+    assert limited.status_code == 429
+    assert int(limited.headers['Retry-After']) >= 1
+    assert client.post(url, environ_base={'REMOTE_ADDR': '10.0.0.9'}).status_code == 200
@@ -0,0 +1,138 @@
+"""
+Testes da análise estruturada do Claude: pedido com schema de ferramenta,
+extração da resposta e reparo só das chaves ausentes
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+FORM = {'envType': 'cozinha', 'format': 'l', 'stoneElements': ['bancada', 'ilha'],
+        'cutouts': ['pia'], 'characteristics': ''}
+
+
+def tool_use(payload, name='registrar_analise'):
+    return SimpleNamespace(type='tool_use', name=name, input=payload)
+
+
+def text(value):
+    return SimpleNamespace(type='text', text=value)
+
+
+def response(*blocks, stop_reason='tool_use'):
+    return SimpleNamespace(content=list(blocks), stop_reason=stop_reason)
+
+
+def full_analysis(marmo_app):
+    return {key: f'valor de {key}' for key in marmo_app.ANALYSIS_REQUIRED_KEYS}
+
+
+def test_extract_prefers_the_tool_call(marmo_app):
+    reply = response(text('{"layout_analysis": "do texto"}'),
+                     tool_use({'layout_analysis': 'da ferramenta'}))
+    assert marmo_app._extract_analysis(reply) == {'layout_analysis': 'da ferramenta'}
+
+
+def test_extract_falls_back_to_text(marmo_app):
+    fenced = text('Segue a análise:\n```json\n{"confidence": 70}\n```')
+    assert marmo_app._extract_analysis(response(fenced)) == {'confidence': 70}
+    assert marmo_app._extract_analysis(response(text('sem json'), text('{quebrado'))) == {}
+    assert marmo_app._extract_analysis(response(tool_use({'x': 1}, name='outra'))) == {}
+
+
+def test_missing_keys(marmo_app):
+    analysis = full_analysis(marmo_app)
+    del analysis['challenges'], analysis['confidence']
+    assert marmo_app._missing_keys(analysis, response()) == ['challenges', 'confidence']
+    assert marmo_app._missing_keys(full_analysis(marmo_app), response()) == []
+    # Análise vazia não é reparada (o pedido inteiro falhou)
+    assert marmo_app._missing_keys({}, response(stop_reason='max_tokens')) == []
+
+
+def test_max_tokens_grows_with_the_form(marmo_app):
+    small = marmo_app._analysis_max_tokens({'stoneElements': ['nenhum'], 'cutouts': []})
+    large = marmo_app._analysis_max_tokens({'stoneElements': ['e'] * 10, 'cutouts': ['c'] * 8})
+    assert small == 1024
+    assert small < large <= 4096
+    assert marmo_app._analysis_max_tokens({'stoneElements': ['e'] * 50, 'cutouts': []}) == 4096
+
+
+def test_analysis_request_forces_the_tool(marmo_app, upload):
+    session_id = upload(n=4, seed=150)
+    images = marmo_app.session_data.get(session_id)['images']
+    request = marmo_app.build_analysis_request(images, FORM)
+    assert request['tool_choice'] == {'type': 'tool', 'name': 'registrar_analise'}
+    schema = request['tools'][0]['input_schema']
+    assert schema['required'] == marmo_app.ANALYSIS_REQUIRED_KEYS
+    content = request['messages'][0]['content']
+    assert [block['type'] for block in content] == ['image'] * 3 + ['text']
+    assert 'bancada, ilha' in content[-1]['text']
+
+
+def test_repair_request_asks_only_for_missing_keys(marmo_app):
+    partial = {'layout_analysis': 'parede lisa'}
+    request = marmo_app._repair_request(partial, ['challenges', 'confidence'], FORM)
+    schema = request['tools'][0]['input_schema']
+    assert schema['required'] == ['challenges', 'confidence']
+    assert set(schema['properties']) == {'challenges', 'confidence'}
+    prompt = request['messages'][0]['content']
+    assert isinstance(prompt, str)  # sem reenviar as imagens
+    assert json.dumps(partial, ensure_ascii=False, separators=(',', ':')) in prompt
+
+
+def test_merge_repair_keeps_only_requested_keys(marmo_app):
+    analysis = {'layout_analysis': 'original'}
+    repaired = response(tool_use({'confidence': 55, 'layout_analysis': 'sobrescrita'}))
+    assert marmo_app._merge_repair(analysis, ['confidence'], repaired) == \
+        {'layout_analysis': 'original', 'confidence': 55}
+
+
+class FakeMessages:
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+@pytest.fixture
+def claude(marmo_app, monkeypatch):
+    """Instala um cliente falso da Anthropic com as respostas dadas"""
+    def install(*replies):
+        messages = FakeMessages(*replies)
+        monkeypatch.setattr(marmo_app, 'HAS_CLAUDE_VISION', True)
+        monkeypatch.setattr(marmo_app.providers, 'get',
+                            lambda name: SimpleNamespace(messages=messages))
+        return messages
+    return install
+
+
+def test_partial_analysis_is_repaired(marmo_app, upload, claude):
+    images = marmo_app.session_data.get(upload(n=1, seed=153))['images']
+    partial = full_analysis(marmo_app)
+    del partial['confidence']
+    messages = claude(response(tool_use(partial), stop_reason='max_tokens'),
+                      response(tool_use({'confidence': 64})))
+    analysis = marmo_app.analyze_images_with_claude(images, FORM)
+    assert analysis == {**partial, 'confidence': 64}
+    assert len(messages.requests) == 2
+    assert messages.requests[1]['tools'][0]['input_schema']['required'] == ['confidence']
+
+
+def test_failed_repair_keeps_partial_analysis(marmo_app, upload, claude):
+    images = marmo_app.session_data.get(upload(n=1, seed=154))['images']
+    claude(response(tool_use({'layout_analysis': 'parcial'})), RuntimeError('529 overloaded'))
+    assert marmo_app.analyze_images_with_claude(images, FORM) == {'layout_analysis': 'parcial'}
+
+
+def test_empty_analysis_is_none(marmo_app, upload, claude):
+    images = marmo_app.session_data.get(upload(n=1, seed=155))['images']
+    messages = claude(response(text('não consegui analisar')))
+    assert marmo_app.analyze_images_with_claude(images, FORM) is None
+    assert len(messages.requests) == 1
@@ -0,0 +1,89 @@
+"""
+Testes do núcleo assíncrono: contagem das corrotinas em andamento e o
+caminho httpx do Hugging Face contra o servidor falso (fake_providers.py)
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from async_core import AsyncCore
+
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+
+@pytest.fixture
+def core():
+    core = AsyncCore(cpu_workers=1)
+    yield core
+    core.loop.call_soon_threadsafe(core.loop.stop)
+    core.cpu_executor.shutdown()
+
+
+async def _quick(value):
+    return value
+
+
+def test_in_flight_never_negative(core):
+    samples = []
+    futures = []
+    for i in range(500):
+        futures.append(core.submit(_quick(i)))
+        samples.append(core.in_flight())
+    assert [f.result(5) for f in futures] == list(range(500))
+    assert min(samples) >= 0
+    assert core.in_flight() == 0
+
+
+def test_in_flight_counts_pending_coroutines(core):
+    release = asyncio.Event()
+
+    async def wait():
+        await release.wait()
+
+    future = core.submit(wait())
+    assert core.in_flight() == 1
+    core.loop.call_soon_threadsafe(release.set)
+    future.result(5)
+    assert core.in_flight() == 0
+
+
+def test_rejected_submit_is_not_counted(core):
+    with pytest.raises(TypeError):
+        core.submit(lambda: None)
+    assert core.in_flight() == 0
+
+
+@pytest.fixture
+def fake_space():
+    """Servidor falso dos provedores numa thread, sem latência; retorna a URL"""
+    pytest.importorskip('httpx')
+    from werkzeug.serving import make_server
+    import fake_providers
+
+    saved = fake_providers.config()
+    fake_providers._merge(fake_providers._config, {'latency_scale': 0.0,
+                                                   'hf': {'image_size': 64}})
+    server = make_server('127.0.0.1', 0, fake_providers.fake, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield fake_providers, f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    thread.join()
+    with fake_providers._config_lock:
+        fake_providers._config.clear()
+        fake_providers._config.update(saved)
+
+
+@pytest.mark.parametrize('mode, upload', [('base64', True), ('url', True), ('file', False)])
+def test_hf_http_fallback_async(marmo_app, fake_space, mode, upload):
+    from conftest import jpeg_bytes
+    fake_providers, url = fake_space
+    fake_providers._merge(fake_providers._config, {'hf': {'mode': mode, 'upload': upload}})
+
+    input_image = marmo_app.hf_input_image(jpeg_bytes(150))
+    result = marmo_app.async_core.run(marmo_app._generate_image_http_fallback_async(
+        input_image, 'bancada de mármore', url, 'hf-token'), timeout=30)
+    assert result.startswith(PNG_MAGIC)
+    assert marmo_app.async_core.in_flight() == 0
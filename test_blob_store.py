@@ -0,0 +1,151 @@
+"""
+Testes do blob store: contagem de referências por dono, release e prune
+"""
+
+import io
+import os
+import time
+
+import pytest
+
+from blob_store import DiskBlobStore, MemoryBlobStore, blob_digest
+from conftest import jpeg_bytes
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def store(request, tmp_path):
+    if request.param == 'disk':
+        return DiskBlobStore(str(tmp_path / 'spool'))
+    return MemoryBlobStore()
+
+
+def test_put_deduplicates_and_counts_owners(store):
+    digest = store.put(b'foto', 's1')
+    assert digest == blob_digest(b'foto')
+    assert store.put(b'foto', 's2') == digest
+    assert store.put(b'foto', 's2') == digest  # mesmo dono: uma referência só
+    assert store.refcount(digest) == 2
+    assert bytes(store.get(digest)) == b'foto'
+    assert store.stats()['blobs'] == 1
+
+
+def test_release_frees_only_unreferenced(store):
+    shared = store.put(b'compartilhada', 's1')
+    store.put(b'compartilhada', 's2')
+    own = store.put(b'so-de-s1', 's1')
+
+    assert sorted(store.release('s1')) == [own]
+    assert own not in store
+    assert shared in store
+    assert store.refcount(shared) == 1
+
+    assert store.release('s2') == [shared]
+    assert shared not in store
+    assert store.release('s2') == []
+    assert store.stats() == {'blobs': 0, 'bytes': 0, 'owners': 0}
+
+
+def test_discard_drops_one_reference(store):
+    shared = store.put(b'compartilhada', 's1')
+    store.put(b'compartilhada', 's2')
+    kept = store.put(b'fica', 's1')
+
+    assert store.discard(shared, 's1') is False  # s2 ainda referencia
+    assert store.refcount(shared) == 1
+    assert store.discard(shared, 's1') is False  # referência já removida
+    assert store.discard(shared, 's2') is True
+    assert shared not in store
+    assert kept in store
+    assert store.release('s1') == [kept]
+
+
+def test_add_ref_requires_existing_blob(store):
+    digest = store.put(b'x', 's1')
+    store.add_ref(digest, 's2')
+    assert store.refcount(digest) == 2
+    with pytest.raises(KeyError):
+        store.add_ref(blob_digest(b'inexistente'), 's1')
+
+
+def test_prune_releases_dead_owners(store):
+    live = store.put(b'viva', 'viva')
+    dead = store.put(b'morta', 'morta')
+    if isinstance(store, DiskBlobStore):
+        freed = store.prune(['viva'], grace=0)
+    else:
+        freed = store.prune(['viva'])
+    assert freed == [dead]
+    assert live in store
+    assert dead not in store
+
+
+def test_disk_prune_keeps_recent_owners(tmp_path):
+    store = DiskBlobStore(str(tmp_path / 'spool'))
+    recent = store.put(b'upload em andamento', 'nova')
+    old = store.put(b'antiga', 'antiga')
+    past = time.time() - 3600
+    os.utime(os.path.join(store.root, 'owners', 'antiga'), (past, past))
+
+    assert store.prune([], grace=600) == [old]
+    assert recent in store
+
+
+def test_disk_refcount_survives_reopen(tmp_path):
+    root = str(tmp_path / 'spool')
+    digest = DiskBlobStore(root).put(b'persistente', 's1')
+    reopened = DiskBlobStore(root)
+    assert reopened.refcount(digest) == 1
+    assert reopened.release('s1') == [digest]
+    assert digest not in reopened
+
+
+def test_disk_get_is_memory_mapped(tmp_path):
+    store = DiskBlobStore(str(tmp_path / 'spool'))
+    digest = store.put(b'conteudo' * 100, 's1')
+    view = store.get(digest)
+    assert view[:8] == b'conteudo' and len(view) == 800
+    assert store.path(digest).startswith(store.root)
+    assert store.size(digest) == 800
+
+
+def test_disk_stats_tolerates_concurrent_release(tmp_path, monkeypatch):
+    store = DiskBlobStore(str(tmp_path / 'spool'))
+    store.put(b'fica', 's1')
+    store.put(b'sai', 's2')
+    scandir = os.scandir
+
+    def scandir_then_release(path):
+        entries = list(scandir(path))
+        store.release('s2')  # apagado entre a listagem e o stat
+        return iter(entries)
+
+    monkeypatch.setattr(os, 'scandir', scandir_then_release)
+    assert store.stats()['blobs'] == 1
+
+
+def test_one_blob_scan_per_scrape(client, marmo_app, monkeypatch):
+    calls = []
+    stats = marmo_app.blob_store.stats
+    monkeypatch.setattr(marmo_app.blob_store, 'stats', lambda: calls.append(1) or stats())
+    monkeypatch.setattr(marmo_app, '_blob_stats', (0.0, None))
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/api/health').status_code == 200
+    assert len(calls) == 1
+
+
+def test_non_image_upload_is_400_without_orphan_refs(client, marmo_app):
+    before = marmo_app.blob_store.stats()
+    response = client.post('/api/upload', data={
+        'images': [(io.BytesIO(jpeg_bytes(50)), 'ok.jpg'),
+                   (io.BytesIO(b'isto nao e uma imagem' * 10), 'falsa.jpg')],
+        'envType': 'cozinha'}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert marmo_app.blob_store.stats() == before
+
+
+def test_identical_uploads_share_blobs(upload, marmo_app):
+    first = marmo_app.session_data.get(upload(n=1, seed=60))
+    second = marmo_app.session_data.get(upload(n=1, seed=60))
+    digest = first['images'][0]['digest']
+    assert second['images'][0]['digest'] == digest
+    assert marmo_app.blob_store.refcount(digest) == 2
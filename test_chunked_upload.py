@@ -0,0 +1,192 @@
+"""
+Testes dos uploads retomáveis: pedaços fora de ordem, repetidos ou
+corrompidos, SHA-256 por foto e repetição da finalização
+"""
+
+import hashlib
+import io
+
+import pytest
+
+from chunked_upload import UploadError, UploadSpool, add_range, missing_ranges
+from conftest import jpeg_bytes
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return UploadSpool(str(tmp_path / 'uploads'))
+
+
+def declare(spool, *photos, sha=True):
+    files = [{'filename': f'foto{i}.jpg', 'size': len(photo),
+              'sha256': hashlib.sha256(photo).hexdigest() if sha else None}
+             for i, photo in enumerate(photos)]
+    return spool.create(files, {'envType': 'cozinha'})['upload_id']
+
+
+def send(spool, upload_id, index, photo, offset, size):
+    chunk = photo[offset:offset + size]
+    return spool.write_chunk(upload_id, index, offset, io.BytesIO(chunk), len(chunk))
+
+
+def test_ranges():
+    assert add_range([[0, 10], [20, 30]], 10, 20) == [[0, 30]]
+    assert add_range([[20, 30]], 0, 5) == [[0, 5], [20, 30]]
+    assert missing_ranges([[0, 5], [20, 30]], 40) == [[5, 20], [30, 40]]
+
+
+def test_out_of_order_chunks(spool):
+    photo = bytes(range(250)) * 40
+    upload_id = declare(spool, photo)
+    for offset in (4000, 8000, 0, 2000, 6000):
+        state = send(spool, upload_id, 0, photo, offset, 2000)
+    assert state['complete']
+    files, form = spool.complete_files(upload_id)
+    assert files[0].read() == photo
+    assert files[0].sha256 == hashlib.sha256(photo).hexdigest()
+    assert form == {'envType': 'cozinha'}
+
+
+def test_duplicate_chunk_is_idempotent(spool):
+    photo = b'abcdefghij' * 500
+    upload_id = declare(spool, photo)
+    send(spool, upload_id, 0, photo, 0, 2000)
+    send(spool, upload_id, 0, photo, 0, 2000)
+    state = send(spool, upload_id, 0, photo, 1000, 2000)
+    assert state['files'][0]['received'] == [[0, 3000]]
+    send(spool, upload_id, 0, photo, 3000, 2000)
+    files, _form = spool.complete_files(upload_id)
+    assert files[0].read() == photo
+
+
+def test_missing_ranges_and_incomplete_finalize(spool):
+    photo = b'x' * 5000
+    upload_id = declare(spool, photo, sha=False)
+    send(spool, upload_id, 0, photo, 0, 1000)
+    send(spool, upload_id, 0, photo, 3000, 1000)
+    assert spool.status(upload_id)['files'][0]['missing'] == [[1000, 3000], [4000, 5000]]
+    with pytest.raises(UploadError) as excinfo:
+        spool.complete_files(upload_id)
+    assert excinfo.value.status == 409
+
+
+def test_corrupted_chunk_is_not_counted(spool):
+    photo = b'y' * 4000
+    upload_id = declare(spool, photo)
+    with pytest.raises(UploadError) as excinfo:
+        spool.write_chunk(upload_id, 0, 0, io.BytesIO(b'z' * 1000), 1000, chunk_sha256='00' * 32)
+    assert excinfo.value.status == 400
+    assert spool.status(upload_id)['files'][0]['received'] == []
+    with pytest.raises(UploadError) as excinfo:
+        spool.write_chunk(upload_id, 0, 0, io.BytesIO(b'y' * 10), 1000)  # corpo truncado
+    assert spool.status(upload_id)['files'][0]['received'] == []
+
+
+def test_declared_sha_mismatch_resets_photo(spool):
+    photo = b'w' * 3000
+    upload_id = spool.create([{'filename': 'a.jpg', 'size': len(photo), 'sha256': 'ab' * 32}],
+                             {})['upload_id']
+    send(spool, upload_id, 0, photo, 0, 3000)
+    with pytest.raises(UploadError) as excinfo:
+        spool.complete_files(upload_id)
+    assert excinfo.value.status == 422
+    assert spool.status(upload_id)['files'][0]['missing'] == [[0, 3000]]
+
+
+@pytest.mark.parametrize('sha256', [123, ['ab'], 'ab' * 31, 'zz' * 32, ''])
+def test_invalid_declared_sha_is_400(spool, sha256):
+    with pytest.raises(UploadError) as excinfo:
+        spool.create([{'filename': 'a.jpg', 'size': 10, 'sha256': sha256}], {})
+    assert excinfo.value.status == 400
+
+
+def test_declared_sha_is_case_insensitive(spool):
+    photo = b'u' * 100
+    upload_id = spool.create([{'filename': 'a.jpg', 'size': 100,
+                               'sha256': hashlib.sha256(photo).hexdigest().upper()}], {})['upload_id']
+    send(spool, upload_id, 0, photo, 0, 100)
+    files, _form = spool.complete_files(upload_id)
+    assert files[0].read() == photo
+
+
+def test_out_of_range_and_unknown_upload(spool):
+    upload_id = declare(spool, b'q' * 100)
+    with pytest.raises(UploadError) as excinfo:
+        spool.write_chunk(upload_id, 0, 90, io.BytesIO(b'q' * 20), 20)
+    assert excinfo.value.status == 416
+    with pytest.raises(UploadError) as excinfo:
+        spool.status('0' * 32)
+    assert excinfo.value.status == 404
+
+
+def upload_via_api(client, photos, form=None):
+    response = client.post('/api/uploads', json={
+        'files': [{'filename': f'foto{i}.jpg', 'size': len(p),
+                   'sha256': hashlib.sha256(p).hexdigest()} for i, p in enumerate(photos)],
+        'form': form or {'envType': 'cozinha', 'format': 'l', 'cutouts': ['pia']}})
+    assert response.status_code == 201, response.json
+    upload_id = response.json['upload_id']
+    for index, photo in enumerate(photos):
+        half = len(photo) // 2
+        for offset in (half, 0):  # segunda metade primeiro
+            end = len(photo) if offset else half
+            response = client.put(f'/api/uploads/{upload_id}/files/{index}?offset={offset}',
+                                  data=photo[offset:end])
+            assert response.status_code == 200, response.json
+    return upload_id
+
+
+def test_finalize_replay_returns_same_body(client, marmo_app):
+    photos = [jpeg_bytes(1), jpeg_bytes(2)]
+    upload_id = upload_via_api(client, photos)
+
+    first = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert first.status_code == 200
+    assert first.json['images_count'] == 2
+    replay = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert replay.status_code == 200
+    assert replay.json == first.json
+    assert replay.headers.get('Idempotent-Replayed') == 'true'
+
+    data = marmo_app.session_data.get(first.json['session_id'])
+    assert data['form']['cutouts'] == ['pia']
+    assert [img['digest'] for img in data['images']] == \
+        [hashlib.sha256(p).hexdigest() for p in photos]
+
+
+def test_finalize_after_session_expired_is_410(client, marmo_app):
+    upload_id = upload_via_api(client, [jpeg_bytes(3)])
+    session_id = client.post(f'/api/uploads/{upload_id}/finalize').json['session_id']
+    marmo_app.evict_session(session_id)
+    assert client.post(f'/api/uploads/{upload_id}/finalize').status_code == 410
+
+
+@pytest.mark.parametrize('form', [['x'], {'format': {'x': 1}}, {'desconhecido': 'a'},
+                                  {'cutouts': [1]}, 'texto'])
+def test_invalid_form_is_400(client, form):
+    response = client.post('/api/uploads', json={'files': [{'filename': 'a.jpg', 'size': 3}],
+                                                 'form': form})
+    assert response.status_code == 400
+
+
+def test_finalize_during_chunk_write_is_409(spool):
+    photo = b'v' * 4000
+    upload_id = declare(spool, photo)
+    send(spool, upload_id, 0, photo, 0, 2000)
+    take_hasher = spool._take_hasher
+
+    def finalize_meanwhile(key, offset):
+        # Outra requisição finaliza (e apaga as partes) depois da checagem do estado
+        spool.finish(upload_id, 'sessao', {'session_id': 'sessao'})
+        return take_hasher(key, offset)
+
+    spool._take_hasher = finalize_meanwhile
+    with pytest.raises(UploadError) as excinfo:
+        send(spool, upload_id, 0, photo, 2000, 2000)
+    assert excinfo.value.status == 409
+
+
+def test_non_string_sha_via_api_is_400(client):
+    response = client.post('/api/uploads', json={'files': [{'filename': 'a.jpg', 'size': 3,
+                                                            'sha256': 123}]})
+    assert response.status_code == 400
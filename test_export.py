@@ -0,0 +1,87 @@
+"""
+Testes da exportação em lote (/api/export): ZIP em streaming, manifest,
+sessões intactas e acesso só com ADMIN_TOKEN
+"""
+
+import io
+import json
+import time
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def sessions(client, upload):
+    drawn = upload(n=2, seed=210)
+    assert client.post(f'/api/generate-drawing/{drawn}').status_code == 200
+    return drawn, upload(n=1, seed=215)
+
+
+def export(client, admin, **params):
+    response = client.post('/api/export', json=params, headers=admin)
+    assert response.status_code == 200, response.data[:200]
+    assert response.is_streamed
+    return zipfile.ZipFile(io.BytesIO(response.get_data()))
+
+
+def test_export_requires_admin_token(client, marmo_app, sessions, monkeypatch):
+    assert client.post('/api/export', json={'session_ids': list(sessions)}).status_code == 404
+    monkeypatch.setattr(marmo_app, 'ADMIN_TOKEN', 'token-de-teste')
+    assert client.post('/api/export', json={'session_ids': list(sessions)}).status_code == 401
+    wrong = {'Authorization': 'Bearer outro'}
+    assert client.post('/api/export', json={'session_ids': list(sessions)},
+                       headers=wrong).status_code == 401
+
+
+def test_export_archive(client, marmo_app, admin, sessions):
+    drawn, uploaded = sessions
+    before = {sid: marmo_app.session_data.snapshot(sid) for sid in sessions}
+    archive = export(client, admin, session_ids=[drawn, uploaded, 'nao-existe'])
+    assert archive.testzip() is None
+
+    names = set(archive.namelist())
+    assert {f'{drawn}/fotos/01_foto0.jpg', f'{drawn}/fotos/02_foto1.jpg', f'{drawn}/desenho.png',
+            f'{drawn}/desenho.pdf', f'{drawn}/analise.json', f'{uploaded}/fotos/01_foto0.jpg',
+            f'{uploaded}/analise.json', 'manifest.json'} == names
+    assert archive.read(f'{drawn}/desenho.png').startswith(b'\x89PNG')
+    assert archive.read(f'{drawn}/desenho.pdf').startswith(b'%PDF')
+    photo = marmo_app.session_data.get(drawn)['images'][0]['digest']
+    assert archive.read(f'{drawn}/fotos/01_foto0.jpg') == bytes(marmo_app.blob_store.get(photo))
+
+    manifest = {entry['session_id']: entry
+                for entry in json.loads(archive.read('manifest.json'))['sessions']}
+    assert manifest['nao-existe'] == {'session_id': 'nao-existe', 'error': 'Sessão não encontrada'}
+    assert manifest[drawn]['status'] == 'drawing_created'
+    assert json.loads(archive.read(f'{uploaded}/analise.json'))['drawing'] is None
+
+    # Exportar só lê: status, digests e PDF da sessão continuam como estavam
+    for sid in sessions:
+        after = marmo_app.session_data.snapshot(sid)
+        assert after['status'] == before[sid]['status']
+        assert 'pdf_digest' not in after
+
+
+def test_export_by_time_range(client, admin, sessions):
+    archive = export(client, admin, since=time.time() - 60, status='drawing_created')
+    exported = {entry['session_id'] for entry in
+                json.loads(archive.read('manifest.json'))['sessions']}
+    assert sessions[0] in exported and sessions[1] not in exported
+
+
+def test_export_get_with_query(client, admin, sessions):
+    response = client.get(f'/api/export?session_ids={sessions[1]}', headers=admin)
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].startswith('attachment; filename="marmoview_')
+
+
+@pytest.mark.parametrize('params', [{}, {'session_ids': {'a': 1}}, {'session_ids': [1, 2]},
+                                    {'since': 'ontem'}])
+def test_invalid_export_is_400(client, admin, params):
+    assert client.post('/api/export', json=params, headers=admin).status_code == 400
+
+
+def test_export_limit(client, marmo_app, admin, monkeypatch):
+    monkeypatch.setattr(marmo_app, 'EXPORT_MAX_SESSIONS', 2)
+    response = client.post('/api/export', json={'session_ids': ['a', 'b', 'c']}, headers=admin)
+    assert response.status_code == 400
@@ -0,0 +1,97 @@
+"""
+Testes da entrada e da resposta do Space do Hugging Face: foto reduzida no
+formato original, token só para o próprio Space e leitura do /api/predict
+"""
+
+import base64
+import io
+
+import pytest
+from PIL import Image
+
+from conftest import jpeg_bytes
+
+
+def encode(img, fmt, **params):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+def open_image(data):
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return img
+
+
+def test_small_jpeg_goes_as_is(marmo_app):
+    photo = jpeg_bytes(150)
+    assert marmo_app.hf_input_image(photo) == (photo, 'image/jpeg', 'entrada.jpg')
+
+
+def test_large_jpeg_is_downscaled(marmo_app):
+    photo = jpeg_bytes(151, size=(2000, 1000))
+    data, mime, filename = marmo_app.hf_input_image(photo)
+    assert (mime, filename) == ('image/jpeg', 'entrada.jpg')
+    img = open_image(data)
+    assert img.format == 'JPEG'
+    assert max(img.size) == marmo_app.HF_INPUT_MAX_SIDE
+    assert len(data) < len(photo)
+
+
+def test_exif_rotation_is_applied(marmo_app):
+    exif = Image.Exif()
+    exif[0x0112] = 6  # girar 90°
+    photo = encode(Image.new('RGB', (1600, 800), (90, 90, 90)), 'JPEG', exif=exif)
+    img = open_image(marmo_app.hf_input_image(photo)[0])
+    assert img.size[0] < img.size[1]
+
+
+def test_mpo_becomes_plain_jpeg(marmo_app):
+    main = Image.new('RGB', (320, 240), (200, 30, 30))
+    photo = encode(main, 'MPO', save_all=True, append_images=[Image.new('RGB', (320, 240))])
+    assert open_image(photo).format == 'MPO'
+    data, mime, filename = marmo_app.hf_input_image(photo)
+    assert (mime, filename) == ('image/jpeg', 'entrada.jpg')
+    img = open_image(data)
+    assert img.format == 'JPEG'
+    assert img.size == (320, 240)
+    assert img.getpixel((10, 10))[0] > 150  # a foto principal, não o quadro extra
+
+
+@pytest.mark.parametrize('fmt', ['PNG', 'WEBP', 'BMP'])
+def test_other_formats_become_png(marmo_app, fmt):
+    photo = encode(Image.new('RGB', (1200, 300), (10, 120, 10)), fmt)
+    data, mime, filename = marmo_app.hf_input_image(photo)
+    assert (mime, filename) == ('image/png', 'entrada.png')
+    assert open_image(data).size == (marmo_app.HF_INPUT_MAX_SIDE, 192)
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://user-model.hf.space/file=/tmp/a.png', True),
+    ('https://USER-model.hf.space:443/file=x', False),
+    ('http://user-model.hf.space/file=x', False),
+    ('https://user-model.hf.space.evil.com/file=x', False),
+    ('https://user-model.hf.space@evil.com/file=x', False),
+    ('https://evil.com/?https://user-model.hf.space', False),
+])
+def test_token_only_for_the_space_origin(marmo_app, url, expected):
+    base = 'https://user-model.hf.space'
+    assert marmo_app.same_origin(url, base) is expected
+    headers = marmo_app.hf_auth_headers('hf-token', url, base)
+    assert bool(headers) is expected
+    assert marmo_app.hf_auth_headers('hf-token') == {'Authorization': 'Bearer hf-token'}
+    assert marmo_app.hf_auth_headers(None, url, base) == {}
+
+
+def test_hf_output(marmo_app):
+    base = 'https://user-model.hf.space'
+    png = encode(Image.new('RGB', (4, 4)), 'PNG')
+    data_uri = 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+    assert marmo_app.hf_output({'data': [data_uri]}, base) == png
+    assert marmo_app.hf_output({'data': ['https://cdn/x.png']}, base) == 'https://cdn/x.png'
+    assert marmo_app.hf_output({'data': [{'path': '/tmp/x.png'}]}, base) == f'{base}/file=/tmp/x.png'
+    assert marmo_app.hf_output({'data': [{'url': 'https://cdn/y.png', 'path': '/tmp/y.png'}]},
+                               base) == 'https://cdn/y.png'
+    assert marmo_app.hf_output({'data': []}, base) is None
+    assert marmo_app.hf_output({'error': 'fila cheia'}, base) is None
@@ -0,0 +1,122 @@
+"""
+Testes da Idempotency-Key (repetição x 422) e da geração single-flight
+"""
+
+import hashlib
+import io
+import threading
+import time
+
+from conftest import jpeg_bytes
+
+
+def post_upload(client, key, env_type='cozinha', seed=10):
+    return client.post('/api/upload', headers={'Idempotency-Key': key},
+                       data={'images': [(io.BytesIO(jpeg_bytes(seed)), 'a.jpg')],
+                             'envType': env_type, 'format': 'l'},
+                       content_type='multipart/form-data')
+
+
+def test_stream_sha256_reads_in_blocks(marmo_app):
+    data = jpeg_bytes(12) * 40  # maior que um bloco de 64 KB
+    assert len(data) > 64 * 1024
+    assert marmo_app.stream_sha256(io.BytesIO(data)) == hashlib.sha256(data).hexdigest()
+
+
+def test_upload_replay_returns_original(client, marmo_app):
+    sessions = len(marmo_app.session_data)
+    first = post_upload(client, 'upload-replay')
+    assert first.status_code == 200
+    replay = post_upload(client, 'upload-replay')
+    assert replay.status_code == 200
+    assert replay.json == first.json
+    assert replay.headers.get('Idempotent-Replayed') == 'true'
+    assert len(marmo_app.session_data) == sessions + 1
+
+
+def test_upload_key_reused_with_other_body_is_422(client):
+    assert post_upload(client, 'upload-422').status_code == 200
+    assert post_upload(client, 'upload-422', env_type='banheiro').status_code == 422
+    assert post_upload(client, 'upload-422', seed=11).status_code == 422
+
+
+def test_key_is_scoped_per_client(client):
+    first = post_upload(client, 'upload-cliente')
+    other = client.post('/api/upload', headers={'Idempotency-Key': 'upload-cliente'},
+                        environ_base={'REMOTE_ADDR': '10.0.0.2'},
+                        data={'images': [(io.BytesIO(jpeg_bytes(10)), 'a.jpg')],
+                              'envType': 'cozinha', 'format': 'l'},
+                        content_type='multipart/form-data')
+    assert other.status_code == 200
+    assert other.json['session_id'] != first.json['session_id']
+
+
+def test_generation_replay_and_mismatch(client, upload):
+    session_id = upload(seed=20)
+    url = f'/api/generate-drawing/{session_id}'
+    first = client.post(url, headers={'Idempotency-Key': 'gen-1'})
+    assert first.status_code == 200
+    replay = client.post(url, headers={'Idempotency-Key': 'gen-1'})
+    assert replay.json == first.json
+    assert replay.headers.get('Idempotent-Replayed') == 'true'
+    assert client.post(url + '?mode=async', headers={'Idempotency-Key': 'gen-1'}).status_code == 422
+
+
+def test_concurrent_generations_share_one_run(marmo_app, upload, monkeypatch):
+    session_id = upload(seed=30)
+    runs = []
+    original = marmo_app.run_generation
+
+    def slow_generation(sid, data):
+        runs.append(sid)
+        time.sleep(0.3)
+        return original(sid, data)
+
+    monkeypatch.setattr(marmo_app, 'run_generation', slow_generation)
+
+    results = []
+
+    def generate():
+        response = marmo_app.app.test_client().post(f'/api/generate-drawing/{session_id}')
+        results.append((response.status_code, response.json))
+
+    threads = [threading.Thread(target=generate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert runs == [session_id]
+    assert [status for status, _ in results] == [200] * 4
+    assert all(payload == results[0][1] for _, payload in results)
+    assert not marmo_app._generation_flights
+    assert marmo_app.generation_gate.stats()['active'] == 0
+
+
+def test_failed_save_releases_generation_slot(client, marmo_app, upload, monkeypatch):
+    session_id = upload(seed=40)
+
+    def broken_save(sid, data):
+        raise RuntimeError('disco cheio')
+
+    monkeypatch.setattr(marmo_app.session_data, 'save', broken_save)
+    assert client.post(f'/api/generate-drawing/{session_id}').status_code == 500
+    assert marmo_app.generation_gate.stats()['active'] == 0
+    assert not marmo_app._generation_flights
+    data = marmo_app.session_data.get(session_id)
+    assert data['status'] == 'uploaded'
+    assert 'generation_inputs' not in data and 'generation_started' not in data
+
+
+def test_failed_submit_clears_generation_marks(client, marmo_app, upload, monkeypatch):
+    session_id = upload(seed=41)
+
+    def broken_submit(*args):
+        raise RuntimeError('executor encerrado')
+
+    monkeypatch.setattr(marmo_app.generation_executor, 'submit', broken_submit)
+    assert client.post(f'/api/generate-drawing/{session_id}?mode=async').status_code == 500
+    assert marmo_app.generation_gate.stats()['active'] == 0
+    data = marmo_app.session_data.get(session_id)
+    assert data['status'] == 'uploaded'
+    assert 'generation_inputs' not in data and 'generation_started' not in data
@@ -0,0 +1,136 @@
+"""
+Testes da preparação de imagens: folha de contato (várias fotos num único
+bloco de imagem) e pontuação/seleção das fotos mais informativas
+"""
+
+import base64
+import io
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+from conftest import jpeg_bytes
+from image_prep import (CONTACT_SHEET_GAP, CONTACT_SHEET_MAX_PIXELS, CONTACT_SHEET_MAX_SIDE,
+                        _sheet_grid, build_contact_sheet, hash_distance, rank_images,
+                        score_image)
+
+COLORS = [(200, 40, 40), (40, 200, 40), (40, 40, 200), (220, 220, 40), (40, 200, 200)]
+
+
+def encode(img, quality=90):
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def solid(color, size=(640, 480)):
+    return encode(Image.new('RGB', size, color))
+
+
+def textured(seed, size=(480, 360)):
+    """Foto com detalhe fino (ruído em blocos), diferente para cada seed"""
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(40, 215, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    return Image.fromarray(blocks.repeat(8, axis=0).repeat(8, axis=1))
+
+
+@pytest.mark.parametrize('count', range(1, 10))
+def test_sheet_fits_the_model_limits(count):
+    cols, rows, tile = _sheet_grid(count)
+    assert cols * rows >= count
+    width = cols * tile + CONTACT_SHEET_GAP * (cols - 1)
+    height = rows * tile + CONTACT_SHEET_GAP * (rows - 1)
+    assert max(width, height) <= CONTACT_SHEET_MAX_SIDE
+    assert cols * rows * tile * tile <= CONTACT_SHEET_MAX_PIXELS
+
+
+def test_each_photo_lands_in_its_tile():
+    sheet = Image.open(io.BytesIO(build_contact_sheet([solid(c) for c in COLORS])))
+    assert sheet.format == 'JPEG'
+    cols, rows, tile = _sheet_grid(len(COLORS))
+    assert sheet.size == (cols * tile + CONTACT_SHEET_GAP * (cols - 1),
+                          rows * tile + CONTACT_SHEET_GAP * (rows - 1))
+    for index, color in enumerate(COLORS):
+        col, row = index % cols, index // cols
+        center = (col * (tile + CONTACT_SHEET_GAP) + tile // 2,
+                  row * (tile + CONTACT_SHEET_GAP) + tile // 2)
+        assert all(abs(a - b) < 20 for a, b in zip(sheet.getpixel(center), color))
+    # Tile vazio (6º de uma grade 3x2) fica branco
+    assert sheet.getpixel((sheet.size[0] - tile // 2, sheet.size[1] - tile // 2)) == (255, 255, 255)
+
+
+def test_empty_sheet_is_an_error():
+    with pytest.raises(ValueError):
+        build_contact_sheet([])
+
+
+def test_analysis_request_sends_one_sheet(marmo_app, upload, monkeypatch):
+    monkeypatch.setattr(marmo_app, 'CLAUDE_CONTACT_SHEET', True)
+    monkeypatch.setattr(marmo_app, 'CONTACT_SHEET_MAX_IMAGES', 4)
+    images = marmo_app.session_data.get(upload(n=5, seed=160))['images']
+    form = {'envType': 'cozinha', 'format': 'l', 'stoneElements': [], 'cutouts': []}
+    content = marmo_app.build_analysis_request(images, form)['messages'][0]['content']
+    assert [block['type'] for block in content] == ['image', 'text']
+    assert 'folha de contato com 4 fotos' in content[1]['text']
+    sheet = Image.open(io.BytesIO(base64.b64decode(content[0]['source']['data'])))
+    assert sheet.size[0] <= CONTACT_SHEET_MAX_SIDE
+
+    # Uma foto só: vai como está, sem folha
+    single = marmo_app.build_analysis_request(images[:1], form)['messages'][0]['content']
+    assert 'folha de contato' not in single[1]['text']
+
+
+def test_blurred_photo_scores_lower():
+    photo = textured(1)
+    sharp = score_image(encode(photo))
+    blurred = score_image(encode(photo.filter(ImageFilter.GaussianBlur(6))))
+    assert blurred['sharpness'] < sharp['sharpness'] / 4
+    assert blurred['score'] < sharp['score']
+
+
+def test_badly_exposed_photo_scores_lower():
+    photo = np.asarray(textured(2), dtype=np.float32)
+    normal = score_image(encode(textured(2)))
+    dark = score_image(encode(Image.fromarray((photo * 0.1).astype(np.uint8))))
+    blown = score_image(encode(Image.fromarray(np.clip(photo * 3, 0, 255).astype(np.uint8))))
+    assert dark['exposure'] < normal['exposure'] and blown['exposure'] < normal['exposure']
+    assert 0.0 <= dark['exposure'] <= 1.0
+
+
+def test_phash_survives_reencoding():
+    photo = textured(3)
+    same = hash_distance(score_image(encode(photo, 95))['phash'],
+                         score_image(encode(photo.resize((240, 180)), 40))['phash'])
+    other = hash_distance(score_image(encode(photo))['phash'],
+                          score_image(encode(textured(4)))['phash'])
+    assert same <= 4 < 20 <= other
+
+
+def test_rank_drops_near_duplicates():
+    photo = textured(5)
+    qualities = [
+        score_image(encode(photo.filter(ImageFilter.GaussianBlur(3)))),  # 0: cópia borrada
+        None,                                                            # 1: sem pontuação
+        score_image(encode(photo)),                                      # 2: melhor cópia
+        score_image(encode(textured(6))),                                # 3: outra foto
+    ]
+    ranking = rank_images(qualities)
+    assert ranking[0] in (2, 3)
+    assert 0 not in ranking
+    assert set(ranking) == {1, 2, 3}
+    assert ranking[-1] == 1
+
+
+def test_upload_ranks_the_session_photos(client, marmo_app):
+    photo = textured(7)
+    files = [(io.BytesIO(encode(photo.filter(ImageFilter.GaussianBlur(3)))), 'borrada.jpg'),
+             (io.BytesIO(encode(photo)), 'nitida.jpg'),
+             (io.BytesIO(jpeg_bytes(170)), 'outra.jpg')]
+    response = client.post('/api/upload', data={'images': files, 'envType': 'cozinha',
+                                                'format': 'l'},
+                           content_type='multipart/form-data')
+    assert response.json['distinct_images'] == 2
+    data = marmo_app.session_data.get(response.json['session_id'])
+    assert 'borrada.jpg' not in [img['filename'] for img in marmo_app.ranked_images(data)]
+    assert all(img['quality']['phash'] for img in data['images'])
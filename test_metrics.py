@@ -0,0 +1,90 @@
+"""
+Testes das métricas (formato de exposição do Prometheus) e do /metrics
+"""
+
+import threading
+
+from metrics import Counter, Gauge, Histogram, Metrics
+
+
+def test_counter_and_labels():
+    counter = Counter('teste_total', 'Contador de teste', ('provider', 'outcome'))
+    counter.inc(provider='claude', outcome='success')
+    counter.inc(2, provider='claude', outcome='success')
+    counter.inc(provider='dall"e', outcome='failure')
+    assert counter.collect() == [
+        '# HELP teste_total Contador de teste',
+        '# TYPE teste_total counter',
+        'teste_total{provider="claude",outcome="success"} 3',
+        'teste_total{provider="dall\\"e",outcome="failure"} 1',
+    ]
+
+
+def test_counter_collect_while_incrementing():
+    counter = Counter('teste_total', 'Contador de teste', ('key',))
+
+    def writer():
+        for i in range(20000):
+            counter.inc(key=str(i))  # chave nova a cada incremento
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    while thread.is_alive():
+        counter.collect()  # sem "dictionary changed size during iteration"
+    thread.join()
+    assert len(counter.collect()) == 20002
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('teste_seconds', 'Histograma de teste', ('stage',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, stage='pdf')
+    lines = histogram.collect()
+    assert 'teste_seconds_bucket{stage="pdf",le="0.1"} 1' in lines
+    assert 'teste_seconds_bucket{stage="pdf",le="1.0"} 3' in lines
+    assert 'teste_seconds_bucket{stage="pdf",le="+Inf"} 4' in lines
+    assert 'teste_seconds_count{stage="pdf"} 4' in lines
+    assert 'teste_seconds_sum{stage="pdf"} 4.25' in lines
+
+
+def test_failing_gauge_is_skipped():
+    def broken():
+        raise RuntimeError('indisponível')
+    assert Gauge('teste', 'Gauge de teste', broken).collect() == ['# HELP teste Gauge de teste',
+                                                                  '# TYPE teste gauge']
+
+
+def test_timed_records_failures():
+    registry = Metrics(prefix='teste')
+
+    @registry.timed('etapa')
+    def fails():
+        raise ValueError
+
+    try:
+        fails()
+    except ValueError:
+        pass
+    assert 'teste_stage_duration_seconds_count{stage="etapa"} 1' in registry.render()
+
+
+def test_metrics_endpoint(client, upload):
+    session_id = upload(n=1, seed=110)
+    assert client.post(f'/api/generate-drawing/{session_id}').status_code == 200
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    assert 'marmoview_stage_duration_seconds_count{stage="upload_parse"}' in body
+    assert 'marmoview_stage_duration_seconds_count{stage="render_drawing"}' in body
+    assert 'marmoview_in_flight{job="generation"} 0' in body
+    assert 'marmoview_sessions ' in body
+
+
+def test_in_flight_counts_only_running_speculative_jobs(client, marmo_app, monkeypatch):
+    from concurrent.futures import Future
+    done, running = Future(), Future()
+    done.set_result({'confidence': 80})
+    monkeypatch.setattr(marmo_app, '_speculative_jobs', {'a': (done, None), 'b': (running, None)})
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'marmoview_in_flight{job="speculative_analysis"} 1' in body
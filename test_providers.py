@@ -0,0 +1,70 @@
+"""
+Testes do registro de provedores: SDKs importados só no primeiro uso e
+verificação de instalação sem import
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from providers import ProviderRegistry
+
+
+def test_client_is_built_once_on_first_use():
+    registry = ProviderRegistry()
+    built = []
+
+    def factory():
+        built.append(1)
+        time.sleep(0.05)
+        return object()
+
+    registry.register('lento', factory, module='json')
+    assert registry.stats() == {'lento': {'installed': True, 'loaded': False, 'load_ms': None}}
+
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(registry.get('lento')))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert len({id(client) for client in clients}) == 1
+    assert registry.stats()['lento']['loaded'] is True
+    assert registry.load_seconds()['lento'] >= 0.05
+
+
+def test_installed_does_not_import():
+    registry = ProviderRegistry()
+    registry.register('ausente', lambda: None, module='pacote_que_nao_existe')
+    assert registry.installed('ausente') is False
+    assert registry.installed('colorsys') is True
+    code = ("import sys\nfrom providers import ProviderRegistry\n"
+            "assert ProviderRegistry().installed('colorsys')\n"
+            "assert 'colorsys' not in sys.modules\n")
+    subprocess.run([sys.executable, '-c', code], check=True,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_app_import_skips_provider_sdks():
+    code = ("import os, sys\n"
+            "os.environ.update(ANTHROPIC_API_KEY='x', OPENAI_API_KEY='x', WARMUP='0')\n"
+            "import app\n"
+            "loaded = [m for m in ('anthropic', 'openai', 'gradio_client', 'reportlab')"
+            " if m in sys.modules]\n"
+            "assert not loaded, loaded\n"
+            "print(sorted(app.providers.stats()))\n")
+    env = dict(os.environ, SESSION_BACKEND='memory', BLOB_BACKEND='memory')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == "['anthropic', 'gradio', 'http', 'openai']"
+
+
+def test_health_reports_providers(client):
+    health = client.get('/api/health').json
+    assert set(health['providers']) == {'anthropic', 'openai', 'gradio', 'http'}
+    assert health['providers']['anthropic']['loaded'] is False
@@ -0,0 +1,68 @@
+"""
+Testes do pool de renderização: saída igual à da thread, worker morto
+(pool recriado, renderização na thread) e timeout
+"""
+
+import time
+
+import pytest
+
+from render_pool import RenderPool, RenderTimeout
+from rendering import build_scene
+
+PNG_MAGIC = b'\x89PNG\r\n\x1a\n'
+
+
+@pytest.fixture(scope='module')
+def scene():
+    drawing = {'title': 'Desenho Conceitual - Cozinha', 'environment': 'Cozinha', 'format': 'Em L',
+               'elements': ['bancada'], 'cutouts': ['pia'], 'characteristics': '',
+               'images_analyzed': 1, 'shapes': [], 'ai_analysis': None, 'notes': []}
+    form = {'envType': 'cozinha', 'format': 'l', 'stoneElements': ['bancada'], 'cutouts': ['pia'],
+            'characteristics': ''}
+    return build_scene(drawing, form, None, 'teste-pool')
+
+
+@pytest.fixture
+def pool():
+    pool = RenderPool(size=1, queue_timeout=5)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_output_matches_inline(pool, scene):
+    inline = RenderPool(size=0).render('drawing', scene=scene)
+    assert inline.startswith(PNG_MAGIC)
+    assert pool.render('drawing', scene=scene) == inline
+    assert pool.stats()['kinds']['drawing']['count'] == 1
+    assert pool.pending() == 0
+
+
+def test_dead_worker_rebuilds_pool_and_renders_inline(pool, scene):
+    expected = pool.render('drawing', scene=scene)
+    broken = pool._executor
+    for process in list(broken._processes.values()):
+        process.kill()
+        process.join()
+
+    assert pool.render('drawing', scene=scene) == expected
+    assert pool.stats()['fallbacks'] == 1
+    assert pool._executor is not broken
+
+    # O pool novo volta a atender
+    assert pool.render('drawing', scene=scene) == expected
+    assert pool._executor is not None
+
+
+def test_render_timeout(scene):
+    pool = RenderPool(size=1, queue_timeout=5, render_timeout=0.001)
+    try:
+        pool.start()
+        with pytest.raises(RenderTimeout):
+            pool.render('drawing', scene=scene)
+        assert pool.pending() == 0
+        pool.render_timeout = None
+        time.sleep(0.5)  # o resultado atrasado é descartado pelo callback
+        assert pool.render('drawing', scene=scene).startswith(PNG_MAGIC)
+    finally:
+        pool.shutdown()
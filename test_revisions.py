@@ -0,0 +1,109 @@
+"""
+Testes das revisões incrementais (PATCH /api/session/<id>): deltas do
+formulário, histórico de versões e conflitos
+"""
+
+import time
+
+import pytest
+
+
+@pytest.fixture
+def drawn(client, upload):
+    """Sessão com o desenho local já gerado"""
+    session_id = upload(n=1, seed=100, cutouts='pia')
+    assert client.post(f'/api/generate-drawing/{session_id}').status_code == 200
+    return session_id
+
+
+def revise(client, session_id, **payload):
+    return client.patch(f'/api/session/{session_id}', json=payload)
+
+
+def test_add_and_remove_cutouts(client, marmo_app, drawn):
+    response = revise(client, drawn, form={'cutouts': {'add': ['cooktop'], 'remove': ['pia']}},
+                      note='troca a pia pelo cooktop')
+    assert response.status_code == 200
+    assert response.json['version'] == 2
+    assert response.json['changes'] == {'cutouts': {'from': ['pia'], 'to': ['cooktop']}}
+    assert response.json['invalidated'] == ['ai_layout', 'drawing']
+    assert response.json['changed_layers']
+
+    data = marmo_app.session_data.get(drawn)
+    assert data['form']['cutouts'] == ['cooktop']
+    assert data['status'] == 'drawing_revised'
+
+    revisions = client.get(f'/api/session/{drawn}/revisions').json['revisions']
+    assert [(r['version'], r['kind']) for r in revisions] == [(1, 'generate'), (2, 'revision')]
+    assert revisions[-1]['note'] == 'troca a pia pelo cooktop'
+
+
+def test_unchanged_delta_keeps_version(client, drawn):
+    response = revise(client, drawn, form={'cutouts': ['pia']})
+    assert response.status_code == 200
+    assert response.json['changes'] == {}
+    assert response.json['version'] == 1
+
+
+@pytest.mark.parametrize('delta', [
+    {'cutouts': {'add': 'cooktop'}},
+    {'cutouts': {'remove': 'pia'}},
+    {'cutouts': {'add': [1]}},
+    {'cutouts': {'adicionar': ['cooktop']}},
+    {'cutouts': 'cooktop'},
+    {'format': ['l']},
+    {'session_id': 'x'},
+    ['cutouts'],
+])
+def test_invalid_delta_is_400(client, marmo_app, drawn, delta):
+    response = revise(client, drawn, form=delta)
+    assert response.status_code == 400
+    data = marmo_app.session_data.get(drawn)
+    assert data['form']['cutouts'] == ['pia']
+    assert data['version'] == 1
+
+
+def test_stale_base_version_is_409(client, drawn):
+    assert revise(client, drawn, form={'format': 'u'}, base_version=1).status_code == 200
+    response = revise(client, drawn, form={'format': 'reto'}, base_version=1)
+    assert response.status_code == 409
+    assert response.json['version'] == 2
+
+
+def test_unknown_session_is_404(client):
+    assert revise(client, 'nao-existe', form={'format': 'u'}).status_code == 404
+
+
+def test_revision_during_generation_is_409(client, marmo_app, drawn):
+    marmo_app.session_data.update(drawn, {'status': 'generating', 'generation_started': time.time()})
+    response = revise(client, drawn, form={'format': 'u'})
+    assert response.status_code == 409
+    assert response.json['status'] == 'generating'
+    assert marmo_app.session_data.get(drawn)['form']['format'] == 'l'
+
+    # Marca abandonada (worker que morreu) não bloqueia a revisão
+    marmo_app.session_data.update(drawn, {'generation_started': time.time() - 10 ** 6})
+    assert revise(client, drawn, form={'format': 'u'}).status_code == 200
+
+
+def test_trimmed_versions_release_their_blobs(client, marmo_app, drawn, monkeypatch):
+    monkeypatch.setattr(marmo_app, 'REVISION_HISTORY_LIMIT', 2)
+    blobs = marmo_app.blob_store
+    first = marmo_app.session_data.get(drawn)
+    old = {first['scene_digest'], first['svg_digest'], first['drawing_digest']}
+    assert client.get(f'/api/generate-pdf/{drawn}').status_code == 200
+    old.add(marmo_app.session_data.get(drawn)['pdf_digest'])
+
+    for fmt in ('u', 'reto', 'ilha'):
+        assert revise(client, drawn, form={'format': fmt}).status_code == 200
+        assert client.get(f'/api/drawing-image/{drawn}').status_code == 200
+
+    data = marmo_app.session_data.get(drawn)
+    assert [r['version'] for r in data['revisions']] == [3, 4]
+    assert all(digest not in blobs for digest in old)
+    for kind in ('scene', 'svg', 'drawing'):
+        assert data[f'{kind}_digest'] in blobs
+    assert all(img['digest'] in blobs for img in data['images'])
+
+    assert client.get(f'/api/drawing-svg/{drawn}?version=1').status_code == 404
+    assert client.get(f'/api/drawing-svg/{drawn}?version=3').status_code == 200
@@ -0,0 +1,94 @@
+"""
+Testes do grafo de cena: construção, SVG, PNG, PDF vetorial e diferença por
+camada entre duas versões do desenho
+"""
+
+import io
+import json
+import xml.etree.ElementTree as ET
+
+import pytest
+from PIL import Image
+
+from scene import Scene, changed_layers, layer_digests, render_png, render_svg, scene_json
+
+SVG = '{http://www.w3.org/2000/svg}'
+
+
+def sample_scene(cutout_x=300):
+    scene = Scene(width=400, height=200)
+    scene.layer('bancada').rect((10, 10, 390, 190), fill=(200, 200, 200), outline=(0, 0, 0), width=2)
+    scene.layer('recortes').ellipse((cutout_x, 50, cutout_x + 60, 110), fill=(40, 40, 200))
+    scene.layer('textos').text((20, 20), 'Pia & cooktop <1>\nsegunda linha', (0, 0, 0), font='nota')
+    scene.layer('cotas').line([20, 180, 380, 180], fill=(255, 0, 0), width=1)
+    scene.regions['desenho'] = [0, 0, 400, 200]
+    return scene.to_dict()
+
+
+def test_scene_is_plain_json():
+    scene = sample_scene()
+    assert json.loads(scene_json(scene)) == scene
+    assert scene['nodes'][0]['fill'] == '#c8c8c8'
+    assert scene['nodes'][3]['points'] == [[20, 180], [380, 180]]
+    assert b' ' not in scene_json({'a': [1, 2]})
+
+
+def test_svg_output():
+    root = ET.fromstring(render_svg(sample_scene()))
+    assert (root.get('width'), root.get('viewBox')) == ('400', '0 0 400 200')
+    ellipse = root.find(f'{SVG}ellipse')
+    assert (ellipse.get('cx'), ellipse.get('rx'), ellipse.get('fill')) == ('330', '30', '#2828c8')
+    text = root.find(f'{SVG}text')
+    assert [span.text for span in text] == ['Pia & cooktop <1>', 'segunda linha']
+    assert root.find(f'{SVG}polyline').get('points') == '20,180 380,180'
+
+
+def test_svg_layer_filter():
+    root = ET.fromstring(render_svg(sample_scene(), layers={'recortes'}))
+    assert [child.tag.replace(SVG, '') for child in root] == ['rect', 'ellipse']  # fundo + recorte
+
+
+def test_png_output():
+    img = Image.open(io.BytesIO(render_png(sample_scene())))
+    assert img.size == (400, 200)
+    assert img.getpixel((330, 80)) == (40, 40, 200)   # recorte
+    assert img.getpixel((200, 150)) == (200, 200, 200)  # bancada
+    assert img.getpixel((5, 5)) == (255, 255, 255)    # fundo
+    only_cutout = Image.open(io.BytesIO(render_png(sample_scene(), layers={'recortes'})))
+    assert only_cutout.getpixel((200, 150)) == (255, 255, 255)
+
+
+def test_changed_layers():
+    old, new = sample_scene(), sample_scene(cutout_x=100)
+    assert changed_layers(old, new) == ['recortes']
+    assert changed_layers(old, sample_scene()) == []
+    assert changed_layers(None, new) == ['bancada', 'cotas', 'recortes', 'textos']
+
+    without_text = dict(new, nodes=[n for n in new['nodes'] if n['layer'] != 'textos'])
+    assert changed_layers(new, without_text) == ['textos']
+    assert set(layer_digests(new)) == {'bancada', 'recortes', 'textos', 'cotas'}
+
+
+def test_pdf_vectors():
+    pytest.importorskip('reportlab')
+    from reportlab.pdfgen import canvas
+    from scene import draw_scene_pdf
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pageCompression=0)
+    draw_scene_pdf(pdf, sample_scene(), 50, 50, 400, 300, region='desenho')
+    pdf.save()
+    content = buffer.getvalue()
+    assert content.startswith(b'%PDF')
+    assert b'(Pia & cooktop <1>) Tj' in content  # texto como texto, não pixels
+    assert b'/Subtype /Image' not in content
+
+
+def test_drawing_svg_endpoint(client, upload):
+    session_id = upload(n=1, seed=180)
+    assert client.post(f'/api/generate-drawing/{session_id}').status_code == 200
+    response = client.get(f'/api/drawing-svg/{session_id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/svg+xml'
+    root = ET.fromstring(response.data)
+    assert root.tag == f'{SVG}svg'
@@ -0,0 +1,234 @@
+"""
+Testes dos backends de sessão: leitura/gravação, expiração, paginação
+por cursor da listagem e chaves auxiliares (idempotência)
+"""
+
+import importlib.util
+import io
+import os
+import subprocess
+import sys
+import threading
+import uuid
+
+import pytest
+
+from session_store import (MemorySessionStore, RedisSessionStore, RespClient, RespError,
+                           SQLiteSessionStore)
+
+
+@pytest.fixture(scope='module')
+def resp_url():
+    """Servidor Redis falso via TCP, para exercitar o RespClient de verdade"""
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'redis://127.0.0.1:%d/0' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis', 'resp'])
+def store(request):
+    if request.param == 'sqlite':
+        return SQLiteSessionStore(':memory:')
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        return RedisSessionStore(client=fakeredis.FakeRedis())
+    if request.param == 'resp':
+        return RedisSessionStore(client=RespClient(request.getfixturevalue('resp_url')),
+                                 prefix=uuid.uuid4().hex)
+    return MemorySessionStore()
+
+
+def session(created_at, status='uploaded', env_type='cozinha', last_access=None):
+    return {'status': status, 'created_at': created_at,
+            'last_access': created_at if last_access is None else last_access,
+            'form': {'envType': env_type}}
+
+
+def all_pages(store, limit, between_pages=None, **filters):
+    ids, cursor, pages = [], None, 0
+    while True:
+        entries, cursor = store.list_sessions(cursor=cursor, limit=limit, **filters)
+        ids.extend(entry['id'] for entry in entries)
+        pages += 1
+        if not cursor:
+            return ids
+        if between_pages:
+            between_pages(pages)
+
+
+def test_save_get_update_delete(store):
+    store.save('s1', session(10))
+    assert store.get('s1')['status'] == 'uploaded'
+    assert 's1' in store and len(store) == 1
+    assert store.update('s1', {'status': 'drawing_created'})['status'] == 'drawing_created'
+    assert store.update('nao-existe', {'status': 'x'}) is None
+    assert store.delete('s1')['status'] == 'drawing_created'
+    assert store.get('s1') is None
+    assert 's1' not in store and len(store) == 0
+
+
+def test_expired_uses_last_access(store):
+    store.save('velha', session(1, last_access=5))
+    store.save('nova', session(2, last_access=50))
+    assert store.expired(10) == ['velha']
+    store.update('velha', {'last_access': 60})
+    assert store.expired(10) == []
+    assert sorted(store.expired(100)) == ['nova', 'velha']
+    store.delete('velha')
+    assert store.expired(100) == ['nova']
+
+
+def test_sqlite_shared_between_store_instances(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    worker_a, worker_b = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    worker_a.save('s1', session(10))
+    worker_b.update('s1', {'status': 'drawing_created'})
+    assert worker_a.get('s1')['status'] == 'drawing_created'
+
+
+def test_redis_shared_between_store_instances():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    worker_a = RedisSessionStore(client=fakeredis.FakeRedis(server=server))
+    worker_b = RedisSessionStore(client=fakeredis.FakeRedis(server=server))
+    worker_a.save('s1', session(10))
+    worker_b.update('s1', {'status': 'drawing_created'})
+    assert worker_a.get('s1')['status'] == 'drawing_created'
+    assert worker_b.expired(100) == ['s1']
+
+
+def test_pagination_newest_first(store):
+    for i in range(10):
+        store.save(f's{i:02d}', session(100 + i))
+    assert all_pages(store, limit=3) == [f's{i:02d}' for i in range(9, -1, -1)]
+
+
+def test_pagination_stable_across_inserts(store):
+    for i in range(10):
+        store.save(f's{i:02d}', session(100 + i))
+
+    def insert_newer(page):
+        # Sessões novas durante a paginação não deslocam as páginas seguintes
+        store.save(f'nova{page}', session(1000 + page))
+
+    ids = all_pages(store, limit=4, between_pages=insert_newer)
+    assert ids == [f's{i:02d}' for i in range(9, -1, -1)]
+
+
+def test_pagination_ties_on_created_at(store):
+    for i in range(7):
+        store.save(f's{i}', session(100))
+    ids = all_pages(store, limit=2)
+    assert sorted(ids) == [f's{i}' for i in range(7)]
+    assert len(ids) == len(set(ids))
+
+
+def test_pagination_filters_and_range(store):
+    for i in range(6):
+        store.save(f'c{i}', session(100 + i, env_type='cozinha'))
+        store.save(f'b{i}', session(100 + i, status='drawing_created', env_type='banheiro'))
+    assert all_pages(store, limit=4, env_type='banheiro') == [f'b{i}' for i in range(5, -1, -1)]
+    assert all_pages(store, limit=4, status='uploaded') == [f'c{i}' for i in range(5, -1, -1)]
+    assert all_pages(store, limit=2, env_type='cozinha', since=102, until=105) == ['c4', 'c3', 'c2']
+
+    store.update('c5', {'status': 'drawing_created'})
+    assert all_pages(store, limit=10, status='uploaded') == [f'c{i}' for i in range(4, -1, -1)]
+    assert store.status_counts() == {'uploaded': 5, 'drawing_created': 7}
+
+
+def test_invalid_cursor(store):
+    with pytest.raises(ValueError):
+        store.list_sessions(cursor='%%%')
+
+
+def test_claim_key_is_first_writer_wins(store):
+    assert store.claim_key('idem:1', {'request_id': 'a'}, 60) == {'request_id': 'a'}
+    assert store.claim_key('idem:1', {'request_id': 'b'}, 60) == {'request_id': 'a'}
+    store.set_key('idem:1', {'request_id': 'a', 'state': 'done'}, 60)
+    assert store.get_key('idem:1')['state'] == 'done'
+    store.delete_key('idem:1')
+    assert store.get_key('idem:1') is None
+    assert store.claim_key('idem:1', {'request_id': 'c'}, 60) == {'request_id': 'c'}
+
+
+def test_memory_keys_expire_without_full_scans(monkeypatch):
+    store = MemorySessionStore()
+    clock = [1000.0]
+    monkeypatch.setattr('session_store.time.time', lambda: clock[0])
+    for i in range(5000):
+        store.claim_key(f'curta:{i}', i, 10)
+    store.claim_key('longa', 'x', 100)
+    store.set_key('curta:0', 'regravada', 100)  # a entrada antiga no heap não a remove
+
+    clock[0] += 50
+    assert store.claim_key('nova', 'y', 10) == 'y'
+    assert set(store._keys) == {'longa', 'curta:0', 'nova'}
+    assert store.get_key('curta:0') == 'regravada'
+    assert len(store._key_expiry) == 3
+
+
+def test_redis_save_is_one_transaction(resp_url, monkeypatch):
+    client = RespClient(resp_url)
+    store = RedisSessionStore(client=client, prefix=uuid.uuid4().hex)
+    store.save('s1', session(10))
+    batches = []
+    original = client._roundtrip
+
+    def roundtrip(commands):
+        batches.append([args[0] for args in commands])
+        return original(commands)
+
+    monkeypatch.setattr(client, '_roundtrip', roundtrip)
+    store.update('s1', {'status': 'drawing_generated'})
+    # GET da sessão, HGET da entrada antiga e um MULTI/EXEC com todas as escritas
+    assert [batch[0] for batch in batches] == ['GET', 'HGET', 'MULTI']
+    assert batches[-1][-1] == 'EXEC'
+    assert [e['id'] for e in store.list_sessions(status='drawing_generated')[0]] == ['s1']
+    assert store.list_sessions(status='uploaded')[0] == []
+
+
+def test_resp_pipeline_errors(resp_url, monkeypatch):
+    client = RespClient(resp_url)
+    key = uuid.uuid4().hex
+    pipe = client.pipeline()
+    pipe.set(key, 'b')
+    pipe.sadd(key + ':set', 'x', 'y')
+    assert pipe.execute() == [b'OK', 2]
+    assert client.get(key) == b'b'
+
+    # Erro dentro do EXEC: lido sem dessincronizar o restante da resposta
+    reader = io.BytesIO(b'*3\r\n+OK\r\n-ERR value is not an integer\r\n:1\r\n+PONG\r\n')
+    reply = client._read(reader)
+    assert isinstance(reply[1], RespError) and reply[2] == 1
+    assert client._read(reader) == b'PONG'
+
+    monkeypatch.setattr(client, '_roundtrip', lambda commands: [b'OK', reply])
+    pipe = client.pipeline()
+    pipe.set(key, 'c')
+    with pytest.raises(RespError, match='not an integer'):
+        pipe.execute()
+
+    # Erro ao enfileirar: EXEC abortado, vale o primeiro erro
+    monkeypatch.setattr(client, '_roundtrip', lambda commands: [
+        b'OK', b'QUEUED', RespError('ERR unknown command'), RespError('EXECABORT')])
+    pipe.set(key, 'c')
+    pipe.execute_command('COMANDO-INEXISTENTE')
+    with pytest.raises(RespError, match='unknown command'):
+        pipe.execute()
+
+
+def test_redis_is_imported_only_by_the_redis_backend():
+    code = ("import sys, session_store\n"
+            "session_store.create_session_store('memory')\n"
+            "assert 'redis' not in sys.modules\n"
+            "store = session_store.RedisSessionStore('redis://127.0.0.1:1/0')\n"
+            "print(type(store._client).__module__.split('.')[0])\n")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0, result.stderr
+    installed = importlib.util.find_spec('redis') is not None
+    assert result.stdout.strip() == ('redis' if installed else 'session_store')
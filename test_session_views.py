@@ -0,0 +1,84 @@
+"""
+Testes das leituras de sessão: projeção por campos, resumo para polling,
+snapshot estável e bytes nunca serializados no JSON
+"""
+
+import pytest
+
+from session_store import MemorySessionStore
+
+
+@pytest.fixture
+def drawn(client, upload):
+    session_id = upload(n=2, seed=200)
+    assert client.post(f'/api/generate-drawing/{session_id}').status_code == 200
+    return session_id
+
+
+def test_projected_fields(client, marmo_app, drawn):
+    data = marmo_app.session_data.get(drawn)
+    response = client.get(f'/api/session/{drawn}?fields=status,drawing.title,images.1.digest,'
+                          'form.cutouts,nao.existe,images.9.digest')
+    assert response.json == {
+        'status': 'drawing_created',
+        'drawing.title': data['drawing']['title'],
+        'images.1.digest': data['images'][1]['digest'],
+        'form.cutouts': data['form']['cutouts'],
+    }
+
+
+def test_projected_images_are_light(client, drawn):
+    images = client.get(f'/api/session/{drawn}?fields=images').json['images']
+    assert len(images) == 2
+    assert set(images[0]) == {'filename', 'digest', 'width', 'height', 'quality'}
+
+
+def test_summary_view(client, marmo_app, drawn):
+    assert client.get(f'/api/generate-pdf/{drawn}').status_code == 200
+    summary = client.get(f'/api/session/{drawn}?view=summary').json
+    data = marmo_app.session_data.get(drawn)
+    assert summary['session_id'] == drawn
+    assert summary['status'] == data['status']
+    assert [img['digest'] for img in summary['images']] == [img['digest'] for img in data['images']]
+    assert summary['drawing']['title'] == data['drawing']['title']
+
+    blobs = marmo_app.blob_store
+    for kind in ('drawing', 'svg', 'pdf', 'scene'):
+        artifact = summary['artifacts'][kind]
+        assert artifact['digest'] == data[f'{kind}_digest']
+        assert artifact['bytes'] == len(blobs.get(artifact['digest']))
+    assert summary['artifacts']['pdf']['url'] == f'/api/generate-pdf/{drawn}'
+    assert summary['artifacts']['scene']['url'] is None
+
+
+def test_summary_reads_no_blobs(client, marmo_app, drawn, monkeypatch):
+    def no_blob_reads(*args):
+        raise AssertionError('o resumo não deve ler o blob store')
+
+    monkeypatch.setattr(marmo_app.blob_store, 'get', no_blob_reads)
+    assert client.get(f'/api/session/{drawn}?view=summary').status_code == 200
+
+
+def test_full_view_hides_image_records(client, drawn):
+    data = client.get(f'/api/session/{drawn}').json
+    assert set(data['images'][0]) == {'filename', 'digest', 'width', 'height', 'quality'}
+
+
+def test_bytes_are_never_serialized(client, marmo_app, drawn):
+    marmo_app.session_data.update(drawn, {'legado': b'\x89PNG' + b'\x00' * 96})
+    assert client.get(f'/api/session/{drawn}?fields=legado').json == {'legado': {'bytes': 100}}
+
+
+def test_unknown_session_is_404(client):
+    assert client.get('/api/session/nao-existe?view=summary').status_code == 404
+
+
+def test_memory_snapshot_is_a_stable_copy():
+    store = MemorySessionStore()
+    store.save('s1', {'status': 'uploaded', 'created_at': 1, 'form': {}})
+    snapshot = store.snapshot('s1')
+    live = store.get('s1')
+    live['status'] = 'generating'
+    live['novo'] = True
+    assert snapshot == {'status': 'uploaded', 'created_at': 1, 'form': {}}
+    assert store.snapshot('nao-existe') is None
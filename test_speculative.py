@@ -0,0 +1,104 @@
+"""
+Testes da análise especulativa: disparada no upload, reaproveitada na
+geração, limitada por cliente (IP) e descartada quando ninguém a reivindica
+"""
+
+import io
+import threading
+import time
+
+import pytest
+
+from conftest import jpeg_bytes
+
+ANALYSIS = {'layout_analysis': 'parede lisa', 'confidence': 90}
+
+
+@pytest.fixture
+def claude(marmo_app, monkeypatch):
+    """Claude Vision "configurado": cada chamada espera `release` e retorna ANALYSIS"""
+    calls = []
+    release = threading.Event()
+    release.set()
+
+    def analyze(images, form):
+        calls.append(form['envType'])
+        release.wait(5)
+        return dict(ANALYSIS)
+
+    monkeypatch.setattr(marmo_app, 'SPECULATIVE_ANALYSIS', True)
+    monkeypatch.setattr(marmo_app, 'HAS_CLAUDE_VISION', True)
+    monkeypatch.setattr(marmo_app, 'analyze_images_with_claude', analyze)
+    return calls, release
+
+
+def jpeg(seed):
+    return io.BytesIO(jpeg_bytes(seed))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_generation_reuses_speculative_analysis(client, marmo_app, claude):
+    calls, _release = claude
+    response = client.post('/api/upload', data={'envType': 'cozinha', 'format': 'l',
+                                                'images': [(jpeg(120), 'a.jpg')]},
+                           content_type='multipart/form-data')
+    assert response.json['analysis_started'] is True
+    session_id = response.json['session_id']
+
+    # Concluída e não reivindicada: o future sai da tabela, o resultado fica na sessão
+    wait_for(lambda: session_id not in marmo_app._speculative_jobs)
+    assert marmo_app.session_data.get(session_id)['speculative_analysis'] == ANALYSIS
+
+    generated = client.post(f'/api/generate-drawing/{session_id}')
+    assert generated.status_code == 200
+    assert generated.json['ai_analysis'] == ANALYSIS
+    assert calls == ['cozinha']
+
+
+def test_generation_waits_for_running_analysis(client, marmo_app, claude, upload):
+    calls, release = claude
+    release.clear()
+    session_id = upload(n=1, seed=121)
+    assert session_id in marmo_app._speculative_jobs
+    threading.Timer(0.2, release.set).start()
+    generated = client.post(f'/api/generate-drawing/{session_id}')
+    assert generated.json['ai_analysis'] == ANALYSIS
+    assert len(calls) == 1
+    assert session_id not in marmo_app._speculative_jobs
+
+
+def test_limit_is_per_client_ip(client, marmo_app, claude, monkeypatch):
+    _calls, release = claude
+    release.clear()
+    monkeypatch.setattr(marmo_app, 'SPECULATIVE_PER_TENANT', 1)
+
+    def post(seed, **kwargs):
+        return client.post('/api/upload', data={'envType': 'cozinha', 'format': 'l',
+                                                'images': [(jpeg(seed), 'a.jpg')]},
+                           content_type='multipart/form-data', **kwargs).json
+
+    first = post(130)
+    try:
+        assert first['analysis_started'] is True
+        assert post(131, headers={'X-Tenant-Id': 'outro'})['analysis_started'] is False
+        assert post(132, environ_base={'REMOTE_ADDR': '10.0.0.7'})['analysis_started'] is True
+    finally:
+        release.set()
+    wait_for(lambda: not marmo_app._speculative_by_tenant)
+
+
+def test_evicted_session_cancels_analysis(marmo_app, claude, upload):
+    _calls, release = claude
+    release.clear()
+    session_id = upload(n=1, seed=140)
+    marmo_app.evict_session(session_id)
+    release.set()
+    assert session_id not in marmo_app._speculative_jobs
+    wait_for(lambda: not marmo_app._speculative_by_tenant)
+    assert marmo_app.session_data.get(session_id) is None
@@ -0,0 +1,69 @@
+"""
+Testes do trace por requisição: spans, header Server-Timing, bloco debug e
+buffer dos traces lentos (/api/admin/slow-traces)
+"""
+
+import time
+
+import tracing
+
+
+def test_spans_and_server_timing():
+    trace, token = tracing.start('teste')
+    with tracing.span('layout'):
+        time.sleep(0.01)
+    with tracing.span('layout'):
+        pass
+    with tracing.span('hf upload'):
+        pass
+    assert tracing.end(token) is trace
+    assert tracing.current() is None
+
+    items = trace.server_timing().split(', ')
+    assert [item.split(';')[0] for item in items] == ['layout', 'hf_upload', 'total']
+    assert float(items[0].split('dur=')[1]) >= 10
+    assert [span['name'] for span in trace.to_dict()['spans']] == ['layout', 'layout', 'hf upload']
+
+
+def test_span_without_trace_is_ignored():
+    with tracing.span('solto'):
+        pass
+    assert tracing.current() is None
+
+
+def test_slow_log_keeps_recent_slow_traces():
+    log = tracing.SlowTraceLog(threshold=0.5, size=2)
+    for name, duration in [('a', 1.0), ('rapido', 0.1), ('b', 2.0), ('c', 0.5)]:
+        trace = tracing.Trace(name)
+        trace.duration = duration
+        log.record(trace)
+    assert [t['name'] for t in log.recent()] == ['c', 'b']
+    assert [t['name'] for t in log.recent(1)] == ['c']
+
+
+def test_generation_response_has_server_timing(client, upload):
+    session_id = upload(n=1, seed=190)
+    response = client.post(f'/api/generate-drawing/{session_id}?debug=1')
+    names = [item.split(';')[0] for item in response.headers['Server-Timing'].split(', ')]
+    assert 'layout' in names and names[-1] == 'total'
+    trace = response.json['debug']['trace']
+    assert trace['tags'] == {'session_id': session_id, 'status': 200}
+    assert 'debug' not in client.get('/api/health?debug=1').json
+    assert 'Server-Timing' not in client.get('/api/health').headers
+
+
+def test_slow_traces_admin_route(client, marmo_app, upload, admin, monkeypatch):
+    monkeypatch.setattr(marmo_app, 'slow_traces', tracing.SlowTraceLog(threshold=0.0))
+    session_id = upload(n=1, seed=191)
+    client.post(f'/api/generate-drawing/{session_id}')
+
+    assert client.get('/api/admin/slow-traces').status_code == 401
+    response = client.get('/api/admin/slow-traces?limit=1', headers=admin)
+    assert response.status_code == 200
+    assert response.json['threshold_seconds'] == 0.0
+    [trace] = response.json['traces']
+    assert trace['tags']['session_id'] == session_id
+
+
+def test_slow_traces_disabled_without_token(client):
+    assert client.get('/api/admin/slow-traces').status_code == 404
@@ -0,0 +1,59 @@
+"""
+Testes do aquecimento em segundo plano e da readiness (/api/ready)
+"""
+
+import pytest
+
+
+@pytest.fixture
+def pending(marmo_app, monkeypatch):
+    """Worker recém-iniciado: aquecimento ainda não executado"""
+    state = {'state': 'pending', 'steps': {}, 'errors': []}
+    monkeypatch.setattr(marmo_app, 'warmup_state', state)
+    return state
+
+
+def test_ready_without_warmup(client):
+    response = client.get('/api/ready')
+    assert response.status_code == 200
+    assert response.json['ready'] is True
+
+
+def test_not_ready_until_warmup_finishes(client, marmo_app, pending):
+    response = client.get('/api/ready')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert client.get('/api/health').status_code == 200  # liveness não depende do aquecimento
+
+    marmo_app.run_warmup()
+    assert pending['state'] == 'done'
+    assert set(pending['steps']) == {'fonts', 'layouts', 'render'}
+    response = client.get('/api/ready')
+    assert response.status_code == 200
+    assert response.json['warmup']['seconds'] >= 0
+
+
+def test_failed_required_step_keeps_worker_unready(client, marmo_app, pending, monkeypatch):
+    def broken():
+        raise RuntimeError('fonte corrompida')
+
+    monkeypatch.setattr(marmo_app, 'preload_fonts', broken)
+    marmo_app.run_warmup()
+    assert pending['state'] == 'failed'
+    assert pending['errors'] == ['fonts: fonte corrompida']
+    assert client.get('/api/ready').status_code == 503
+
+
+def test_unreachable_provider_does_not_block_readiness(client, marmo_app, pending, monkeypatch):
+    def unreachable():
+        raise ConnectionError('sem rede')
+
+    monkeypatch.setattr(marmo_app, '_warmup_render', lambda: None)
+    monkeypatch.setattr(marmo_app, '_warmup_providers', unreachable)
+    monkeypatch.setattr(marmo_app, 'WARMUP_PROVIDERS', True)
+    monkeypatch.setattr(marmo_app, 'HAS_CLAUDE_VISION', True)
+    marmo_app.run_warmup()
+    assert pending['state'] == 'done'
+    assert pending['errors'] == ['providers: sem rede']
+    assert 'providers' not in pending['steps']
+    assert client.get('/api/ready').status_code == 200
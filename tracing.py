@@ -0,0 +1,124 @@
+"""
+MarmoView - Trace por requisição (spans leves)
+Cada requisição rastreada ganha um Trace no contextvar corrente; as etapas
+medidas (metrics.time_stage, provedores) e os blocos `span(...)` viram spans
+com início relativo e duração. O trace sai no header Server-Timing (visível
+no devtools do navegador), opcionalmente no bloco `debug` da resposta JSON, e
+os lentos ficam num buffer circular (SlowTraceLog).
+
+O contextvar acompanha corrotinas submetidas ao núcleo assíncrono; trabalho
+enviado a pools de threads/processos só aparece pelo span de quem espera.
+"""
+
+import contextvars
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+_current = contextvars.ContextVar('marmoview_trace', default=None)
+
+
+class Trace:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []  # (nome, início relativo, duração) em segundos
+        self.tags = {}
+
+    def add(self, name, started, duration):
+        """Registra um span iniciado em `started` (perf_counter) com `duration` segundos"""
+        self.spans.append((name, started - self.started, duration))
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+        return self
+
+    def server_timing(self):
+        """Valor do header Server-Timing: um item por span (repetidos somados) e o total"""
+        totals = {}
+        for name, _offset, duration in list(self.spans):
+            totals[name] = totals.get(name, 0.0) + duration
+        items = [f"{_token(name)};dur={duration * 1000:.1f}" for name, duration in totals.items()]
+        items.append(f"total;dur={(self.duration or 0) * 1000:.1f}")
+        return ', '.join(items)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'at': self.at,
+            'total_ms': round((self.duration or 0) * 1000, 1),
+            'tags': dict(self.tags),
+            'spans': [{'name': name, 'start_ms': round(offset * 1000, 1),
+                       'duration_ms': round(duration * 1000, 1)}
+                      for name, offset, duration in list(self.spans)],
+        }
+
+
+def _token(name):
+    # Nomes do Server-Timing são tokens HTTP (sem espaços nem separadores)
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+
+
+def start(name):
+    """Abre um trace e o torna o corrente; retorna (trace, token para `end`)"""
+    trace = Trace(name)
+    return trace, _current.set(trace)
+
+
+def end(token):
+    """Encerra o trace corrente e restaura o anterior"""
+    trace = _current.get()
+    _current.reset(token)
+    return trace.finish() if trace is not None else None
+
+
+def current():
+    return _current.get()
+
+
+def add_span(name, started, duration):
+    """Acrescenta um span ao trace corrente (sem trace, não faz nada)"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, started, duration)
+
+
+@contextmanager
+def span(name):
+    """Mede o bloco como um span do trace corrente"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, started, time.perf_counter() - started)
+
+
+class SlowTraceLog:
+    """Buffer circular dos últimos traces com duração >= threshold segundos"""
+
+    def __init__(self, threshold=5.0, size=100):
+        self.threshold = threshold
+        self._traces = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        if trace.duration is None or trace.duration < self.threshold:
+            return False
+        with self._lock:
+            self._traces.append(trace.to_dict())
+        return True
+
+    def recent(self, limit=None):
+        """Traces lentos, do mais recente para o mais antigo"""
+        with self._lock:
+            traces = list(self._traces)
+        traces.reverse()
+        return traces[:limit] if limit else traces
@@ -0,0 +1,64 @@
+"""
+MarmoView - ZIP gerado em streaming
+O zipfile escreve num destino sem seek (tamanhos e CRC vão no descritor de
+dados após cada entrada); cada `add` devolve os bytes do arquivo à medida que
+são produzidos, em pedaços de CHUNK_SIZE. Só o pedaço corrente e o diretório
+central (uma linha por entrada) ficam em memória, nunca o arquivo inteiro.
+"""
+
+import time
+import zipfile
+
+CHUNK_SIZE = 256 * 1024
+
+
+class _Sink:
+    """Destino do zipfile: acumula o que foi escrito até o próximo `drain`"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStream:
+    def __init__(self):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w')
+        self.names = []
+
+    def add(self, name, data, compress=False):
+        """
+        Acrescenta a entrada `name` com `data` (bytes, memoryview ou mmap) e
+        gera os bytes do ZIP produzidos. Fotos, PNG e PDF já são comprimidos:
+        só vale comprimir (compress=True) texto/JSON.
+        """
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        view = memoryview(data)
+        with self._zip.open(info, 'w') as entry:
+            for offset in range(0, len(view), CHUNK_SIZE):
+                entry.write(view[offset:offset + CHUNK_SIZE])
+                chunk = self._sink.drain()
+                if chunk:
+                    yield chunk
+        self.names.append(name)
+        chunk = self._sink.drain()
+        if chunk:
+            yield chunk
+
+    def close(self):
+        """Fecha o arquivo e retorna o diretório central"""
+        self._zip.close()
+        return self._sink.drain()